@@ -1,6 +1,7 @@
 function conn_1stlevel_ttest()
 % First-level t-test for CONN
 % make sure to cd to the firstlevel folder in your CONN project before running this script
+% See also conn_1stlevel_ttest_roi.py for the same t-test on the ROI-to-ROI results (resultsROI_*.mat), for many contrasts at once
 % By Alfonso Nieto-Castanon and Stephen Karl Larroque
 % From an original script here: https://www.nitrc.org/forum/message.php?msg_id=10082
 % Compatibility tested with MATLAB R2011a and R2018b
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# conn_1stlevel_ttest_roi.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Batched ROI-to-ROI first-level t-tests for CONN
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: first-level t-tests on the ROI-to-ROI connectivity of CONN (resultsROI_SubjectXXX_ConditionYYY.mat files in the firstlevel folder of a CONN project), for any number of contrasts at once, with FDR correction, same test as conn_1stlevel_ttest.m (which does it voxel-wise on the BETA maps, for one hand-edited pair of conditions per run).
+#
+# All the resultsROI_*.mat files are read in parallel threads, but only their Z (Fisher-transformed correlations, sources x targets), DOF and ROI names variables. They are stacked in one array, and all the contrasts are then evaluated over all ROI pairs at once with a matrix product: the difference of Fisher z is weighted by the contrast, divided by its standard error sqrt(sum(w^2 / (DOF - 3))), and converted to two-sided p-values, which are FDR corrected (Benjamini-Hochberg, as conn_fdr) per seed (each source row, as conn_1stlevel_ttest.m does per source) or over the whole analysis.
+#
+# Contrasts are given as condition:weight lists (eg, Subject037_Condition001:-1,Subject038_Condition001:1), in a text file with one contrast per line, or generated with --all-pairs for all pairs of conditions of each subject.
+#
+# Results are saved as one table with one row per contrast and ROI pair (CSV, or Parquet with pandas and pyarrow), and one ROI_<contrast>.mat file per contrast with the matrices (diff, z, p, pFDR, names, names2) to load in MATLAB.
+#
+# Usage:
+#   python conn_1stlevel_ttest_roi.py -i /path/to/conn_project/results/firstlevel/SBC_01 -c Subject037_Condition001:-1,Subject038_Condition001:1
+#   python conn_1stlevel_ttest_roi.py -i /path/to/firstlevel/SBC_01 --all-pairs -o /path/to/results
+#
+# Required libraries: numpy, scipy. Optional: pandas + pyarrow for Parquet tables.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import itertools
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import stats
+from scipy.io import loadmat, savemat
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Filenames of the CONN first-level ROI-to-ROI results
+RESULTS_REGEX = re.compile(r'^resultsROI_(Subject\d+)_(Condition\d+)\.mat$')
+# Variables read from the resultsROI_*.mat files (the others, such as the regressors, are not loaded)
+RESULTS_VARIABLES = ['Z', 'DOF', 'names', 'names2']
+# Columns of the results table, in order
+COLUMNS = ['contrast', 'source', 'target', 'diff', 'z', 'p', 'pFDR', 'significant']
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def find_results(firstlevel):
+    '''Find all resultsROI_SubjectXXX_ConditionYYY.mat files. Returns a dict {SubjectXXX_ConditionYYY: path}.'''
+    found = {}
+    for f in sorted(os.listdir(firstlevel)):
+        m = RESULTS_REGEX.match(f)
+        if m:
+            found['%s_%s' % (m.group(1), m.group(2))] = os.path.join(firstlevel, f)
+    return found
+
+def read_results(filepath):
+    '''Read only the Z matrix, DOF and ROI names of a resultsROI_*.mat file'''
+    mat = loadmat(filepath, variable_names=RESULTS_VARIABLES, squeeze_me=True)
+    if 'Z' not in mat or 'DOF' not in mat:
+        raise ValueError('%s does not contain the Z and DOF variables, is it a CONN resultsROI file?' % filepath)
+    names = [str(n) for n in np.atleast_1d(mat.get('names', []))]
+    names2 = [str(n) for n in np.atleast_1d(mat.get('names2', []))]
+    return np.atleast_2d(np.asarray(mat['Z'], dtype=np.float64)), float(np.asarray(mat['DOF']).ravel()[0]), names, names2
+
+def load_stack(filepaths, jobs=16):
+    '''Read all the results files in threads and stack their Z matrices in one (nfiles, nsources, ntargets) array. Returns (Z, DOF, names, names2).'''
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(read_results, filepaths))
+    shapes = set(r[0].shape for r in results)
+    if len(shapes) > 1:
+        raise ValueError('The resultsROI files do not all have the same number of sources and targets: %s' % sorted(shapes))
+    Z = np.stack([r[0] for r in results])
+    DOF = np.array([r[1] for r in results])
+    names, names2 = results[0][2], results[0][3]
+    if not names:
+        names = ['Source%03d' % (i + 1) for i in range(Z.shape[1])]
+    if not names2:
+        names2 = ['Target%03d' % (i + 1) for i in range(Z.shape[2])]
+    return Z, DOF, names, names2
+
+def parse_contrast(s):
+    '''Parse a contrast string such as "Subject037_Condition001:-1,Subject038_Condition001:1" into a list of (condition, weight)'''
+    contrast = []
+    for part in s.replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        cond, _, weight = part.rpartition(':')
+        if not cond:
+            raise ValueError('Invalid contrast term "%s", expected Subject<XXX>_Condition<YYY>:<weight>' % part)
+        contrast.append((cond.strip(), float(weight)))
+    return contrast
+
+def contrast_name(contrast):
+    '''Name of a contrast, as in conn_1stlevel_ttest.m (eg, -1xSubject037_Condition001_1xSubject038_Condition001)'''
+    return '_'.join('%gx%s' % (w, c) for c, w in contrast)
+
+def all_pairs(conds):
+    '''Contrasts [-1 1] between all pairs of conditions of each subject'''
+    bysubject = {}
+    for c in sorted(conds):
+        bysubject.setdefault(c.split('_')[0], []).append(c)
+    return [[(a, -1.0), (b, 1.0)] for subj in sorted(bysubject) for a, b in itertools.combinations(bysubject[subj], 2)]
+
+def fdr(p, axis=-1):
+    '''Benjamini-Hochberg FDR-corrected p-values along an axis, ignoring NaNs (same as conn_fdr), vectorized over the other axes'''
+    p = np.moveaxis(np.asarray(p, dtype=np.float64), axis, -1)
+    order = np.argsort(p, axis=-1) # NaNs are sorted last
+    ps = np.take_along_axis(p, order, axis=-1)
+    n = (~np.isnan(p)).sum(axis=-1, keepdims=True)
+    ranks = np.arange(1, p.shape[-1] + 1)
+    q = ps * n / ranks
+    # Cumulative minimum from the largest p-value down (NaNs stay NaN at the end)
+    q = np.flip(np.fmin.accumulate(np.flip(np.where(np.isnan(q), np.inf, q), axis=-1), axis=-1), axis=-1)
+    q = np.minimum(q, 1)
+    q[ranks > n] = np.nan
+    out = np.empty_like(q)
+    np.put_along_axis(out, order, q, axis=-1)
+    return np.moveaxis(out, -1, axis)
+
+def ttests(Z, DOF, W, fdr_scope='seed'):
+    '''Evaluate all contrasts (rows of W, weights per file) over all ROI pairs at once.
+    Returns (diff, z, p, pFDR) arrays of shape (ncontrasts, nsources, ntargets).'''
+    nfiles, nsources, ntargets = Z.shape
+    diff = W.dot(Z.reshape(nfiles, -1)).reshape(-1, nsources, ntargets)
+    # Standard error of the weighted difference of Fisher z, each with a variance of 1/(DOF-3)
+    with np.errstate(divide='ignore'):
+        var = 1.0 / np.maximum(0, DOF - 3)
+    se = np.sqrt((W ** 2).dot(var)).reshape(-1, 1, 1)
+    z = diff / se
+    p = 2 * stats.norm.sf(np.abs(z)) # two-sided p-values
+    if fdr_scope == 'seed':
+        pFDR = fdr(p, axis=-1)
+    else:
+        pFDR = fdr(p.reshape(p.shape[0], -1), axis=-1).reshape(p.shape)
+    return diff, z, p, pFDR
+
+def write_table(rows, outpath):
+    '''Write the rows to a CSV file, or to a Parquet file if the extension is .parquet (needs pandas and pyarrow)'''
+    if outpath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to write Parquet files, please pip install pandas pyarrow or use a .csv output.')
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(outpath, index=False)
+    else:
+        with open(outpath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Batched ROI-to-ROI first-level t-tests for CONN v%s
+Description: Compare the ROI-to-ROI connectivity (Fisher z) between conditions/subjects of a CONN first-level analysis for many contrasts at once, with FDR correction, same test as conn_1stlevel_ttest.m but on the resultsROI_*.mat files.
+    ''' % __version__
+    ep = '''The p-values are two-sided. Contrasts can be given several times with -c, and/or in a file with --contrasts-file (one contrast per line), and/or with --all-pairs.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the CONN first-level analysis folder (eg, conn_project/results/firstlevel/SBC_01) containing the resultsROI_*.mat files.')
+    main_parser.add_argument('-c', '--contrast', metavar='Subject037_Condition001:-1,Subject038_Condition001:1', type=str, action='append', required=False, default=[],
+                        help='Contrast as a list of condition:weight, can be given several times.')
+    main_parser.add_argument('--contrasts-file', metavar='contrasts.txt', type=str, required=False, default=None,
+                        help='Text file with one contrast per line (same syntax as -c, lines starting with # are ignored).')
+    main_parser.add_argument('--all-pairs', action='store_true', required=False, default=False,
+                        help='Add the contrasts [-1 1] between all pairs of conditions of each subject.')
+    main_parser.add_argument('--threshold', metavar='0.05', type=float, required=False, default=0.05,
+                        help='p-FDR threshold (default: 0.05).')
+    main_parser.add_argument('--fdr-scope', type=str, choices=['seed', 'analysis'], required=False, default='seed',
+                        help='FDR correction per seed (each source ROI, default, as conn_1stlevel_ttest.m per source) or over all ROI pairs.')
+    main_parser.add_argument('-o', '--output', metavar='/some/path', type=str, required=False, default=None,
+                        help='Folder where to save the results (default: the input folder).')
+    main_parser.add_argument('-t', '--table', metavar='roi_ttests.csv', type=str, required=False, default='roi_ttests.csv',
+                        help='Filename of the results table in the output folder (.csv or .parquet, default: roi_ttests.csv).')
+    main_parser.add_argument('--no-mat', action='store_true', required=False, default=False,
+                        help='Do not save the ROI_<contrast>.mat matrices files.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=16,
+                        help='Number of threads to read the results files (default: 16).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    outdir = fullpath(args.output) if args.output else inputpath
+
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    #### Main program
+    results = find_results(inputpath)
+    print('== Found %i resultsROI files in %s' % (len(results), inputpath))
+    contrasts = [parse_contrast(c) for c in args.contrast]
+    if args.contrasts_file:
+        with open(args.contrasts_file, 'r') as f:
+            contrasts.extend(parse_contrast(line) for line in f if line.strip() and not line.strip().startswith('#'))
+    if args.all_pairs:
+        contrasts.extend(all_pairs(results))
+    if not contrasts:
+        main_parser.error('no contrast specified, use -c, --contrasts-file or --all-pairs')
+    missing = sorted(set(c for contrast in contrasts for c, _ in contrast if c not in results))
+    if missing:
+        raise NameError('Conditions not found in %s: %s' % (inputpath, ', '.join(missing)))
+
+    # Load only the results files used by the contrasts
+    conds = sorted(set(c for contrast in contrasts for c, _ in contrast))
+    Z, DOF, names, names2 = load_stack([results[c] for c in conds], jobs=args.jobs)
+    index = {c: i for i, c in enumerate(conds)}
+    W = np.zeros((len(contrasts), len(conds)))
+    for ic, contrast in enumerate(contrasts):
+        for c, w in contrast:
+            W[ic, index[c]] += w
+    print('== Computing %i contrasts over %i x %i ROI pairs...' % (len(contrasts), Z.shape[1], Z.shape[2]))
+    diff, z, p, pFDR = ttests(Z, DOF, W, args.fdr_scope)
+
+    rows = []
+    for ic, contrast in enumerate(contrasts):
+        cname = contrast_name(contrast)
+        valid = ~np.isnan(p[ic])
+        for isrc, itgt in zip(*np.nonzero(valid)):
+            rows.append({'contrast': cname, 'source': names[isrc], 'target': names2[itgt],
+                         'diff': diff[ic, isrc, itgt], 'z': z[ic, isrc, itgt], 'p': p[ic, isrc, itgt], 'pFDR': pFDR[ic, isrc, itgt],
+                         'significant': int(pFDR[ic, isrc, itgt] < args.threshold)})
+        if not args.no_mat:
+            savemat(os.path.join(outdir, 'ROI_%s.mat' % cname), {'diff': diff[ic], 'z': z[ic], 'p': p[ic], 'pFDR': pFDR[ic],
+                    'names': np.array(names, dtype=object), 'names2': np.array(names2, dtype=object), 'contrast': cname, 'threshold': args.threshold})
+        print('-> %s: %i significant ROI pairs (p-FDR < %g)' % (cname, int(np.nansum(pFDR[ic] < args.threshold)), args.threshold))
+    tablepath = os.path.join(outdir, args.table)
+    write_table(rows, tablepath)
+    print('== Results table saved in %s' % tablepath)
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# motion_qc.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Motion QC: framewise displacement and paginated plots
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: load all the SPM realignment parameters files (rp_*.txt) of a dataset, compute the motion summary of each session (framewise displacement as in Power et al. 2012, max and mean translation and rotation, fraction of volumes over the FD threshold) in a table to drive subjects exclusion, and render the motion plots as paginated PNG/PDF reports.
+#
+# This is a headless alternative to movvis.m, which loads each rp_*.txt with importdata, plots in interactive figures and waits for a keypress every maxelt subjects. Here all the files are loaded at once (in threads) in one NumPy array with the offset of each file, so that all metrics are computed in vectorized form for the whole dataset, and the pages of plots are rendered in parallel processes with the Agg backend (no display needed, works over SSH or on a cluster).
+#
+# The summary table (CSV, or Parquet with pandas and pyarrow) also acts as a cache: files whose size and mtime did not change are not loaded again (unless plots are requested), and the exclusion flags are recomputed at each run from the thresholds given on the commandline, so it is cheap to try different exclusion criteria.
+#
+# The folders tree is the same as for movvis.m: Condition/Subject/data/Session/modality/rp_*.txt, where the session and modality folders are optional. The mprage and JOBS folders are skipped.
+#
+# Usage:
+#   python motion_qc.py -i /root_pth -o /path/to/qc                       # summary table and plots of all sessions
+#   python motion_qc.py -i /root_pth -o /path/to/qc --no-plots --max-trans 2 --max-rot 2   # only update the summary with stricter criteria
+#   python motion_qc.py -i /root_pth/cond/subj/data/rest/rp_fmri.txt -o .  # one file, like movvis.m single file mode
+#
+# Required libraries: numpy, matplotlib (for the plots). Optional: pandas + pyarrow for Parquet tables.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Regex of the SPM realignment parameters files
+RP_REGEX = r'^rp_.+\.txt$'
+# Folders that never contain functional realignment parameters
+SKIP_DIRS = ('mprage', 'jobs')
+# Columns of the summary table, in order
+COLUMNS = ['condition', 'subject', 'session', 'modality', 'file', 'size', 'mtime', 'nvols',
+           'max_abs_trans', 'mean_abs_trans', 'max_abs_rot', 'mean_abs_rot', 'mean_fd', 'max_fd', 'nvols_fd_over', 'frac_fd_over',
+           'fd_threshold', 'radius', 'exclude', 'exclude_reason', 'error']
+INT_COLUMNS = ('size', 'nvols', 'nvols_fd_over', 'exclude')
+FLOAT_COLUMNS = ('mtime', 'max_abs_trans', 'mean_abs_trans', 'max_abs_rot', 'mean_abs_rot', 'mean_fd', 'max_fd', 'frac_fd_over', 'fd_threshold', 'radius')
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def find_rp_files(rootpath):
+    '''Find all realignment parameters files in the Condition/Subject/data/Session/modality tree. Returns a list of dicts with the condition, subject, session, modality and file.'''
+    if os.path.isfile(rootpath): # single file mode
+        return [{'condition': '', 'subject': '', 'session': '', 'modality': '', 'file': rootpath}]
+    regex = re.compile(RP_REGEX)
+    found = []
+    for dirpath, dirs, files in os.walk(rootpath):
+        relparts = os.path.relpath(dirpath, rootpath).replace(os.sep, '/').split('/')
+        if relparts == ['.']:
+            relparts = []
+        dirs[:] = sorted(d for d in dirs if d.lower() not in SKIP_DIRS and not d.startswith('.'))
+        if len(relparts) < 2:
+            continue # rp files are expected inside a subject folder at least
+        # The folders after data/ are the session then the modality, both optional
+        subparts = relparts[3:] if len(relparts) > 2 and relparts[2] == 'data' else relparts[2:]
+        for f in sorted(files):
+            if regex.match(f):
+                found.append({'condition': relparts[0],
+                              'subject': relparts[1],
+                              'session': subparts[0] if len(subparts) >= 2 else '',
+                              'modality': subparts[-1] if subparts else '',
+                              'file': os.path.join(dirpath, f)})
+    return found
+
+def read_rp(filepath):
+    '''Read a realignment parameters file (6 columns: x, y, z translations in mm, pitch, roll, yaw rotations in radians)'''
+    with open(filepath, 'r') as f:
+        values = np.array(f.read().split(), dtype=np.float64)
+    if values.size % 6:
+        raise ValueError('%s does not have 6 columns' % filepath)
+    return values.reshape(-1, 6)
+
+def load_rp_files(filepaths, jobs=16):
+    '''Load all realignment parameters files in threads and concatenate them in one (nvolumes, 6) array.
+    Returns (data, offsets, errors) where the volumes of file i are data[offsets[i]:offsets[i+1]], and errors is a dict {index: error message} of the files that could not be read (they have 0 volumes).'''
+    def read_or_error(filepath):
+        try:
+            return read_rp(filepath), None
+        except Exception as exc:
+            return np.zeros((0, 6)), '%s: %s' % (exc.__class__.__name__, exc)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(read_or_error, filepaths))
+    arrays = [r[0] for r in results]
+    errors = {i: r[1] for i, r in enumerate(results) if r[1] is not None}
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    data = np.concatenate(arrays) if arrays else np.zeros((0, 6))
+    return data, offsets, errors
+
+def framewise_displacement(data, offsets, radius=50.0):
+    '''Framewise displacement (Power et al., 2012) of all volumes at once: sum of the absolute differences of the translations (mm) and of the rotations converted to the displacement on a sphere of the given radius (mm). The first volume of each file has a FD of 0.'''
+    diffs = np.zeros_like(data)
+    diffs[1:] = np.abs(np.diff(data, axis=0))
+    diffs[offsets[:-1][offsets[:-1] < len(data)]] = 0 # do not compute the difference across two files
+    return diffs[:, :3].sum(axis=1) + radius * diffs[:, 3:].sum(axis=1)
+
+def summarize(data, offsets, fd, fd_threshold):
+    '''Compute the motion metrics of each file in vectorized form (per-file reductions with reduceat). Rotations are reported in degrees. Returns a dict of arrays (NaN for empty files).'''
+    nfiles = len(offsets) - 1
+    nvols = np.diff(offsets)
+    metrics = {k: np.full(nfiles, np.nan) for k in ('max_abs_trans', 'mean_abs_trans', 'max_abs_rot', 'mean_abs_rot', 'mean_fd', 'max_fd', 'frac_fd_over')}
+    metrics['nvols'] = nvols
+    metrics['nvols_fd_over'] = np.zeros(nfiles, dtype=np.int64)
+    nonempty = nvols > 0
+    if not nonempty.any():
+        return metrics
+    starts = offsets[:-1][nonempty]
+    n = nvols[nonempty].astype(np.float64)
+    abs_trans = np.abs(data[:, :3])
+    abs_rot = np.degrees(np.abs(data[:, 3:]))
+    over = (fd > fd_threshold).astype(np.int64)
+    metrics['max_abs_trans'][nonempty] = np.maximum.reduceat(abs_trans.max(axis=1), starts)
+    metrics['mean_abs_trans'][nonempty] = np.add.reduceat(abs_trans.sum(axis=1), starts) / (3 * n)
+    metrics['max_abs_rot'][nonempty] = np.maximum.reduceat(abs_rot.max(axis=1), starts)
+    metrics['mean_abs_rot'][nonempty] = np.add.reduceat(abs_rot.sum(axis=1), starts) / (3 * n)
+    metrics['mean_fd'][nonempty] = np.add.reduceat(fd, starts) / n
+    metrics['max_fd'][nonempty] = np.maximum.reduceat(fd, starts)
+    metrics['nvols_fd_over'][nonempty] = np.add.reduceat(over, starts)
+    metrics['frac_fd_over'][nonempty] = metrics['nvols_fd_over'][nonempty] / n
+    return metrics
+
+def exclusion(row, max_trans, max_rot, max_mean_fd, max_frac_fd):
+    '''Decide if a session should be excluded. Returns (exclude, reason).'''
+    if row.get('error') or not row.get('nvols'):
+        return 1, 'no data'
+    reasons = []
+    if row['max_abs_trans'] > max_trans:
+        reasons.append('max translation %.2f mm > %g' % (row['max_abs_trans'], max_trans))
+    if row['max_abs_rot'] > max_rot:
+        reasons.append('max rotation %.2f deg > %g' % (row['max_abs_rot'], max_rot))
+    if row['mean_fd'] > max_mean_fd:
+        reasons.append('mean FD %.3f mm > %g' % (row['mean_fd'], max_mean_fd))
+    if row['frac_fd_over'] > max_frac_fd:
+        reasons.append('%.1f%% volumes with FD > %g mm' % (100 * row['frac_fd_over'], row['fd_threshold']))
+    return int(bool(reasons)), '; '.join(reasons)
+
+def load_summary(summarypath):
+    '''Load a summary table as a dict {file: row}'''
+    if not os.path.exists(summarypath):
+        return {}
+    if summarypath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to read Parquet tables, please pip install pandas pyarrow or use a .csv table.')
+        df = pd.read_parquet(summarypath)
+        rows = [{k: (None if (v is None or (isinstance(v, float) and v != v)) else v) for k, v in r.items()} for r in df.to_dict('records')]
+    else:
+        rows = []
+        with open(summarypath, 'r', newline='') as f:
+            for r in csv.DictReader(f):
+                for k, v in r.items():
+                    if v == '':
+                        r[k] = None
+                    elif k in INT_COLUMNS:
+                        r[k] = int(float(v))
+                    elif k in FLOAT_COLUMNS:
+                        r[k] = float(v)
+                rows.append(r)
+    return {r['file']: r for r in rows}
+
+def save_summary(rows, summarypath):
+    '''Save the rows (list of dicts) as a Parquet or CSV table, written to a temporary file first so that an interrupted save does not corrupt the previous table'''
+    tmppath = summarypath + '.tmp'
+    if summarypath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to write Parquet tables, please pip install pandas pyarrow or use a .csv table.')
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(tmppath, index=False)
+    else:
+        with open(tmppath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(tmppath, summarypath)
+
+def compute_rows(entries, data, offsets, errors, fd_threshold, radius):
+    '''Compute the summary rows of the loaded files'''
+    fd = framewise_displacement(data, offsets, radius)
+    metrics = summarize(data, offsets, fd, fd_threshold)
+    rows = []
+    for i, entry in enumerate(entries):
+        row = dict.fromkeys(COLUMNS)
+        row.update(entry)
+        st = os.stat(entry['file'])
+        row.update({'size': st.st_size, 'mtime': st.st_mtime, 'fd_threshold': fd_threshold, 'radius': radius, 'error': errors.get(i)})
+        for k, v in metrics.items():
+            row[k] = None if (isinstance(v[i], float) and np.isnan(v[i])) else v[i].item()
+        rows.append(row)
+    return rows, fd
+
+def render_page(args):
+    '''Render one page of motion plots (one cell per session: translations, rotations and FD) with the Agg backend. Run in a separate process.'''
+    pagepath, cells, ncols, fd_threshold = args
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    nrows = int(np.ceil(len(cells) / float(ncols)))
+    fig = plt.figure(figsize=(4.5 * ncols, 5.0 * nrows))
+    grid = fig.add_gridspec(nrows, ncols, hspace=0.45, wspace=0.3)
+    for icell, (title, rp, fd, excluded) in enumerate(cells):
+        sub = grid[icell // ncols, icell % ncols].subgridspec(3, 1, hspace=0.08)
+        ax_t = fig.add_subplot(sub[0])
+        ax_r = fig.add_subplot(sub[1], sharex=ax_t)
+        ax_fd = fig.add_subplot(sub[2], sharex=ax_t)
+        ax_t.plot(rp[:, :3], linewidth=0.7)
+        ax_t.set_ylabel('mm', fontsize=7)
+        ax_t.set_title(title, fontsize=8, color='red' if excluded else 'black')
+        ax_r.plot(np.degrees(rp[:, 3:]), linewidth=0.7)
+        ax_r.set_ylabel('deg', fontsize=7)
+        ax_fd.plot(fd, color='black', linewidth=0.7)
+        ax_fd.axhline(fd_threshold, color='red', linestyle='--', linewidth=0.7)
+        ax_fd.set_ylabel('FD mm', fontsize=7)
+        ax_fd.set_xlabel('Volume number', fontsize=7)
+        for ax in (ax_t, ax_r, ax_fd):
+            ax.tick_params(labelsize=6)
+        for ax in (ax_t, ax_r):
+            ax.tick_params(labelbottom=False)
+        if icell == 0:
+            # One legend for all the cells, as in movvis.m
+            ax_t.legend(['x', 'y', 'z'], fontsize=6, loc='upper right', frameon=False)
+            ax_r.legend(['pitch', 'roll', 'yaw'], fontsize=6, loc='upper right', frameon=False)
+    fig.suptitle('Motion (translations, rotations and framewise displacement), in red: excluded sessions', fontsize=10)
+    fig.savefig(pagepath, dpi=100)
+    plt.close(fig)
+    return pagepath
+
+def render_report(outdir, rows, data, offsets, fd, maxelt=25, fmt='png', fd_threshold=0.5, jobs=None):
+    '''Render the motion plots of all sessions, maxelt sessions per page, pages in parallel processes. Returns the list of pages paths.'''
+    ncols = int(np.ceil(np.sqrt(maxelt)))
+    order = [i for i in range(len(rows)) if rows[i]['nvols']]
+    tasks = []
+    for ipage, start in enumerate(range(0, len(order), maxelt)):
+        cells = []
+        for i in order[start:start + maxelt]:
+            r = rows[i]
+            title = ' '.join(s for s in (r['subject'], r['condition'], r['session'], r['modality']) if s) or os.path.basename(r['file'])
+            cells.append((title, data[offsets[i]:offsets[i + 1]], fd[offsets[i]:offsets[i + 1]], r['exclude']))
+        tasks.append((os.path.join(outdir, 'motion_qc_page%03i.%s' % (ipage + 1, fmt)), cells, ncols, fd_threshold))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(render_page, tasks))
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Motion QC v%s
+Description: Compute the motion summary (framewise displacement, max/mean translation and rotation, fraction of volumes over the FD threshold) of all the rp_*.txt realignment files of a dataset into one table with exclusion flags, and render paginated motion plots (headless alternative to movvis.m).
+    ''' % __version__
+    ep = '''Framewise displacement as in Power et al., 2012, NeuroImage: rotations are converted to mm on a sphere of --radius mm. Rotations in the table and plots are in degrees.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root of the dataset (Condition/Subject/data/Session/modality/rp_*.txt), or to a single rp_*.txt file.')
+    main_parser.add_argument('-o', '--output', metavar='/some/path', type=str, required=True,
+                        help='Folder where to save the summary table and the plots (better outside of the dataset tree).')
+    main_parser.add_argument('-s', '--summary', metavar='motion_summary.csv', type=str, required=False, default='motion_summary.csv',
+                        help='Filename of the summary table in the output folder (.csv or .parquet, default: motion_summary.csv).')
+    main_parser.add_argument('--fd-threshold', metavar='mm', type=float, required=False, default=0.5,
+                        help='Framewise displacement above which a volume is considered as corrupted by motion (default: 0.5 mm).')
+    main_parser.add_argument('--radius', metavar='mm', type=float, required=False, default=50.0,
+                        help='Radius of the sphere to convert rotations to displacements (default: 50 mm, approximately the distance from the cortex to the center of the head).')
+    main_parser.add_argument('--max-trans', metavar='mm', type=float, required=False, default=3.0,
+                        help='Exclusion criterion: maximum absolute translation (default: 3 mm).')
+    main_parser.add_argument('--max-rot', metavar='deg', type=float, required=False, default=3.0,
+                        help='Exclusion criterion: maximum absolute rotation (default: 3 degrees).')
+    main_parser.add_argument('--max-mean-fd', metavar='mm', type=float, required=False, default=0.5,
+                        help='Exclusion criterion: maximum mean framewise displacement (default: 0.5 mm).')
+    main_parser.add_argument('--max-frac-fd', metavar='0.2', type=float, required=False, default=0.2,
+                        help='Exclusion criterion: maximum fraction of volumes with a FD above --fd-threshold (default: 0.2).')
+    main_parser.add_argument('--maxelt', metavar='25', type=int, required=False, default=25,
+                        help='Maximum number of sessions plotted on the same page (default: 25, as in movvis.m).')
+    main_parser.add_argument('--format', type=str, choices=['png', 'pdf'], required=False, default='png',
+                        help='Format of the pages of plots (default: png).')
+    main_parser.add_argument('--no-plots', action='store_true', required=False, default=False,
+                        help='Only update the summary table, do not render the plots (files that did not change are then not loaded again).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes to render the plots (default: number of CPUs).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    outdir = fullpath(args.output)
+
+    if not os.path.exists(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    summarypath = os.path.join(outdir, args.summary)
+
+    #### Main program
+    entries = find_rp_files(inputpath)
+    print('== Found %i realignment parameters files in %s' % (len(entries), inputpath))
+    if not entries:
+        return 0
+
+    # Reuse the rows of the files that did not change since the last run (if no plots are needed and the FD parameters are the same)
+    cache = load_summary(summarypath)
+    reuse = [False] * len(entries)
+    if args.no_plots:
+        for i, entry in enumerate(entries):
+            old = cache.get(entry['file'])
+            if old is not None and not old.get('error'):
+                st = os.stat(entry['file'])
+                reuse[i] = (old['size'] == st.st_size and old['mtime'] == st.st_mtime and old['fd_threshold'] == args.fd_threshold and old['radius'] == args.radius)
+    toload = [e for e, r in zip(entries, reuse) if not r]
+    data, offsets, errors = load_rp_files([e['file'] for e in toload])
+    newrows, fd = compute_rows(toload, data, offsets, errors, args.fd_threshold, args.radius)
+    print('== Loaded %i files (%i volumes), %i unchanged files reused from %s' % (len(toload), len(data), len(entries) - len(toload), summarypath))
+
+    newrows_iter = iter(newrows)
+    rows = [dict(cache[e['file']], **e) if r else next(newrows_iter) for e, r in zip(entries, reuse)]
+    for row in rows:
+        row['exclude'], row['exclude_reason'] = exclusion(row, args.max_trans, args.max_rot, args.max_mean_fd, args.max_frac_fd)
+    save_summary(rows, summarypath)
+    for row in rows:
+        if row['error']:
+            print('ERROR: %s: %s' % (row['file'], row['error']), file=sys.stderr)
+    nexcluded = sum(r['exclude'] for r in rows)
+    print('== Summary saved in %s: %i/%i sessions flagged for exclusion.' % (summarypath, nexcluded, len(rows)))
+    for row in rows:
+        if row['exclude'] and not row['error']:
+            print('   %s %s %s %s: %s' % (row['condition'], row['subject'], row['session'], row['modality'], row['exclude_reason']))
+
+    if not args.no_plots:
+        pages = render_report(outdir, newrows, data, offsets, fd, maxelt=max(1, args.maxelt), fmt=args.format, fd_threshold=args.fd_threshold, jobs=args.jobs)
+        print('== %i pages of plots saved in %s' % (len(pages), outdir))
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
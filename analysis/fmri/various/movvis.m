@@ -4,6 +4,7 @@ function movvis(root_path, maxelt)
 % Folders tree structure must correspond to conn subjects loader expected structure (Condition/Subject/data/Session/modality/rp_*.txt), but in fact all subfolders are optional apart from Condition/Subject
 % maxelt allows to select the maximum number of elements to show on the same plot (the rest will be shown after pressing a key in the console)
 % Can also be used to visualize a single subject movement, by providing the full path to a rp_*.txt file as the root_path.
+% For big datasets, motion_qc.py computes the framewise displacement and exclusion criteria of all subjects in one table and saves these plots as paginated images, without a display.
 %
 % v1.5.1
 % by Stephen Larroque 2016-2019
@@ -5,6 +5,7 @@ function run_spm_jobs(matlabbatchall, parallel_processing, matlabbatchall_infos,
 % containing additional info to print for each job
 % pathtoset is optional and allows to provide a path to set inside the
 % parfor loop before running the jobs
+% See also preprocessing/fmri/run_jobs_pool.py to run the saved batch files across several headless MATLAB processes
     if exist('matlabbatchall_infos','var') % check if variable was provided, for parfor transparency we need to check existence before
         minfos_flag = true;
     else
@@ -2,6 +2,7 @@ function [T_thr, P_thr] = threshold_fdr(imfilepath, mcc, thr, df, STAT, conjonc_
 % threshold_fdr(imfilepath, mcc, thr, df, STAT, conjonc_nb, mask, twotailed)
 % (For SPM12) This script allows the thresholding of any nifti file, no need for a SPM.mat structure. It supports FDR but also FWE and p-uncorrected, and also Nichols min-T conjunction (conjunction null hypothesis).
 % If no argument is given, a SPM (minimal) GUI will open to ask for the required parameters.
+% To threshold all the contrasts of a results folder at once (in parallel, without MATLAB), see threshold_fdr.py.
 %
 % Inputs:
 % imfilepath : can be any neuroimage, but generally you want to use the unthresholded maps, also called the T maps, in other words in SPM the contrast maps which are named spmT_XXXX.nii, where XXXX is the position of the contrast in the contrast manager (first, second, etc).
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# threshold_fdr.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Vectorized FDR/FWE thresholding of statistical maps
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: threshold T or Z maps voxel-wise with FDR (Benjamini-Hochberg), FWE (random field theory, needs the resels from the SPM.mat) or uncorrected p-values, optionally as a Nichols min-T conjunction of several maps, and write the thresholded and binarized (mask) images. This is the same as threshold_fdr.m, but without MATLAB/SPM, and all the contrasts of a 2nd-level results folder are thresholded in parallel in one command.
+#
+# Each map is loaded through nibabel (memory-mapped when uncompressed and unscaled). For FDR, a voxel can only be significant if its p-value is below q (since k/m*q <= q), so the survival function is only evaluated on the voxels above the corresponding T value, and only these candidates are sorted, instead of converting and sorting the whole map. The results are identical to spm_uc_FDR: the threshold is the smallest T among the voxels whose p-values pass the Benjamini-Hochberg step-up procedure, and for a conjunction of n maps the p-values of the min-T map are raised to the power n (spm_z2p). Voxels equal to 0 or NaN are considered outside of the search volume.
+#
+# The degrees of freedom and the statistic type (T or Z) are read from the description of the maps written by SPM (eg, "SPM{T_[23.0]} - contrast 1"), so they only need to be given for maps generated by other software. For FWE, the resels are read from the SPM.mat next to the map (or given with --resels).
+#
+# The output images are named as in threshold_fdr.m: <map>_p-<correction><threshold>_thr.nii (thresholded map) and <map>_p-<correction><threshold>_mask.nii (binarized), and <map>_tmap.nii for the min-T conjunction map.
+#
+# Usage:
+#   python threshold_fdr.py -i /path/to/2ndlevel/results --mcc fdr --thr 0.05             # all spmT_*.nii maps of the folder, in parallel
+#   python threshold_fdr.py -i spmT_0001.nii spmT_0002.nii --conjunction --mcc fwe --thr 0.05
+#   python threshold_fdr.py -i tmap.nii --df 23 --mcc fdr --thr 0.05 --two-tailed
+#
+# Required libraries: numpy, scipy, nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import nibabel as nib
+from scipy import stats
+from scipy.optimize import brentq
+from scipy.special import gammaln
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Default regex of the maps to threshold in a results folder (SPM contrasts T maps)
+MAPS_REGEX = r'^spmT_\d+\.(nii|img)$'
+# Description written by SPM in the header of the statistical maps, eg: SPM{T_[23.0]} - contrast 1: patients > controls
+SPM_DESCRIP_REGEX = re.compile(r'SPM\{([TZ])(?:_\[([0-9.]+)(?:,\s*([0-9.]+))?\])?\}')
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def list_maps(inputpaths, regex=MAPS_REGEX):
+    '''Expand the input paths (maps or folders, not recursive) into a list of maps'''
+    maps = []
+    for p in inputpaths:
+        p = fullpath(p)
+        if os.path.isdir(p):
+            maps.extend(os.path.join(p, f) for f in sorted(os.listdir(p)) if re.search(regex, f))
+        elif os.path.isfile(p):
+            maps.append(p)
+        else:
+            raise NameError('Specified input path does not exist: %s' % p)
+    return maps
+
+def stat_info(img):
+    '''Get the statistic type and degrees of freedom from the description written by SPM in the header. Returns (STAT, df) or (None, None).'''
+    try:
+        descrip = img.header['descrip'].item()
+        descrip = descrip.decode('latin-1') if isinstance(descrip, bytes) else str(descrip)
+    except (KeyError, ValueError):
+        return None, None
+    m = SPM_DESCRIP_REGEX.search(descrip)
+    if m is None:
+        return None, None
+    return m.group(1), (float(m.group(2)) if m.group(2) else None)
+
+def survival(t, df, STAT='T'):
+    '''Vectorized survival function (1 - cdf) of the statistic, as 1 - spm_Tcdf or 1 - spm_Ncdf'''
+    return stats.t.sf(t, df) if STAT == 'T' else stats.norm.sf(t)
+
+def inverse_survival(p, df, STAT='T'):
+    '''Statistic value whose survival function is p, as spm_u'''
+    return stats.t.isf(p, df) if STAT == 'T' else stats.norm.isf(p)
+
+def conjunction_map(maps):
+    '''Nichols min-T conjunction, as threshold_fdr.m: minimum of the positive parts and maximum of the negative parts, voxels positive in one map and negative in another are set to 0 (conservative)'''
+    pos = np.where(maps[0] > 0, maps[0], 0)
+    neg = np.where(maps[0] < 0, maps[0], 0)
+    for m in maps[1:]:
+        pos = np.minimum(pos, m)
+        neg = np.maximum(neg, m)
+    conj = pos + neg
+    conj[(pos < 0) & (neg > 0)] = 0
+    return conj
+
+def search_values(T):
+    '''Values of the voxels inside the search volume (not 0 nor NaN), as a flat array'''
+    T = np.asarray(T).ravel()
+    return T[(T != 0) & ~np.isnan(T)]
+
+def fdr_threshold(T, q, df, STAT='T', n=1):
+    '''Benjamini-Hochberg FDR threshold on the statistic, same as spm_uc_FDR (one-sided, positive tail). Returns np.inf if no voxel survives.
+    Only the voxels whose p-value can pass (p <= q) are converted to p-values and sorted.'''
+    Ts = search_values(T)
+    m = Ts.size
+    if m == 0:
+        return np.inf
+    # p <= q  <=>  T >= u(q^(1/n))
+    candidates = Ts[Ts >= inverse_survival(q ** (1.0 / n), df, STAT)]
+    if candidates.size == 0:
+        return np.inf
+    candidates = -np.sort(-candidates) # descending T = ascending p
+    ps = survival(candidates, df, STAT) ** n
+    # These are the smallest p-values of the whole map, so their ranks are the same as in the full sorted list
+    passing = np.flatnonzero(ps <= np.arange(1, candidates.size + 1) / float(m) * q)
+    if passing.size == 0:
+        return np.inf
+    return float(candidates[passing[-1]])
+
+def ec_density(STAT, t, df):
+    '''Euler characteristic densities for D = 0..3 dimensions, as spm_ECdensity (for T and Z fields)'''
+    a = 4 * np.log(2)
+    t = float(t)
+    if STAT == 'T':
+        v = float(df)
+        b = np.exp(gammaln((v + 1) / 2.0) - gammaln(v / 2.0))
+        c = (1 + t ** 2 / v) ** ((1 - v) / 2.0)
+        return np.array([stats.t.sf(t, v),
+                         a ** 0.5 / (2 * np.pi) * c,
+                         a / ((2 * np.pi) ** 1.5) * c * t / ((v / 2.0) ** 0.5) * b,
+                         a ** 1.5 / ((2 * np.pi) ** 2) * c * ((v - 1) * (t ** 2) / v - 1)])
+    e = np.exp(-t ** 2 / 2.0)
+    return np.array([stats.norm.sf(t),
+                     a ** 0.5 / (2 * np.pi) * e,
+                     a / ((2 * np.pi) ** 1.5) * e * t,
+                     a ** 1.5 / ((2 * np.pi) ** 2) * e * (t ** 2 - 1)])
+
+def rf_pvalue(u, df, STAT, R, n=1):
+    '''Corrected p-value of a peak height u with random field theory, as spm_P_RF(1, 0, u, df, STAT, R, n)'''
+    R = np.asarray(R, dtype=np.float64).ravel()
+    D = int(np.flatnonzero(R)[-1]) + 1
+    R = R[:D]
+    G = np.sqrt(np.pi) / np.exp(gammaln(np.arange(1, D + 1) / 2.0))
+    EC = np.maximum(ec_density(STAT, u, df)[:D], np.finfo(np.float64).eps)
+    # EC densities of the conjunction: first row of the n-th power of the upper triangular Toeplitz matrix
+    col = EC * G
+    T = np.zeros((D, D))
+    for i in range(D):
+        T[i, i:] = col[:D - i]
+    P = np.linalg.matrix_power(T, n)[0, :]
+    Em = np.sum((R / G) * P)
+    return 1 - np.exp(-Em)
+
+def fwe_threshold(alpha, df, STAT, R, n=1, S=None):
+    '''FWE corrected threshold on the statistic, as spm_uc: random field theory threshold, or the Bonferroni threshold if lower (when S, the number of voxels, is given)'''
+    u = brentq(lambda x: rf_pvalue(x, df, STAT, R, n) - alpha, 0.0, 100.0)
+    if S:
+        u = min(u, float(inverse_survival((alpha / float(S)) ** (1.0 / n), df, STAT)))
+    return u
+
+def load_resels(spmmat):
+    '''Load the resel counts (xVol.R) from a SPM.mat'''
+    from scipy.io import loadmat
+    try:
+        spm = loadmat(spmmat, struct_as_record=False, squeeze_me=True)['SPM']
+    except NotImplementedError:
+        raise IOError('%s is a MATLAB v7.3 file which cannot be read, please provide the resels with --resels (SPM.xVol.R in MATLAB)' % spmmat)
+    return np.atleast_1d(spm.xVol.R).astype(np.float64)
+
+def threshold_maps(mappaths, mcc='fdr', thr=0.05, df=None, STAT=None, twotailed=False, resels=None, spmmat=None, outdir=None):
+    '''Threshold one map, or the min-T conjunction of several maps, and write the thresholded and mask images. Returns a dict with the thresholds and the number of significant voxels.'''
+    imgs = [nib.load(p) for p in mappaths]
+    hdr_stat, hdr_df = stat_info(imgs[0])
+    STAT = STAT or hdr_stat or 'T'
+    df = df if df is not None else hdr_df
+    if STAT == 'T' and df is None:
+        raise ValueError('%s: cannot find the degrees of freedom in the header, please provide --df' % mappaths[0])
+    n = len(imgs)
+    maps = [np.asarray(img.dataobj, dtype=np.float64) for img in imgs]
+    T = maps[0] if n == 1 else conjunction_map(maps)
+
+    mcc = mcc.lower()
+    if mcc == 'fdr':
+        T_thr = fdr_threshold(T, thr, df, STAT, n)
+    elif mcc == 'fwe':
+        if resels is None:
+            resels = load_resels(spmmat or os.path.join(os.path.dirname(mappaths[0]), 'SPM.mat'))
+        S = int(np.count_nonzero(np.nan_to_num(T)))
+        T_thr = fwe_threshold(thr, df, STAT, resels, n, S)
+    elif mcc == 'unc':
+        # No adjustment: p for conjunctions is p of the conjunction SPM
+        T_thr = float(inverse_survival(thr, df, STAT))
+    else:
+        raise ValueError('Unknown control method "%s".' % mcc)
+    P_thr = float(survival(T_thr, df, STAT))
+    if twotailed:
+        # Two-tailed test (for both positive and negative), by Thomas Nichols
+        T_thr = float(inverse_survival(P_thr / 2.0, df, STAT))
+        P_thr = float(survival(T_thr, df, STAT))
+
+    # Threshold the original map
+    Tz = np.nan_to_num(T)
+    if twotailed:
+        map_mask = (Tz < -T_thr) | (Tz > T_thr)
+    elif Tz.max() > 0: # positive part thresholding
+        map_mask = Tz > T_thr
+    else: # negative part thresholding
+        map_mask = Tz < -T_thr
+    map_thr = Tz * map_mask
+
+    # Write out the thresholded and binarized images, next to the (first) map
+    base, ext = os.path.splitext(os.path.basename(mappaths[0]))
+    if ext.lower() == '.gz':
+        base, ext = os.path.splitext(base)
+    outdir = outdir or os.path.dirname(mappaths[0])
+    prefix = os.path.join(outdir, '%s_p-%s%s' % (base, mcc, '%g' % thr))
+    ref = imgs[0]
+    outputs = [(prefix + '_thr.nii', map_thr.astype(np.float32)), (prefix + '_mask.nii', map_mask.astype(np.uint8))]
+    if n > 1:
+        outputs.append((os.path.join(outdir, base + '_tmap.nii'), T.astype(np.float32)))
+    for outpath, data in outputs:
+        out = nib.Nifti1Image(data, ref.affine, nib.Nifti1Header.from_header(ref.header) if isinstance(ref.header, nib.Nifti1Header) else None)
+        out.set_data_dtype(data.dtype)
+        out.header.set_slope_inter(1, 0)
+        nib.save(out, outpath)
+    return {'map': ' & '.join(mappaths), 'STAT': STAT, 'df': df, 'mcc': mcc, 'thr': thr, 'T_thr': T_thr, 'P_thr': P_thr,
+            'nvox': int(map_mask.sum()), 'outputs': [o[0] for o in outputs]}
+
+def process_task(args):
+    '''Worker for the process pool, never raises but returns the error'''
+    mappaths, kwargs = args
+    try:
+        return threshold_maps(mappaths, **kwargs)
+    except Exception as exc:
+        return {'map': ' & '.join(mappaths), 'error': '%s: %s' % (exc.__class__.__name__, exc)}
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Vectorized FDR/FWE thresholding v%s
+Description: Threshold T/Z maps voxel-wise (FDR, FWE or uncorrected), or their Nichols min-T conjunction, and write the thresholded and binarized images, same as threshold_fdr.m but for all the contrasts of a results folder at once, in parallel.
+    ''' % __version__
+    ep = '''Note: this is only voxel-wise thresholding, for cluster-wise thresholding use SPM (see threshold_fdr.m for more details).'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, nargs='+', required=True,
+                        help='T/Z maps to threshold, or folders containing them (eg, a 2nd-level results folder).')
+    main_parser.add_argument('-r', '--regex', metavar='regex', type=str, required=False, default=MAPS_REGEX,
+                        help='Regular expression to select the maps in the input folders (default: %s).' % MAPS_REGEX.replace('%', '%%'))
+    main_parser.add_argument('--mcc', type=str, choices=['fdr', 'fwe', 'unc'], required=False, default='fdr',
+                        help='Voxel-wise p-value adjustment (default: fdr).')
+    main_parser.add_argument('--thr', metavar='0.05', type=float, required=False, default=0.05,
+                        help='Voxel-wise threshold (default: 0.05).')
+    main_parser.add_argument('--df', metavar='N', type=float, required=False, default=None,
+                        help='Degrees of freedom (default: read from the SPM description of the maps).')
+    main_parser.add_argument('--stat', type=str, choices=['T', 'Z'], required=False, default=None,
+                        help='Statistic of the maps (default: read from the SPM description of the maps, else T).')
+    main_parser.add_argument('--two-tailed', action='store_true', required=False, default=False,
+                        help='Two-tailed test (threshold both positive and negative values).')
+    main_parser.add_argument('--conjunction', action='store_true', required=False, default=False,
+                        help='Nichols min-T conjunction of all the input maps, instead of thresholding them separately.')
+    main_parser.add_argument('--resels', metavar='R', type=float, nargs=4, required=False, default=None,
+                        help='Resel counts (SPM.xVol.R) for FWE (default: read from the SPM.mat next to each map).')
+    main_parser.add_argument('--spm-mat', metavar='SPM.mat', type=str, required=False, default=None,
+                        help='SPM.mat to read the resels from for FWE (default: the SPM.mat next to each map).')
+    main_parser.add_argument('-o', '--output', metavar='/some/path', type=str, required=False, default=None,
+                        help='Folder where to write the thresholded images (default: next to each map).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    maps = list_maps(args.input, args.regex)
+    if not maps:
+        main_parser.error('no map found in %s' % args.input)
+    outdir = fullpath(args.output) if args.output else None
+    if outdir is not None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    #### Main program
+    kwargs = {'mcc': args.mcc, 'thr': args.thr, 'df': args.df, 'STAT': args.stat, 'twotailed': args.two_tailed,
+              'resels': args.resels, 'spmmat': fullpath(args.spm_mat) if args.spm_mat else None, 'outdir': outdir}
+    tasks = [(maps, kwargs)] if args.conjunction else [([m], kwargs) for m in maps]
+    print('== Thresholding %i maps (%s p < %g)%s...' % (len(maps), args.mcc.upper(), args.thr, ' as a min-T conjunction' if args.conjunction else ''))
+    nerrors = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for res in executor.map(process_task, tasks):
+            if 'error' in res:
+                nerrors += 1
+                print('ERROR: %s: %s' % (res['map'], res['error']), file=sys.stderr)
+            else:
+                print('-> %s: %s threshold = %.4f (p = %.6g, df = %s), %i significant voxels' % (res['map'], res['STAT'], res['T_thr'], res['P_thr'], '%g' % res['df'] if res['df'] is not None else '-', res['nvox']))
+    print('== Done, %i errors.' % nerrors)
+    return 1 if nerrors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
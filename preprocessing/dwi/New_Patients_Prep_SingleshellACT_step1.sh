@@ -37,6 +37,7 @@ gunzip mask.nii.gz
 # TODO: add status messages and progress bar? for example when eddy is launched, say that it is currently processing (and check CPU activity of eddy process?)
 # TODO: auto overwrite all files (can input --force to this script) without asking first
 # TODO: write a copy of console output to a log file, for all softwares called!
+# To check the raw DWI for dropout slices and outlier volumes before eddy (for all subjects at once): python $SCRIPTPATH/dwi_qc.py -i /path/to/patients/ -o dwi_qc.csv
 echo "Motion correction using fsl eddy, this can take a while..."
 eddy --very_verbose --imain=dwi.nii --mask=mask.nii --index=index.txt --acqp=$SCRIPTPATH/acqp.txt --bvecs=grad.bvecs --bvals=grad.bvals --out=dwicorr.nii # can also do --very_verbose
 
@@ -45,6 +46,7 @@ echo "Tensor directions estimation, this can also take a while..."
 gunzip dwicorr.nii.gz
 dwi2tensor -force -grad grad.txt -mask mask.nii dwicorr.nii tensor.nii
 tensor2metric -force -mask mask.nii tensor.nii -adc adc.nii -fa fa.nii -vector RGB_fa.nii
+# For quality control of the whole cohort (eg, FA before and after eddy), the tensors can also be fitted in seconds per subject with: python $SCRIPTPATH/dti_fit.py -i /path/to/patients/ --dwi dwi.nii --prefix raw_
 fslmaths fa.nii -thr 0.20 fathr.nii
 gunzip fathr.nii.gz
 # fa.nii = fractional anistotropy estimation
@@ -58,8 +60,10 @@ echo "Coregistration using FAST..."
 fast -v t1_bet.nii
 gunzip t1_bet_pve_*
 
-# Quality Assurance: Check segmentation using mricron (display white and grey matter segmentation over skull extracted brain)
-mricron t1_bet.nii -o t1_bet_pve_2.nii -o t1_bet_pve_1.nii -b 50 -t 50 &
+# Quality Assurance: Check segmentation (white matter in red and grey matter in green over skull extracted brain), saved as a mosaic in qc/ (open qc/t1_bet_index.html), or for all subjects at once: python $SCRIPTPATH/qc_montage.py -i /path/to/patients/ --preset act_step1 -o /path/to/qc
+python $SCRIPTPATH/qc_montage.py -i . --preset act_step1 -o qc
+# Interactive alternative using mricron:
+#mricron t1_bet.nii -o t1_bet_pve_2.nii -o t1_bet_pve_1.nii -b 50 -t 50 &
 
 # Extra (registration, stuff)
 #flirt -in mask2.nii -ref t1_bet_pve_2.nii -out mask_t1.nii
@@ -44,18 +44,17 @@ if [ "$choice_wmgm" == "n" ]; then
 fi
 
 echo "Launching SPM coregistration and resampling, please wait..."
-matlab -nodesktop -nosplash -r "addpath(genpath('$SCRIPTPATH'));process_spm_coreg_and_exit('fathr.nii', 'WM.nii', 'WMdiff.nii', 'WM.nii', 'GMdiff.nii', 'GM.nii');quit();"
-matlab -nodesktop -nosplash -r "addpath(genpath('$SCRIPTPATH'));process_spm_coreg_and_exit('fathr.nii', 'WM.nii', 'T1diff.nii', 'T1.nii');quit();"
-
-matlab -nodesktop -nosplash -r "addpath(genpath('$SCRIPTPATH'));Resample_im('mask.nii','WMdiff.nii','mask3.nii');quit();"
-
-
-matlab -nodesktop -nosplash -r "addpath(genpath('$SCRIPTPATH'));EA_masking('mask3.nii','WMdiff.nii','WMdiff_masked.nii');quit();"
-
-matlab -nodesktop -nosplash -r "addpath(genpath('$SCRIPTPATH'));Resample_im('WMdiff_masked.nii','mask.nii','WMdiff_masked2.nii');quit();"
+# All MATLAB steps are run in a single MATLAB session (MATLAB+SPM startup is often longer than the steps themselves), stopping at the first error
+python "$SCRIPTPATH/matlab_batch.py" --addpath "$SCRIPTPATH" --preset act_step2
+if [ $? -ne 0 ]; then
+    echo "ERROR: the SPM coregistration and resampling failed, please check the error above and relaunch this script."
+    exit 1
+fi
 
-# Quality Assurance: check if the WM mask is not cutting too much (and it eases interpretation)
-mricron WMdiff.nii -o mask3.nii -b 50 -t 50 &
+# Quality Assurance: check if the WM mask is not cutting too much (and it eases interpretation), saved as a mosaic in qc/ (open qc/WMdiff_index.html), or for all subjects at once: python $SCRIPTPATH/qc_montage.py -i /path/to/patients/ --preset act_step2 -o /path/to/qc
+python $SCRIPTPATH/qc_montage.py -i . --preset act_step2 -o qc
+# Interactive alternative using mricron:
+#mricron WMdiff.nii -o mask3.nii -b 50 -t 50 &
 
 
 #Pacho number
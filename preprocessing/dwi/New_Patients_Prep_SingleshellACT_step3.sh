@@ -30,6 +30,7 @@ python $SCRIPTPATH/Conv_track.py
 
 ### connectome
 #tck2connectome -info -force Allbrain.tck aalnative.nii Connectome.csv -zero_diagonal
+# or, for all subjects at once (from the patients root folder): python $SCRIPTPATH/tck_connectome.py -i /path/to/patients/ --atlas aalnative.nii --zero-diagonal
 
 #erode -dilate -npass 3 mask2.nii mask_dil.nii dilate mask?
 ##erode a mask or image by zeroing non-zero voxels when zero voxels found in kernel
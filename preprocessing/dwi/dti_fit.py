@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# dti_fit.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Fast vectorized DTI tensor fitting
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: fits the diffusion tensor and computes the FA, MD (the -adc of tensor2metric) and RGB (principal direction weighted by FA) maps of all subjects of a cohort, from the raw (dwi.nii) or the eddy corrected (dwicorr.nii) DWI, for quality control without running the dwi2tensor and tensor2metric chain of New_Patients_Prep_SingleshellACT_step1.sh (eg, to compare the FA before and after eddy).
+#
+# The design matrix of the log-linear tensor model is built once from the gradient table (grad.txt in MRtrix format, or FSL bvecs and bvals), and its pseudo-inverse is precomputed, so that the ordinary least squares fit of all the voxels of a slab (a few slices, read from a memory map) is a single matrix product. With --wls, the fit is refined by a weighted least squares with the squared predicted signal as weights (as dipy's WLS), solved for all the voxels of a slab at once. The eigenvalues and principal eigenvectors are computed with batched eigen decompositions. The slabs are processed in a pool of threads (numpy releases the GIL for these operations), and only the voxels inside the mask are fitted.
+#
+# The tensor is fitted in the axes of the image (the gradient directions are rotated from scanner coordinates), so that the RGB map is directly the colour-coded FA of the image axes (red: left-right, green: anterior-posterior, blue: inferior-superior for an image in RAS orientation). The maps are saved in each subject's folder with a prefix (dtifit_ by default), so that the maps of tensor2metric are not overwritten, and the mean FA and MD in the mask are printed and optionally saved in a summary table.
+#
+# Usage:
+#   python dti_fit.py -i /path/to/patients/ --dwi dwicorr.nii --summary fit_corrected.csv
+#   python dti_fit.py -i /path/to/patients/ --dwi dwi.nii --prefix raw_ --wls --summary fit_raw.csv
+#   python dti_fit.py -i /path/to/patients/ --dwi dwi.nii --bvecs grad.bvecs --bvals grad.bvals
+#
+# Required libraries: numpy, nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import os
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+from dti_stats import find_subjects, load_3d
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Columns of the summary table
+SUMMARY_COLUMNS = ['subject', 'dwi', 'volumes', 'bvalues', 'voxels', 'fa_mean', 'md_mean']
+# Lowest signal used in the log (the signal of background or corrupted voxels can be 0)
+MIN_SIGNAL = 1e-6
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def rotation(affine):
+    '''Rotation part of an affine (columns normalized by the voxel sizes)'''
+    return affine[:3, :3] / np.sqrt((affine[:3, :3] ** 2).sum(axis=0))
+
+def read_gradients(folder, affine, gradname='grad.txt', bvecsname=None, bvalsname=None):
+    '''Read the gradient table of a subject and return (directions in the image axes (n, 3), b-values (n,)). Either a MRtrix gradient file (one line "x y z b" per volume, directions in scanner coordinates), or FSL bvecs and bvals (directions in the image axes, with the x axis flipped for images with a neurological voxel order).'''
+    if bvecsname and bvalsname:
+        bvecs = np.loadtxt(os.path.join(folder, bvecsname), ndmin=2)
+        if bvecs.shape[0] == 3 and bvecs.shape[1] != 3:
+            bvecs = bvecs.T
+        bvals = np.loadtxt(os.path.join(folder, bvalsname), ndmin=1).ravel()
+        bvecs = bvecs.copy()
+        if np.linalg.det(affine[:3, :3]) > 0:
+            bvecs[:, 0] = -bvecs[:, 0]
+    else:
+        grad = np.loadtxt(os.path.join(folder, gradname), ndmin=2)
+        if grad.shape[1] != 4:
+            raise ValueError('%s is not a MRtrix gradient file (4 columns expected)' % os.path.join(folder, gradname))
+        # From scanner coordinates to the image axes
+        bvecs = grad[:, :3].dot(rotation(affine))
+        bvals = grad[:, 3]
+    norms = np.sqrt((bvecs ** 2).sum(axis=1))
+    bvecs = np.where(norms[:, None] > 0, bvecs / np.where(norms > 0, norms, 1)[:, None], 0)
+    return bvecs, bvals
+
+def design_matrix(bvecs, bvals):
+    '''Design matrix of the log-linear tensor model: log(S) = X . [Dxx, Dyy, Dzz, Dxy, Dxz, Dyz, log(S0)]'''
+    x, y, z = bvecs.T
+    return np.stack([-bvals * x * x, -bvals * y * y, -bvals * z * z, -2 * bvals * x * y, -2 * bvals * x * z, -2 * bvals * y * z, np.ones(len(bvals))], axis=1)
+
+def tensor_metrics(params):
+    '''FA, MD and principal eigenvector of the tensors (rows of [Dxx, Dyy, Dzz, Dxy, Dxz, Dyz, ...])'''
+    tensors = np.empty((len(params), 3, 3))
+    for (i, j), k in zip(((0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2)), range(6)):
+        tensors[:, i, j] = tensors[:, j, i] = params[:, k]
+    evals, evecs = np.linalg.eigh(tensors)
+    # Negative eigenvalues are due to noise, as in dipy they are set to 0
+    evals = np.maximum(evals, 0)
+    md = evals.mean(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fa = np.sqrt(1.5 * ((evals - md[:, None]) ** 2).sum(axis=1) / (evals ** 2).sum(axis=1))
+    fa = np.clip(np.nan_to_num(fa), 0, 1)
+    # eigh sorts the eigenvalues in ascending order, the principal eigenvector is the last one
+    return fa, md, evecs[:, :, 2]
+
+
+
+#***********************************
+#                     ENGINE
+#***********************************
+
+def fit_slab(dwi, mask, z0, z1, X, pinv, wls, outputs):
+    '''Fit the tensors of the voxels of the slices [z0, z1) inside the mask, and write the metrics in the outputs arrays (fa, md, rgb)'''
+    sel = mask[:, :, z0:z1]
+    if not sel.any():
+        return 0
+    slab = np.asarray(dwi[:, :, z0:z1], dtype=np.float64)
+    signal = slab[sel]
+    logs = np.log(np.maximum(signal, MIN_SIGNAL))
+    # Ordinary least squares for all voxels with one product
+    params = logs.dot(pinv.T)
+    if wls:
+        # Weighted least squares, weights = squared predicted signal, for all voxels at once
+        w = np.exp(2 * params.dot(X.T))
+        A = np.einsum('vn,ni,nj->vij', w, X, X)
+        b = np.einsum('vn,ni,vn->vi', w, X, logs)
+        try:
+            params = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # a singular voxel in the slab (eg, a signal of zeros everywhere), keep the OLS fit for the whole slab
+            pass
+    fa, md, v1 = tensor_metrics(params)
+    outputs['fa'][:, :, z0:z1][sel] = fa
+    outputs['md'][:, :, z0:z1][sel] = md
+    outputs['rgb'][:, :, z0:z1][sel] = np.abs(v1) * fa[:, None]
+    return int(sel.sum())
+
+def fit_subject(folder, dwiname='dwicorr.nii', maskname='mask.nii', gradname='grad.txt', bvecsname=None, bvalsname=None, prefix='dtifit_', wls=False, slab_size=4, jobs=None):
+    '''Fit the tensors of one subject and save the FA, MD and RGB maps in its folder. Returns a dict of summary values.'''
+    img = nib.load(os.path.join(folder, dwiname))
+    if len(img.shape) != 4:
+        raise ValueError('%s is not a 4D image (shape %s)' % (dwiname, img.shape))
+    shape = img.shape[:3]
+    bvecs, bvals = read_gradients(folder, img.affine, gradname, bvecsname, bvalsname)
+    if len(bvals) != img.shape[3]:
+        raise ValueError('the gradient table has %i entries but %s has %i volumes' % (len(bvals), dwiname, img.shape[3]))
+    X = design_matrix(bvecs, bvals)
+    pinv = np.linalg.pinv(X)
+    dwi = img.dataobj
+    if maskname and os.path.exists(os.path.join(folder, maskname)):
+        mimg, mshape = load_3d(os.path.join(folder, maskname))
+        if mshape != shape:
+            raise ValueError('%s has a different shape than %s: %s vs %s' % (maskname, dwiname, mshape, shape))
+        mask = np.asarray(mimg.dataobj).reshape(shape) > 0
+    else:
+        # No mask: all voxels with a signal in the first b0 volume
+        mask = np.asarray(dwi[..., int(np.argmin(bvals))]) > 0
+    outputs = {'fa': np.zeros(shape, dtype=np.float32), 'md': np.zeros(shape, dtype=np.float32), 'rgb': np.zeros(shape + (3,), dtype=np.float32)}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(fit_slab, dwi, mask, z, min(z + slab_size, shape[2]), X, pinv, wls, outputs) for z in range(0, shape[2], slab_size)]
+        nvoxels = sum(f.result() for f in futures)
+    header = img.header.copy()
+    header.set_data_dtype(np.float32)
+    for name, data in outputs.items():
+        nib.save(nib.Nifti1Image(data, img.affine, header), os.path.join(folder, '%s%s.nii' % (prefix, name)))
+    return {'dwi': dwiname, 'volumes': len(bvals), 'bvalues': ' '.join('%g' % b for b in np.unique(np.round(bvals, -2))), 'voxels': nvoxels,
+            'fa_mean': float(outputs['fa'][mask].mean()) if nvoxels else float('nan'), 'md_mean': float(outputs['md'][mask].mean()) if nvoxels else float('nan')}
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Fast vectorized DTI tensor fitting v%s
+Description: Fit the diffusion tensor (log-linear least squares, optionally weighted) of the DWI of all subjects found recursively in the input folder, and save the FA, MD and RGB maps, for quality control.
+    ''' % __version__
+    ep = '''The maps are saved in each subject's folder as <prefix>fa.nii, <prefix>md.nii and <prefix>rgb.nii. Without a mask in the subject's folder, all voxels with a non-zero b0 signal are fitted.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder, all subfolders containing the DWI are considered as subjects.')
+    main_parser.add_argument('--dwi', metavar='dwicorr.nii', type=str, required=False, default='dwicorr.nii',
+                        help='Filename of the 4D DWI in each subject folder (default: dwicorr.nii, use dwi.nii for the raw data).')
+    main_parser.add_argument('--mask', metavar='mask.nii', type=str, required=False, default='mask.nii',
+                        help='Filename of the brain mask in each subject folder (default: mask.nii).')
+    main_parser.add_argument('--grad', metavar='grad.txt', type=str, required=False, default='grad.txt',
+                        help='Filename of the MRtrix gradient table in each subject folder (default: grad.txt).')
+    main_parser.add_argument('--bvecs', metavar='grad.bvecs', type=str, required=False, default=None,
+                        help='Filename of the FSL bvecs in each subject folder, to use instead of the MRtrix gradient table (with --bvals).')
+    main_parser.add_argument('--bvals', metavar='grad.bvals', type=str, required=False, default=None,
+                        help='Filename of the FSL bvals in each subject folder (with --bvecs).')
+    main_parser.add_argument('--prefix', metavar='dtifit_', type=str, required=False, default='dtifit_',
+                        help='Prefix of the maps saved in each subject folder (default: dtifit_).')
+    main_parser.add_argument('--wls', action='store_true', required=False, default=False,
+                        help='Refine the fit with a weighted least squares (slower, more accurate at high b-values).')
+    main_parser.add_argument('--summary', metavar='fit.csv', type=str, required=False, default=None,
+                        help='Save a summary table of all subjects (volumes, b-values, fitted voxels, mean FA and MD in the mask).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of threads (default: number of CPUs + 4, as concurrent.futures).')
+    main_parser.add_argument('--slab', metavar='4', type=int, required=False, default=4,
+                        help='Number of slices fitted at once per thread (lower to reduce memory usage).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if bool(args.bvecs) != bool(args.bvals):
+        main_parser.error('--bvecs and --bvals must be given together')
+
+    #### Main program
+    subjects = find_subjects(inputpath, args.dwi)
+    print('== Found %i subjects with %s in %s' % (len(subjects), args.dwi, inputpath))
+    rows = []
+    errors = []
+    for i, (subjid, folder) in enumerate(subjects):
+        start = time.time()
+        try:
+            row = fit_subject(folder, args.dwi, args.mask, args.grad, args.bvecs, args.bvals, args.prefix, args.wls, args.slab, args.jobs)
+        except Exception as exc:
+            errors.append((subjid, exc))
+            print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+            continue
+        row['subject'] = subjid
+        rows.append(row)
+        print('-> Subject %i/%i %s: %i voxels fitted in %.1fs, mean FA %.3f, mean MD %.2e' % (i+1, len(subjects), subjid, row['voxels'], time.time() - start, row['fa_mean'], row['md_mean']))
+    if args.summary:
+        with open(fullpath(args.summary), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    print('== Tensors of %i subjects fitted (%i errors)' % (len(rows), len(errors)))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# dti_stats.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Cohort FA/ROI statistics engine
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: compute for a whole cohort the same statistics that New_Patients_Prep_SingleshellACT_step2.sh writes per subject in DTIValueBefore.txt and DTIValueAfter.txt (`fslstats fa.nii -M -S -V` and `fslstats fathr015.nii -M -V`), and write them in one tidy table (one row per subject x threshold x ROI) instead of collecting the text files by hand.
+#
+# Each image is read only once, slab by slab from a memory map (so only one slab is in RAM at a time), and all statistics (all thresholds and all atlas ROIs) are accumulated at the same time with streaming sums. Subjects are processed in parallel in a pool of processes.
+#
+# Statistics follow fslstats conventions: only non-zero (and non-NaN) voxels are counted, a threshold t keeps voxels >= t (like `fslmaths -thr`), and the standard deviation is the sample one (n-1).
+#
+# Usage:
+#   python dti_stats.py -i /path/to/patients/ -o dti_stats.csv -t 0.15
+#   python dti_stats.py -i /path/to/patients/ -o dti_stats.csv -t 0.15 -t 0.2 --mask mask.nii --atlas aal_diff.nii
+#
+# Required libraries: numpy, nibabel. Optional: pandas + pyarrow to write Parquet files.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import os
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Columns of the output table, in order
+COLUMNS = ['subject', 'image', 'threshold', 'roi', 'voxels', 'volume', 'mean', 'sd']
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def find_subjects(inputpath, imname):
+    '''Find recursively all folders containing a file named imname. Return a sorted list of (subject id, folder), the subject id being the folder path relative to inputpath.'''
+    subjects = []
+    for dirpath, dirs, files in os.walk(inputpath):
+        dirs.sort()
+        if imname in files:
+            subjid = os.path.relpath(dirpath, inputpath)
+            if subjid == '.':
+                subjid = os.path.basename(os.path.normpath(inputpath))
+            subjects.append((subjid.replace(os.sep, '/'), dirpath))
+    return subjects
+
+def load_3d(filepath):
+    '''Load a 3D image lazily (memory mapped if uncompressed). Trailing singleton dimensions are dropped.'''
+    img = nib.load(filepath)
+    shape = img.shape
+    while len(shape) > 3 and shape[-1] == 1:
+        shape = shape[:-1]
+    if len(shape) != 3:
+        raise ValueError('%s is not a 3D image (shape %s)' % (filepath, img.shape))
+    return img, shape
+
+def iter_slabs(img, shape, slab_size):
+    '''Iterate over slabs of slab_size slices along the last spatial axis, which is the slowest varying axis on disk for NIfTI files (so each slab is a contiguous read)'''
+    for z in range(0, shape[2], slab_size):
+        # Slice the z axis explicitly, trailing singleton dimensions (eg, X,Y,Z,1) are indexed with 0
+        slab = np.asarray(img.dataobj[(slice(None), slice(None), slice(z, z + slab_size)) + (0,) * (len(img.shape) - 3)]).reshape(shape[0], shape[1], -1)
+        yield slab
+
+def summarize(count, total, total2):
+    '''Get mean and sample standard deviation from streaming sums'''
+    count = np.asarray(count, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+        var = np.where(count > 1, (total2 - count * mean**2) / (count - 1), np.nan)
+    return mean, np.sqrt(np.maximum(var, 0))
+
+
+
+#***********************************
+#                     ENGINE
+#***********************************
+
+def _grow(arr, size):
+    '''Grow the last axis of an accumulator array to size (new entries are zeros)'''
+    if arr.shape[-1] >= size:
+        return arr
+    return np.concatenate([arr, np.zeros(arr.shape[:-1] + (size - arr.shape[-1],), dtype=arr.dtype)], axis=-1)
+
+def image_stats(impath, thresholds=(0.0,), maskpath=None, atlaspath=None, slab_size=8):
+    '''Compute fslstats-like statistics of one image in a single pass, for all thresholds and optionally all ROIs of an atlas (label image in the same space).
+    Return a list of dicts (one per threshold x roi), roi being 'all' for the whole image.'''
+    img, shape = load_3d(impath)
+    vox_volume = float(np.prod(img.header.get_zooms()[:3]))
+    thresholds = list(thresholds)
+    nthr = len(thresholds)
+
+    # Open all images of this subject, they are all read slab by slab in lockstep
+    readers = [iter_slabs(img, shape, slab_size)]
+    for otherpath in (maskpath, atlaspath):
+        if otherpath:
+            oimg, oshape = load_3d(otherpath)
+            if oshape != shape:
+                raise ValueError('%s has a different shape than %s: %s vs %s' % (otherpath, impath, oshape, shape))
+            readers.append(iter_slabs(oimg, oshape, slab_size))
+
+    # Streaming sums: count, sum and sum of squares per threshold, for the whole image and per atlas label (indexed by the label value, grown as new labels are met)
+    count = np.zeros(nthr, dtype=np.int64)
+    total = np.zeros(nthr, dtype=np.float64)
+    total2 = np.zeros(nthr, dtype=np.float64)
+    roi_count = np.zeros((nthr, 1), dtype=np.int64)
+    roi_total = np.zeros((nthr, 1), dtype=np.float64)
+    roi_total2 = np.zeros((nthr, 1), dtype=np.float64)
+    roi_present = np.zeros(1, dtype=bool)
+    for slabs in zip(*readers):
+        data = slabs[0].astype(np.float64, copy=False).ravel()
+        valid = (data != 0) & ~np.isnan(data)
+        if maskpath:
+            valid &= slabs[1].ravel() != 0
+        if atlaspath:
+            labels = np.rint(slabs[-1].ravel()).astype(np.int64)
+            labels[labels < 0] = 0
+            nlabels = int(labels.max()) + 1 if labels.size else 1
+            roi_count, roi_total, roi_total2 = [_grow(a, nlabels) for a in (roi_count, roi_total, roi_total2)]
+            roi_present = _grow(roi_present, nlabels)
+            roi_present[:nlabels] |= np.bincount(labels, minlength=nlabels) > 0
+        for t, thr in enumerate(thresholds):
+            sel = valid & (data >= thr) if thr > 0 else valid
+            vals = data[sel]
+            count[t] += vals.size
+            total[t] += vals.sum()
+            total2[t] += np.dot(vals, vals)
+            if atlaspath:
+                lsel = labels[sel]
+                n = roi_count.shape[1]
+                roi_count[t] += np.bincount(lsel, minlength=n)
+                roi_total[t] += np.bincount(lsel, weights=vals, minlength=n)
+                roi_total2[t] += np.bincount(lsel, weights=vals*vals, minlength=n)
+
+    # Assemble the results, the whole image first then each label present in the atlas (label 0 is the background)
+    rois = [('all', count, total, total2)]
+    for label in np.flatnonzero(roi_present[1:]) + 1:
+        rois.append((str(label), roi_count[:, label], roi_total[:, label], roi_total2[:, label]))
+    rows = []
+    for roi, c, s, s2 in rois:
+        mean, sd = summarize(c, s, s2)
+        for t, thr in enumerate(thresholds):
+            rows.append({
+                'image': os.path.basename(impath),
+                'threshold': thr,
+                'roi': roi,
+                'voxels': int(c[t]),
+                'volume': c[t] * vox_volume,
+                'mean': mean[t],
+                'sd': sd[t],
+                })
+    return rows
+
+def subject_stats(args):
+    '''Worker: compute the statistics of all images of one subject. args is a tuple (subject id, folder, images names, thresholds, mask name, atlas name, slab size), so that it can be sent to a process pool.'''
+    subjid, folder, imnames, thresholds, maskname, atlasname, slab_size = args
+    maskpath = os.path.join(folder, maskname) if maskname else None
+    atlaspath = os.path.join(folder, atlasname) if atlasname else None
+    rows = []
+    for imname in imnames:
+        impath = os.path.join(folder, imname)
+        if not os.path.exists(impath):
+            continue
+        for row in image_stats(impath, thresholds, maskpath=maskpath, atlaspath=atlaspath, slab_size=slab_size):
+            row['subject'] = subjid
+            rows.append(row)
+    return rows
+
+def cohort_stats(subjects, imnames=('fa.nii',), thresholds=(0.0,), maskname=None, atlasname=None, slab_size=8, jobs=None, verbose=True):
+    '''Compute the statistics for all subjects (list of (subject id, folder)) in parallel. Return the list of rows, in the subjects order. Subjects that fail are reported and skipped.'''
+    tasks = [(subjid, folder, list(imnames), list(thresholds), maskname, atlasname, slab_size) for subjid, folder in subjects]
+    rows = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(subject_stats, task) for task in tasks]
+        for i, ((subjid, _), future) in enumerate(zip(subjects, futures)):
+            try:
+                rows.extend(future.result())
+                if verbose: print('Subject %i/%i done: %s' % (i+1, len(subjects), subjid))
+            except Exception as exc:
+                errors.append((subjid, exc))
+                print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+    return rows, errors
+
+def write_table(rows, outpath):
+    '''Write the rows to a CSV file, or to a Parquet file if the extension is .parquet (needs pandas and pyarrow)'''
+    if outpath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to write Parquet files, please pip install pandas pyarrow or use a .csv output.')
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(outpath, index=False)
+    else:
+        with open(outpath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Cohort FA/ROI statistics engine v%s
+Description: Compute fslstats-like statistics (mean, sd, voxels count and volume of non-zero voxels) of the FA maps (or any scalar map) of all subjects found recursively in the input folder, for several thresholds and optionally per atlas ROI, and save them in one table.
+    ''' % __version__
+    ep = '''The threshold 0 (non-zero voxels, as in DTIValueBefore.txt) is always computed. A threshold of 0.15 gives the same values as DTIValueAfter.txt.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder, all subfolders containing the image are considered as subjects.')
+    main_parser.add_argument('-o', '--output', metavar='stats.csv', type=str, required=True,
+                        help='Path to the output table (.csv or .parquet).')
+    main_parser.add_argument('--image', metavar='fa.nii', type=str, action='append', default=None,
+                        help='Filename of the image(s) to compute statistics on, in each subject folder (default: fa.nii). Can be repeated, eg to also get adc.nii statistics.')
+    main_parser.add_argument('-t', '--threshold', metavar='0.15', type=float, action='append', default=[],
+                        help='Lower threshold (voxels >= threshold are kept), can be repeated.')
+    main_parser.add_argument('--mask', metavar='mask.nii', type=str, required=False, default=None,
+                        help='Filename of a mask in each subject folder, only voxels inside the mask are considered.')
+    main_parser.add_argument('--atlas', metavar='atlas.nii', type=str, required=False, default=None,
+                        help='Filename of a label image in each subject folder (in the same space as the image), to also get statistics per ROI.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('--slab', metavar='8', type=int, required=False, default=8,
+                        help='Number of slices read at once per image (lower to reduce memory usage).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show more output).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    outpath = fullpath(args.output)
+    imnames = args.image or ['fa.nii']
+    thresholds = [0.0] + sorted(set(t for t in args.threshold if t > 0))
+
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    subjects = find_subjects(inputpath, imnames[0])
+    print('== Found %i subjects with %s in %s' % (len(subjects), imnames[0], inputpath))
+    rows, errors = cohort_stats(subjects, imnames, thresholds, maskname=args.mask, atlasname=args.atlas, slab_size=args.slab, jobs=args.jobs, verbose=args.verbose)
+    write_table(rows, outpath)
+    print('== Statistics of %i subjects saved to %s (%i errors)' % (len(subjects) - len(errors), outpath, len(errors)))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
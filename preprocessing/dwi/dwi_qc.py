@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# dwi_qc.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Per-volume and per-slice DWI artifact detector
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: detects the DWI volumes and slices corrupted by motion or signal dropout (frequent in DOC patients) in the raw (dwi.nii) or eddy corrected (dwicorr.nii) DWI of all subjects of a cohort, before eddy instead of after, or by eye in mrview.
+#
+# The 4D image is read volume by volume from a memory map (only one volume is in memory at a time), and the mean signal in the brain mask of each slice is computed (the signal of the volume being the median of its slice means, so that it is not affected by a few dropout slices). Since the signal depends on the b-value, the volumes are grouped by b-shell (b-values rounded to 100), and for each slice, the slice means are compared to the other volumes of the same shell with a robust z-score (distance to the median divided by 1.4826 x the median absolute deviation). A slice with a z-score below -threshold (default 4, as eddy --ol_nstd) is a dropout slice, and a volume whose signal has an absolute z-score above the volume threshold, or with at least --max-dropouts dropout slices, is an outlier volume. Shells with less than 4 volumes (usually the b0s) can not be tested and are never flagged. Subjects are processed in parallel in a pool of processes.
+#
+# In each subject's folder, the following files are written (prefixed by the DWI name, eg dwi_qc_...):
+# * _volumes.csv: the report, one row per volume (b-value, signal, z-score, number of dropout slices and the indices of the dropout slices, outlier flag).
+# * _outlier_map.txt: the dropout slices in the format of eddy's .eddy_outlier_map (one row per volume, one column per slice, 1 for a dropout).
+# * _exclude.txt: the indices (0-based, as eddy and FSL) of the outlier volumes, space separated.
+# * _keep.txt: the indices of the volumes to keep, comma separated, for `fslselectvols -i dwi.nii -o dwi_clean.nii --vols=$(cat dwi_qc_keep.txt)` (the same volumes must then be selected in grad.txt, grad.bvecs, grad.bvals and index.txt before eddy).
+#
+# Usage:
+#   python dwi_qc.py -i /path/to/patients/ -o dwi_qc.csv
+#   python dwi_qc.py -i /path/to/patients/ --dwi dwicorr.nii --threshold 5 --max-dropouts 2 -o dwicorr_qc.csv
+#
+# Required libraries: numpy, nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import os
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+from dti_stats import find_subjects, load_3d
+from dti_fit import read_gradients
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Columns of the per-volume report and of the cohort summary
+VOLUME_COLUMNS = ['volume', 'bvalue', 'signal', 'zscore', 'dropouts', 'dropout_slices', 'outlier']
+SUMMARY_COLUMNS = ['subject', 'dwi', 'volumes', 'shells', 'dropout_slices', 'outlier_volumes', 'excluded']
+# Minimum number of volumes in a shell to compute robust z-scores
+MIN_SHELL_VOLUMES = 4
+# Header of eddy's outlier map files
+OUTLIER_MAP_HEADER = 'One row per scan, one column per slice. Outlier: 1, Non-outlier: 0'
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def robust_zscores(values, axis=0):
+    '''Robust z-scores along an axis: (x - median) / (1.4826 * MAD). NaN where the MAD is 0 or the values are NaN.'''
+    median = np.nanmedian(values, axis=axis, keepdims=True)
+    mad = 1.4826 * np.nanmedian(np.abs(values - median), axis=axis, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(mad > 0, (values - median) / mad, np.nan)
+
+def slice_means(dwi, mask, nvols, axis=2, min_voxels=100):
+    '''Mean signal in the mask of each slice, for each volume, reading one volume at a time. Slices with less than min_voxels voxels in the mask are NaN. Returns (slices means (volumes, slices), signal of each volume (volumes,), which is the median of its slice means).'''
+    other = tuple(a for a in range(3) if a != axis)
+    counts = mask.sum(axis=other)
+    means = np.full((nvols, mask.shape[axis]), np.nan)
+    for v in range(nvols):
+        vol = np.asarray(dwi[..., v], dtype=np.float64).reshape(mask.shape) * mask
+        sums = vol.sum(axis=other)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[v] = np.where(counts >= min_voxels, sums / counts, np.nan)
+    with np.errstate(invalid='ignore'):
+        vmeans = np.nanmedian(means, axis=1) if np.any(counts >= min_voxels) else np.zeros(nvols)
+    return means, vmeans
+
+
+
+#***********************************
+#                     ENGINE
+#***********************************
+
+def qc_subject(args):
+    '''Worker: detect the dropout slices and the outlier volumes of one subject, and save the report, the outlier map and the exclusion lists in its folder. args is a tuple (subject id, folder, dwi name, mask name, grad name, bvecs name, bvals name, slice axis, threshold, volume threshold, max dropouts), so that it can be sent to a process pool. Returns the summary row.'''
+    subjid, folder, dwiname, maskname, gradname, bvecsname, bvalsname, axis, threshold, vol_threshold, max_dropouts = args
+    img = nib.load(os.path.join(folder, dwiname))
+    if len(img.shape) != 4:
+        raise ValueError('%s is not a 4D image (shape %s)' % (dwiname, img.shape))
+    shape, nvols = img.shape[:3], img.shape[3]
+    bvals = read_gradients(folder, img.affine, gradname, bvecsname, bvalsname)[1]
+    if len(bvals) != nvols:
+        raise ValueError('the gradient table has %i entries but %s has %i volumes' % (len(bvals), dwiname, nvols))
+    if maskname and os.path.exists(os.path.join(folder, maskname)):
+        mimg, mshape = load_3d(os.path.join(folder, maskname))
+        if mshape != shape:
+            raise ValueError('%s has a different shape than %s: %s vs %s' % (maskname, dwiname, mshape, shape))
+        mask = np.asarray(mimg.dataobj).reshape(shape) > 0
+    else:
+        # No mask: all voxels with a signal in the first b0 volume
+        mask = np.asarray(img.dataobj[..., int(np.argmin(bvals))]) > 0
+
+    means, vmeans = slice_means(img.dataobj, mask, nvols, axis)
+    # Robust z-scores of the slices and of the volumes within each shell
+    shells = np.round(bvals, -2)
+    zslices = np.full(means.shape, np.nan)
+    zvols = np.full(nvols, np.nan)
+    for shell in np.unique(shells):
+        sel = np.flatnonzero(shells == shell)
+        if len(sel) >= MIN_SHELL_VOLUMES:
+            zslices[sel] = robust_zscores(means[sel])
+            zvols[sel] = robust_zscores(vmeans[sel])
+    with np.errstate(invalid='ignore'):
+        dropouts = zslices < -threshold
+        outliers = (np.abs(zvols) > vol_threshold) | (dropouts.sum(axis=1) >= max_dropouts)
+    excluded = np.flatnonzero(outliers)
+    if len(excluded) and np.all(outliers[shells == shells.min()]):
+        print('WARNING: subject %s: all the b=%g volumes are outliers, check the data before excluding them' % (subjid, shells.min()), file=sys.stderr)
+
+    # Save the report, the outlier map and the exclusion lists
+    prefix = os.path.join(folder, os.path.splitext(os.path.splitext(dwiname)[0])[0] + '_qc')
+    with open(prefix + '_volumes.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=VOLUME_COLUMNS)
+        writer.writeheader()
+        for v in range(nvols):
+            writer.writerow({'volume': v, 'bvalue': bvals[v], 'signal': vmeans[v], 'zscore': zvols[v], 'dropouts': int(dropouts[v].sum()),
+                             'dropout_slices': ' '.join(str(s) for s in np.flatnonzero(dropouts[v])), 'outlier': int(outliers[v])})
+    with open(prefix + '_outlier_map.txt', 'w') as f:
+        f.write(OUTLIER_MAP_HEADER + '\n')
+        for row in dropouts.astype(int):
+            f.write(' '.join(str(x) for x in row) + ' \n')
+    with open(prefix + '_exclude.txt', 'w') as f:
+        f.write(' '.join(str(v) for v in excluded) + '\n')
+    with open(prefix + '_keep.txt', 'w') as f:
+        f.write(','.join(str(v) for v in np.flatnonzero(~outliers)) + '\n')
+    return {'subject': subjid, 'dwi': dwiname, 'volumes': nvols, 'shells': ' '.join('%g' % s for s in np.unique(shells)), 'dropout_slices': int(dropouts.sum()),
+            'outlier_volumes': len(excluded), 'excluded': ' '.join(str(v) for v in excluded)}
+
+def cohort_qc(subjects, dwiname, maskname, gradname, bvecsname, bvalsname, axis=2, threshold=4.0, vol_threshold=4.0, max_dropouts=3, jobs=None, verbose=True):
+    '''Check all subjects (list of (subject id, folder)) in parallel. Returns the summary rows in the subjects order and the list of errors. Subjects that fail are reported and skipped.'''
+    tasks = [(subjid, folder, dwiname, maskname, gradname, bvecsname, bvalsname, axis, threshold, vol_threshold, max_dropouts) for subjid, folder in subjects]
+    rows = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(qc_subject, task) for task in tasks]
+        for i, ((subjid, _), future) in enumerate(zip(subjects, futures)):
+            try:
+                row = future.result()
+                rows.append(row)
+                if verbose or row['outlier_volumes'] or row['dropout_slices']:
+                    print('-> Subject %i/%i %s: %i dropout slices, %i outlier volumes %s' % (i+1, len(subjects), subjid, row['dropout_slices'], row['outlier_volumes'], '(%s)' % row['excluded'] if row['excluded'] else ''))
+            except Exception as exc:
+                errors.append((subjid, exc))
+                print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+    return rows, errors
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Per-volume and per-slice DWI artifact detector v%s
+Description: Detect the dropout slices and the outlier volumes of the DWI of all subjects found recursively in the input folder, with robust z-scores of the slices and volumes signal within each b-shell, and save a report and eddy-compatible exclusion lists in each subject's folder.
+    ''' % __version__
+    ep = '''Without a mask in the subject's folder, all voxels with a non-zero b0 signal are used.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder, all subfolders containing the DWI are considered as subjects.')
+    main_parser.add_argument('-o', '--output', metavar='dwi_qc.csv', type=str, required=False, default=None,
+                        help='Path to a summary table of all subjects (dropout slices and outlier volumes).')
+    main_parser.add_argument('--dwi', metavar='dwi.nii', type=str, required=False, default='dwi.nii',
+                        help='Filename of the 4D DWI in each subject folder (default: dwi.nii, use dwicorr.nii for the eddy corrected data).')
+    main_parser.add_argument('--mask', metavar='mask.nii', type=str, required=False, default='mask.nii',
+                        help='Filename of the brain mask in each subject folder (default: mask.nii).')
+    main_parser.add_argument('--grad', metavar='grad.txt', type=str, required=False, default='grad.txt',
+                        help='Filename of the MRtrix gradient table in each subject folder (default: grad.txt).')
+    main_parser.add_argument('--bvecs', metavar='grad.bvecs', type=str, required=False, default=None,
+                        help='Filename of the FSL bvecs in each subject folder, to use instead of the MRtrix gradient table (with --bvals).')
+    main_parser.add_argument('--bvals', metavar='grad.bvals', type=str, required=False, default=None,
+                        help='Filename of the FSL bvals in each subject folder (with --bvecs).')
+    main_parser.add_argument('--axis', metavar='2', type=int, required=False, default=2, choices=[0, 1, 2],
+                        help='Axis of the slices (default: 2, axial slices for an axial acquisition).')
+    main_parser.add_argument('-t', '--threshold', metavar='4', type=float, required=False, default=4.0,
+                        help='Robust z-score below which a slice is a dropout (default: 4, as eddy --ol_nstd).')
+    main_parser.add_argument('--volume-threshold', metavar='4', type=float, required=False, default=4.0,
+                        help='Absolute robust z-score of the volume signal above which a volume is an outlier (default: 4).')
+    main_parser.add_argument('--max-dropouts', metavar='3', type=int, required=False, default=3,
+                        help='Number of dropout slices from which a volume is an outlier (default: 3).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show all subjects, not only those with artifacts).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if bool(args.bvecs) != bool(args.bvals):
+        main_parser.error('--bvecs and --bvals must be given together')
+
+    #### Main program
+    subjects = find_subjects(inputpath, args.dwi)
+    print('== Found %i subjects with %s in %s' % (len(subjects), args.dwi, inputpath))
+    rows, errors = cohort_qc(subjects, args.dwi, args.mask, args.grad, args.bvecs, args.bvals, axis=args.axis, threshold=args.threshold,
+                             vol_threshold=args.volume_threshold, max_dropouts=args.max_dropouts, jobs=args.jobs, verbose=args.verbose)
+    if args.output:
+        with open(fullpath(args.output), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    print('== %i subjects checked, %i with outlier volumes (%i errors)' % (len(rows), sum(1 for r in rows if r['outlier_volumes']), len(errors)))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# matlab_batch.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#       Persistent MATLAB batch runner
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: run a list of MATLAB commands inside a single MATLAB session, instead of launching a new `matlab -r "...;quit();"` process per command.
+# Starting MATLAB + SPM often takes longer than the computation itself (eg, in New_Patients_Prep_SingleshellACT_step2.sh, 5 MATLAB processes were launched one after the other), so here we start MATLAB once and feed every command through its standard input.
+# Each command is wrapped in a try/catch that prints a unique marker line with the elapsed time or the error message, so that we can time each command and stop at the first failure (instead of carrying on with missing files).
+#
+# Any program reading MATLAB-like commands from its standard input can be used instead of MATLAB (eg, `--matlab "octave-cli --quiet"`), which is also handy to test a commands list without MATLAB.
+#
+# Usage:
+#   python matlab_batch.py --addpath /path/to/dwi/scripts --preset act_step2
+#   python matlab_batch.py -f commands.txt   # one MATLAB command per line, lines starting with % or # are ignored
+#   python matlab_batch.py -c "disp(1)" -c "disp(2)"
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+# Commands of New_Patients_Prep_SingleshellACT_step2.sh (coregistration + resampling + masking), in the order they must run (each one needs the previous outputs)
+PRESETS = {
+    'act_step2': [
+        "process_spm_coreg_and_exit('fathr.nii', 'WM.nii', 'WMdiff.nii', 'WM.nii', 'GMdiff.nii', 'GM.nii')",
+        "process_spm_coreg_and_exit('fathr.nii', 'WM.nii', 'T1diff.nii', 'T1.nii')",
+        "Resample_im('mask.nii','WMdiff.nii','mask3.nii')",
+        "EA_masking('mask3.nii','WMdiff.nii','WMdiff_masked.nii')",
+        "Resample_im('WMdiff_masked.nii','mask.nii','WMdiff_masked2.nii')",
+        ],
+    }
+
+class MatlabCommandError(RuntimeError):
+    '''Raised when a command fails inside the MATLAB session (or when the session dies or times out)'''
+    def __init__(self, command, message):
+        self.command = command
+        self.message = message
+        super(MatlabCommandError, self).__init__("Command failed: %s\n%s" % (command, message))
+
+def matlab_quote(s):
+    '''Quote a string as a MATLAB char literal'''
+    return "'" + s.replace("'", "''") + "'"
+
+def read_commands_file(filepath):
+    '''Read a list of commands from a text file (one per line, empty lines and comments starting with % or # are skipped)'''
+    commands = []
+    with open(filepath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(('%', '#')):
+                commands.append(line)
+    return commands
+
+
+
+#***********************************
+#                    SESSION
+#***********************************
+
+class MatlabSession(object):
+    '''A single long-lived MATLAB (or compatible) process to which commands are sent one by one through a pipe.
+    Usage:
+        with MatlabSession() as mat:
+            elapsed = mat.run("disp('hello')")
+    '''
+
+    def __init__(self, executable='matlab -nodesktop -nosplash', cwd=None, echo=True, timeout=None):
+        if isinstance(executable, _str):
+            executable = shlex.split(executable)
+        self.executable = executable
+        self.cwd = cwd
+        self.echo = echo
+        self.timeout = timeout
+        self.proc = None
+        self.startup_time = None
+        self._lines = queue.Queue()
+        self._reader = None
+
+    def __enter__(self):
+        self.startup_time = self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(force=exc_type is not None)
+
+    def start(self):
+        '''Launch the process and wait until it accepts commands. Return the startup time in seconds.'''
+        t0 = time.time()
+        try:
+            self.proc = subprocess.Popen(self.executable, cwd=self.cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        except OSError as exc:
+            raise MatlabCommandError('<startup>', 'Cannot launch %s: %s' % (' '.join(self.executable), exc))
+        # Read the output in a separate thread, so that we can wait with a timeout (a blocking readline cannot be interrupted)
+        self._reader = threading.Thread(target=self._read_output)
+        self._reader.daemon = True
+        self._reader.start()
+        # The banner and startup scripts (eg, startup.m) are done once the first command is answered
+        self.run("disp('')")
+        return time.time() - t0
+
+    def _read_output(self):
+        for line in iter(self.proc.stdout.readline, ''):
+            self._lines.put(line)
+        self._lines.put(None)  # EOF, the process died or quitted
+
+    def run(self, command):
+        '''Run one command and wait for it to finish. Return the elapsed time in seconds (as measured by MATLAB), or raise MatlabCommandError if the command failed.'''
+        timeout = self.timeout
+        if self.proc is None or self.proc.poll() is not None:
+            raise MatlabCommandError(command, 'The MATLAB session is not running.')
+        marker = '__CSG_DONE_%s__' % uuid.uuid4().hex
+        # Everything must be on one line, since the interpreter executes stdin line by line
+        wrapped = ("try, csg_t0__ = tic; %s; fprintf('\\n%s OK %%.3f\\n', toc(csg_t0__)); "
+                   "catch csg_err__, fprintf('\\n%s ERR %%s\\n', regexprep(csg_err__.message, '[\\r\\n]+', ' | ')); end\n") % (command, marker, marker)
+        try:
+            self.proc.stdin.write(wrapped)
+            self.proc.stdin.flush()
+        except (IOError, OSError) as exc:
+            raise MatlabCommandError(command, 'Cannot send the command to the MATLAB session: %s' % exc)
+
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            try:
+                line = self._lines.get(timeout=max(0, deadline - time.time()) if deadline else None)
+            except queue.Empty:
+                self.close(force=True)
+                raise MatlabCommandError(command, 'Timeout after %g seconds, the MATLAB session was killed.' % timeout)
+            if line is None:
+                raise MatlabCommandError(command, 'The MATLAB session exited unexpectedly (return code %s).' % self.proc.wait())
+            if line.startswith(marker):
+                status, _, rest = line[len(marker):].strip().partition(' ')
+                if status == 'OK':
+                    return float(rest)
+                else:
+                    raise MatlabCommandError(command, rest)
+            elif self.echo:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+    def close(self, force=False):
+        '''Quit the session (or kill it if force is True)'''
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            if not force:
+                try:
+                    self.proc.stdin.write('quit\n')
+                    self.proc.stdin.close()
+                    self.proc.wait(timeout=60)
+                except Exception:
+                    force = True
+            if force and self.proc.poll() is None:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+
+def run_commands(commands, executable='matlab -nodesktop -nosplash', addpath=None, cwd=None, timeout=None, echo=True, verbose=True):
+    '''Run a list of commands in one MATLAB session, stopping at the first failure.
+    Return a list of (command, elapsed seconds) for each successful command, or raise MatlabCommandError.'''
+    if verbose: print('== Starting MATLAB session: %s' % executable)
+    with MatlabSession(executable, cwd=cwd, echo=echo, timeout=timeout) as mat:
+        timings = [('<startup>', mat.startup_time)]
+        if verbose: print('== MATLAB session ready in %.1fs' % mat.startup_time)
+        if addpath:
+            timings.append(('<addpath>', mat.run('addpath(genpath(%s))' % matlab_quote(addpath))))
+        for i, command in enumerate(commands):
+            if verbose: print('== Command %i/%i: %s' % (i+1, len(commands), command))
+            elapsed = mat.run(command)
+            timings.append((command, elapsed))
+            if verbose: print('== Command %i/%i done in %.1fs' % (i+1, len(commands), elapsed))
+    return timings
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Persistent MATLAB batch runner v%s
+Description: Run a list of MATLAB commands in a single MATLAB session, with per-command timing. Stops at the first failing command and returns a non-zero exit code.
+    ''' % __version__
+    ep = '''Presets: %s''' % ', '.join(sorted(PRESETS))
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-c', '--command', metavar='"cmd(args)"', type=str, action='append', default=[],
+                        help='MATLAB command to run (can be repeated, commands are run in the given order).')
+    main_parser.add_argument('-f', '--commands-file', metavar='commands.txt', type=str, required=False, default=None,
+                        help='Text file with one MATLAB command per line (run before --command ones).')
+    main_parser.add_argument('-p', '--preset', type=str, required=False, default=None, choices=sorted(PRESETS),
+                        help='Use a predefined list of commands (run before the others).')
+    main_parser.add_argument('-a', '--addpath', metavar='/some/path', type=str, required=False, default=None,
+                        help='Folder to add recursively to the MATLAB path before running the commands (eg, the folder of the DWI scripts).')
+    main_parser.add_argument('-m', '--matlab', metavar='"matlab -nodesktop -nosplash"', type=str, required=False, default='matlab -nodesktop -nosplash',
+                        help='Command line to launch the MATLAB session (or any compatible interpreter reading commands from stdin, eg: "octave-cli --quiet").')
+    main_parser.add_argument('-t', '--timeout', metavar='seconds', type=float, required=False, default=None,
+                        help='Maximum duration of each command (and of the startup), after which the session is killed and the batch fails.')
+    main_parser.add_argument('-q', '--quiet', action='store_true', required=False, default=False,
+                        help='Do not echo MATLAB output.')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+
+    commands = []
+    if args.preset:
+        commands.extend(PRESETS[args.preset])
+    if args.commands_file:
+        commands.extend(read_commands_file(args.commands_file))
+    commands.extend(args.command)
+    if not commands:
+        main_parser.error('No command to run, please specify --preset, --commands-file or --command.')
+
+    #### Main program
+    t0 = time.time()
+    try:
+        timings = run_commands(commands, executable=args.matlab, addpath=args.addpath, timeout=args.timeout, echo=not args.quiet)
+    except MatlabCommandError as exc:
+        print('\nERROR: %s' % exc, file=sys.stderr)
+        print('Stopping here, the remaining commands were NOT run.', file=sys.stderr)
+        return 1
+
+    # Timing report
+    print('\n== Timing report (total %.1fs):' % (time.time() - t0))
+    for command, elapsed in timings:
+        print('%8.1fs  %s' % (elapsed, command))
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
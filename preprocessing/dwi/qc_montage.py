@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# qc_montage.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Headless batch montage renderer for segmentation QC
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: renders the quality control views of New_Patients_Prep_SingleshellACT_step1.sh (the FAST white and grey matter segmentation over the skull stripped T1, previously `mricron t1_bet.nii -o t1_bet_pve_2.nii -o t1_bet_pve_1.nii`) and step2.sh (the WM mask over the coregistered WM, previously `mricron WMdiff.nii -o mask3.nii`) as PNG mosaics for all subjects, with an HTML index to flip through the whole cohort, instead of opening one mricron window per subject.
+#
+# The background and the overlays are read from memory maps, and only the displayed slices are sampled: evenly spaced slices inside the bounding box of the background, in the three orientations (one row each: axial, coronal and sagittal, in neurological convention: the subject's right on the right), with square pixels whatever the voxel size. The overlays are sampled at the world coordinates of the background pixels (nearest voxel), so they do not need to be in the same voxel grid as the background. The background is windowed between robust percentiles, and the overlays are composited with a vectorized alpha blending, the opacity being proportional to the overlay value (so partial volume maps are shown as such). The subjects are rendered in parallel processes, with the Agg backend of matplotlib (no display needed).
+#
+# Usage:
+#   python qc_montage.py -i /path/to/patients/ --preset act_step1 -o /path/to/qc
+#   python qc_montage.py -i /path/to/patients/ --preset act_step2 -o /path/to/qc
+#   python qc_montage.py -i /path/to/patients/ --background t1_bet.nii --overlay t1_bet_pve_2.nii --overlay t1_bet_pve_1.nii --slices 10 -o /path/to/qc
+#
+# Required libraries: numpy, nibabel, matplotlib.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import os
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+import numpy as np
+import nibabel as nib
+
+from dti_stats import find_subjects
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Backgrounds and overlays of the QC steps of the DWI ACT pipeline (same as the former mricron calls)
+PRESETS = {
+    'act_step1': ('t1_bet.nii', ['t1_bet_pve_2.nii', 't1_bet_pve_1.nii']),
+    'act_step2': ('WMdiff.nii', ['mask3.nii']),
+}
+# Colours of the overlays, in order (RGB between 0 and 1)
+COLORS = [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.4, 1.0), (1.0, 1.0, 0.0), (0.0, 1.0, 1.0), (1.0, 0.0, 1.0)]
+# Orientations, as the world axis (0: R, 1: A, 2: S) that is fixed in each row of the mosaic
+ORIENTATIONS = [2, 1, 0]
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+class Volume(object):
+    '''Memory mapped 3D image (the NIfTI scaling is applied to the sampled values only), with its orientation relative to RAS'''
+    def __init__(self, filepath):
+        img = nib.load(filepath)
+        shape = img.shape
+        while len(shape) > 3 and shape[-1] == 1:
+            shape = shape[:-1]
+        if len(shape) != 3:
+            raise ValueError('%s is not a 3D image (shape %s)' % (filepath, img.shape))
+        self.data = img.dataobj.get_unscaled().reshape(shape) if hasattr(img.dataobj, 'get_unscaled') else np.asarray(img.dataobj).reshape(shape)
+        slope, inter = getattr(img.dataobj, 'slope', 1.0), getattr(img.dataobj, 'inter', 0.0)
+        self.slope = 1.0 if slope is None or not np.isfinite(slope) or slope == 0 else float(slope)
+        self.inter = 0.0 if inter is None or not np.isfinite(inter) else float(inter)
+        self.affine = img.affine
+        self.shape = np.array(shape)
+        # Voxel axis and flip of each world axis (R, A, S)
+        ornt = nib.orientations.io_orientation(img.affine)
+        self.axis = np.zeros(3, dtype=np.int64)
+        self.flip = np.zeros(3, dtype=bool)
+        for voxaxis, (worldaxis, direction) in enumerate(ornt.astype(np.int64)):
+            self.axis[worldaxis] = voxaxis
+            self.flip[worldaxis] = direction < 0
+        self.zooms = np.sqrt((img.affine[:3, :3] ** 2).sum(axis=0))[self.axis]
+        self.cshape = self.shape[self.axis]
+
+    def sample(self, vox):
+        '''Values at integer voxel indices (..., 3), 0 outside of the volume'''
+        inside = np.all((vox >= 0) & (vox < self.shape), axis=-1)
+        values = np.zeros(vox.shape[:-1])
+        values[inside] = self.data[tuple(vox[inside].T)] * self.slope + self.inter
+        return values
+
+    def canonical_to_voxel(self, cidx):
+        '''Convert indices in the RAS oriented grid (..., 3) to voxel indices'''
+        vox = np.empty_like(cidx)
+        for w in range(3):
+            vox[..., self.axis[w]] = np.where(self.flip[w], self.cshape[w] - 1 - cidx[..., w], cidx[..., w])
+        return vox
+
+    def subsample(self, step=4):
+        '''Strided subsample of the volume (in voxel order), for the bounding box and the intensity statistics'''
+        return self.data[::step, ::step, ::step] * self.slope + self.inter
+
+def slice_grid(bg, worldaxis, cindex):
+    '''Background voxel indices of the pixels of a slice (height, width, 3), fixing the world axis worldaxis at the index cindex of the RAS grid, with square pixels: the first other axis is horizontal (increasing to the right), the second vertical (increasing upwards)'''
+    a, b = [w for w in range(3) if w != worldaxis]
+    pix = bg.zooms.min()
+    width = max(1, int(round(bg.cshape[a] * bg.zooms[a] / pix)))
+    height = max(1, int(round(bg.cshape[b] * bg.zooms[b] / pix)))
+    ca = ((np.arange(width) + 0.5) * bg.cshape[a] / width).astype(np.int64)
+    cb = ((np.arange(height) + 0.5) * bg.cshape[b] / height).astype(np.int64)[::-1]
+    cidx = np.empty((height, width, 3), dtype=np.int64)
+    cidx[..., worldaxis] = cindex
+    cidx[..., a] = ca[None, :]
+    cidx[..., b] = cb[:, None]
+    return bg.canonical_to_voxel(cidx)
+
+def bounding_box(bg, step=4):
+    '''Bounding box of the non-zero background voxels in the RAS grid, as (low, high) indices per world axis'''
+    sub = np.abs(bg.subsample(step)) > 0
+    low, high = np.zeros(3, dtype=np.int64), bg.cshape - 1
+    if sub.any():
+        for w in range(3):
+            other = tuple(x for x in range(3) if x != bg.axis[w])
+            nz = np.flatnonzero(sub.any(axis=other)) * step
+            lo, hi = nz[0], min(nz[-1] + step - 1, bg.shape[bg.axis[w]] - 1)
+            if bg.flip[w]:
+                lo, hi = bg.cshape[w] - 1 - hi, bg.cshape[w] - 1 - lo
+            low[w], high[w] = lo, hi
+    return low, high
+
+def pad_to(cell, height, width):
+    '''Center an RGB cell in a black cell of the given size'''
+    out = np.zeros((height, width, 3))
+    y, x = (height - cell.shape[0]) // 2, (width - cell.shape[1]) // 2
+    out[y:y+cell.shape[0], x:x+cell.shape[1]] = cell
+    return out
+
+
+
+#***********************************
+#                     ENGINE
+#***********************************
+
+def render_subject(args):
+    '''Worker: render the mosaic of one subject and save it as a PNG. args is a tuple (subject id, folder, background name, overlays names, output PNG path, slices per orientation, opacity), so that it can be sent to a process pool. Returns the PNG path.'''
+    subjid, folder, bgname, ovnames, pngpath, nslices, opacity = args
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.image
+
+    bg = Volume(os.path.join(folder, bgname))
+    overlays = [Volume(os.path.join(folder, ovname)) for ovname in ovnames]
+    # Intensity window of the background, and scale of the overlays (1 for masks and partial volume maps)
+    sub = bg.subsample()
+    sub = sub[sub != 0]
+    vmin, vmax = np.percentile(sub, [1, 99.5]) if sub.size else (0.0, 1.0)
+    scales = []
+    for ov in overlays:
+        osub = ov.subsample()
+        osub = osub[osub > 0]
+        scales.append(np.percentile(osub, 99) if osub.size else 1.0)
+    inv = [np.linalg.inv(ov.affine).dot(bg.affine) for ov in overlays]
+
+    low, high = bounding_box(bg)
+    rows = []
+    for worldaxis in ORIENTATIONS:
+        cells = []
+        # Evenly spaced slices inside the bounding box, without the borders
+        for cindex in np.linspace(low[worldaxis], high[worldaxis], nslices + 2)[1:-1].round().astype(np.int64):
+            vox = slice_grid(bg, worldaxis, cindex)
+            gray = np.clip((bg.sample(vox) - vmin) / max(vmax - vmin, 1e-12), 0, 1)
+            rgb = np.repeat(gray[..., None], 3, axis=-1)
+            for ov, m, scale, color in zip(overlays, inv, scales, COLORS * (len(overlays) // len(COLORS) + 1)):
+                # Overlay voxels at the world coordinates of the background pixels
+                ovox = np.rint(vox.dot(m[:3, :3].T) + m[:3, 3]).astype(np.int64)
+                alpha = opacity * np.clip(ov.sample(ovox) / scale, 0, 1)[..., None]
+                rgb = rgb * (1 - alpha) + np.array(color) * alpha
+            cells.append(rgb)
+        rows.append(cells)
+    height = max(c.shape[0] for row in rows for c in row)
+    width = max(c.shape[1] for row in rows for c in row)
+    mosaic = np.concatenate([np.concatenate([pad_to(c, height, width) for c in row], axis=1) for row in rows], axis=0)
+    matplotlib.image.imsave(pngpath, np.clip(mosaic, 0, 1))
+    return pngpath
+
+def write_index(entries, htmlpath, title):
+    '''Write the HTML index of the mosaics: entries is a list of (subject id, PNG path or None, error message or None). Use the n/p keys to go to the next/previous subject.'''
+    lines = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>%s</title>' % escape(title),
+             '<style>body{background:#111;color:#ddd;font-family:sans-serif} img{max-width:100%} .subject{margin-bottom:2em} .error{color:#f66}</style>',
+             '</head><body>', '<h1>%s (%i subjects)</h1>' % (escape(title), len(entries)), '<p>Keys: n = next subject, p = previous subject.</p>']
+    for i, (subjid, pngpath, error) in enumerate(entries):
+        lines.append('<div class="subject" id="s%i"><h2>%i. %s</h2>' % (i, i + 1, escape(subjid)))
+        if pngpath:
+            lines.append('<img loading="lazy" src="%s" alt="%s">' % (escape(os.path.relpath(pngpath, os.path.dirname(htmlpath)).replace(os.sep, '/')), escape(subjid)))
+        else:
+            lines.append('<p class="error">ERROR: %s</p>' % escape(str(error)))
+        lines.append('</div>')
+    lines.append('''<script>
+var cur = 0, n = %i;
+document.addEventListener('keydown', function(e) {
+    if (e.key == 'n' || e.key == 'p') {
+        cur = Math.max(0, Math.min(n - 1, cur + (e.key == 'n' ? 1 : -1)));
+        document.getElementById('s' + cur).scrollIntoView();
+    }
+});
+</script>''' % len(entries))
+    lines.append('</body></html>')
+    with open(htmlpath, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Headless batch montage renderer for segmentation QC v%s
+Description: Render a PNG mosaic of evenly spaced axial, coronal and sagittal slices of a background image with coloured overlays, for all subjects found recursively in the input folder, and an HTML index of all the mosaics.
+    ''' % __version__
+    ep = '''Presets: act_step1 (t1_bet.nii with t1_bet_pve_2.nii in red and t1_bet_pve_1.nii in green) and act_step2 (WMdiff.nii with mask3.nii in red).
+The mosaics are saved as <subject>_<background name>.png in the output folder, and the index as <background name>_index.html.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder, all subfolders containing the background image are considered as subjects.')
+    main_parser.add_argument('-o', '--output', metavar='/some/path', type=str, required=True,
+                        help='Folder where to save the mosaics and the HTML index (created if needed).')
+    main_parser.add_argument('--preset', type=str, required=False, default=None, choices=sorted(PRESETS),
+                        help='Background and overlays of a QC step of the DWI ACT pipeline.')
+    main_parser.add_argument('--background', metavar='t1_bet.nii', type=str, required=False, default=None,
+                        help='Filename of the background image in each subject folder.')
+    main_parser.add_argument('--overlay', metavar='t1_bet_pve_2.nii', type=str, action='append', default=None,
+                        help='Filename of an overlay in each subject folder, can be repeated (colours: red, green, blue, yellow, cyan, magenta).')
+    main_parser.add_argument('--slices', metavar='8', type=int, required=False, default=8,
+                        help='Number of slices per orientation (default: 8).')
+    main_parser.add_argument('--opacity', metavar='0.5', type=float, required=False, default=0.5,
+                        help='Opacity of the overlays where they are maximal, between 0 and 1 (default: 0.5, as mricron -b 50).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show more output).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    outpath = fullpath(args.output)
+    bgname, ovnames = PRESETS[args.preset] if args.preset else (None, [])
+    bgname = args.background or bgname
+    ovnames = args.overlay or ovnames
+    if not bgname:
+        main_parser.error('a background image is needed, use --background or --preset')
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if not os.path.exists(outpath):
+        os.makedirs(outpath)
+
+    #### Main program
+    subjects = find_subjects(inputpath, bgname)
+    print('== Found %i subjects with %s in %s' % (len(subjects), bgname, inputpath))
+    bgbase = os.path.splitext(os.path.splitext(bgname)[0])[0]
+    tasks = [(subjid, folder, bgname, ovnames, os.path.join(outpath, '%s_%s.png' % (subjid.replace('/', '_'), bgbase)), args.slices, args.opacity) for subjid, folder in subjects]
+    entries = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(render_subject, task) for task in tasks]
+        for i, ((subjid, _), future) in enumerate(zip(subjects, futures)):
+            try:
+                entries.append((subjid, future.result(), None))
+                if args.verbose: print('Subject %i/%i done: %s' % (i+1, len(subjects), subjid))
+            except Exception as exc:
+                entries.append((subjid, None, exc))
+                errors.append((subjid, exc))
+                print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+    htmlpath = os.path.join(outpath, bgbase + '_index.html')
+    write_index(entries, htmlpath, 'QC of %s%s' % (bgname, ' with ' + ', '.join(ovnames) if ovnames else ''))
+    print('== Mosaics of %i subjects saved, open %s to review them (%i errors)' % (len(subjects) - len(errors), htmlpath, len(errors)))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# tck_connectome.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Structural connectome builder from tck and a parcellation
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: builds the structural connectome of all subjects of a cohort in one run, from the whole-brain tractogram (Allbrain.tck, generated by New_Patients_Prep_SingleshellACT_step3.sh or the other DWI pipelines) and a parcellation in the subject's native space (eg, aalnative.nii), like `tck2connectome Allbrain.tck aalnative.nii Connectome.csv`.
+#
+# The streamlines are read by chunks from a memory map of the tck file (see tck_io.py), the two endpoints of all the streamlines of a chunk are converted to voxel coordinates of the parcellation with one matrix product, and their labels are looked up at once. The edges are accumulated with np.add.at in a N x N matrix (N being the highest label) of streamline counts, and optionally of mean streamline length (--length) and of mean FA along the streamlines (--fa fa.nii, sampled at each point of the streamlines, nearest voxel). Each tck file is split in several ranges of streamlines, processed in parallel processes, and the partial matrices are summed.
+#
+# As in tck2connectome, an endpoint that is not in a labelled voxel is assigned to the closest labelled voxel within a radius (--radius, 4 mm by default, 0 to only use the voxel containing the endpoint), and streamlines with an unassigned endpoint are not counted. The matrices are symmetric (row and column i are the label i), and saved in each subject's folder as comma separated values (no header), the diagonal (streamlines connecting a region to itself) being kept unless --zero-diagonal is given.
+#
+# Usage:
+#   python tck_connectome.py -i /path/to/patients/ --atlas aalnative.nii --zero-diagonal
+#   python tck_connectome.py -i /path/to/patients/ --atlas aalnative.nii --length --fa fa.nii --summary connectomes.csv -j 8
+#
+# Required libraries: numpy, nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import multiprocessing
+import os
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dti_stats import find_subjects, load_3d
+from tck_io import TckFile, CHUNK_POINTS, world_to_voxel, streamline_starts, streamline_lengths_mm
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Columns of the summary table
+SUMMARY_COLUMNS = ['subject', 'streamlines', 'assigned', 'nodes', 'edges', 'density']
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def load_volume(filepath, dtype):
+    '''Load a 3D image in memory, with its affine and voxel sizes'''
+    img, shape = load_3d(filepath)
+    data = np.asarray(img.dataobj).reshape(shape)
+    return data.astype(dtype, copy=False), img.affine, np.sqrt((img.affine[:3, :3] ** 2).sum(axis=0))
+
+def lookup(volume, vox):
+    '''Values of a volume at the nearest voxel of continuous voxel coordinates. Returns (values, inside mask), values being 0 outside of the volume.'''
+    idx = np.rint(vox).astype(np.int64)
+    inside = np.all((idx >= 0) & (idx < np.array(volume.shape)), axis=1)
+    values = np.zeros(len(vox), dtype=volume.dtype)
+    values[inside] = volume[tuple(idx[inside].T)]
+    return values, inside
+
+def assign_endpoints(labels, vox, zooms, radius=0.0, batch=4096):
+    '''Label of each endpoint (continuous voxel coordinates of the parcellation): the label of the voxel containing it, or if unlabelled, of the closest labelled voxel within radius (in mm). 0 if unassigned.'''
+    lab = lookup(labels, vox)[0]
+    if radius <= 0:
+        return lab
+    miss = np.flatnonzero(lab == 0)
+    if miss.size == 0:
+        return lab
+    # Offsets of all the voxels that can be within the radius
+    r = np.ceil(radius / zooms).astype(np.int64)
+    grid = np.mgrid[-r[0]:r[0]+1, -r[1]:r[1]+1, -r[2]:r[2]+1].reshape(3, -1).T
+    shape = np.array(labels.shape)
+    for b in range(0, miss.size, batch):
+        sel = miss[b:b+batch]
+        cand = np.rint(vox[sel]).astype(np.int64)[:, None, :] + grid[None, :, :]
+        dist = np.sqrt((((cand - vox[sel][:, None, :]) * zooms) ** 2).sum(axis=-1))
+        ok = np.all((cand >= 0) & (cand < shape), axis=-1) & (dist <= radius)
+        clab = np.zeros(ok.shape, dtype=labels.dtype)
+        clab[ok] = labels[tuple(cand[ok].T)]
+        dist[clab == 0] = np.inf
+        best = dist.argmin(axis=1)
+        rows = np.arange(len(sel))
+        found = np.isfinite(dist[rows, best])
+        lab[sel[found]] = clab[rows, best][found]
+    return lab
+
+def symmetrize(upper):
+    '''Full symmetric matrix from a matrix accumulated on the upper triangle'''
+    return upper + upper.T - np.diag(np.diag(upper))
+
+
+
+#***********************************
+#                     ENGINE
+#***********************************
+
+def connectome_part(args):
+    '''Worker: accumulate the connectome of the streamlines starting in a range of rows of a tck file. args is a tuple (tck path, first row, last row, parcellation path, fa path or None, radius, chunk size), so that it can be sent to a process pool.
+    Returns a dict of the partial upper triangular matrices (count, and length and fa sums) and the number of streamlines and of assigned streamlines.'''
+    tckpath, lo, hi, atlaspath, fapath, radius, chunk_points = args
+    labels, affine, zooms = load_volume(atlaspath, np.int64)
+    labels[labels < 0] = 0
+    nnodes = int(labels.max())
+    if fapath:
+        fa, fa_affine, _ = load_volume(fapath, np.float64)
+    res = {'count': np.zeros((nnodes, nnodes)), 'length': np.zeros((nnodes, nnodes)), 'fa': np.zeros((nnodes, nnodes)) if fapath else None, 'streamlines': 0, 'assigned': 0}
+    tck = TckFile(tckpath)
+    for points, lengths in tck.chunks(lo, hi, chunk_points):
+        starts = streamline_starts(lengths)
+        # Both endpoints of all streamlines of the chunk
+        vox = world_to_voxel(np.concatenate([points[starts], points[starts + lengths - 1]]), affine)
+        ends = assign_endpoints(labels, vox, zooms, radius).reshape(2, -1)
+        valid = (ends[0] > 0) & (ends[1] > 0)
+        # Upper triangle (row <= column), 0-based node indices
+        row = np.minimum(ends[0], ends[1])[valid] - 1
+        col = np.maximum(ends[0], ends[1])[valid] - 1
+        np.add.at(res['count'], (row, col), 1)
+        np.add.at(res['length'], (row, col), streamline_lengths_mm(points, lengths)[valid])
+        if fapath:
+            # Mean FA of each streamline over its points inside the FA map
+            values, inside = lookup(fa, world_to_voxel(points, fa_affine))
+            ids = np.repeat(np.arange(len(lengths)), lengths)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                meanfa = np.bincount(ids[inside], weights=values[inside], minlength=len(lengths)) / np.bincount(ids[inside], minlength=len(lengths))
+            np.add.at(res['fa'], (row, col), np.nan_to_num(meanfa[valid]))
+        res['streamlines'] += len(lengths)
+        res['assigned'] += int(valid.sum())
+    return res
+
+def cohort_connectomes(subjects, tckname, atlasname, faname=None, radius=4.0, split=1, chunk_points=CHUNK_POINTS, jobs=None, verbose=True):
+    '''Build the connectomes of all subjects (list of (subject id, folder)), each tck file being split in split ranges of rows, all processed in one pool of processes.
+    Returns a list of (subject id, folder, results dict with the full symmetric matrices) in the subjects order, and the list of errors. Subjects that fail are reported and skipped.'''
+    results = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        submitted = []
+        for subjid, folder in subjects:
+            try:
+                atlaspath = os.path.join(folder, atlasname)
+                fapath = os.path.join(folder, faname) if faname else None
+                for path in (atlaspath, fapath):
+                    if path and not os.path.exists(path):
+                        raise IOError('%s does not exist' % path)
+                tckpath = os.path.join(folder, tckname)
+                futures = [executor.submit(connectome_part, (tckpath, lo, hi, atlaspath, fapath, radius, chunk_points)) for lo, hi in TckFile(tckpath).ranges(split)]
+                submitted.append((subjid, folder, futures))
+            except Exception as exc:
+                errors.append((subjid, exc))
+                print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+        for i, (subjid, folder, futures) in enumerate(submitted):
+            try:
+                parts = [future.result() for future in futures]
+                total = {}
+                for key in ('count', 'length', 'fa'):
+                    total[key] = symmetrize(sum(p[key] for p in parts)) if parts and parts[0][key] is not None else None
+                total['streamlines'] = sum(p['streamlines'] for p in parts)
+                total['assigned'] = sum(p['assigned'] for p in parts)
+                results.append((subjid, folder, total))
+                if verbose: print('Subject %i/%i done: %s' % (i+1, len(submitted), subjid))
+            except Exception as exc:
+                errors.append((subjid, exc))
+                print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+    return results, errors
+
+def mean_weights(total, count):
+    '''Mean weight per edge from the sum of the weights and the streamline counts (0 where there is no streamline)'''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, 0.0)
+
+def write_matrix(matrix, outpath, zero_diagonal=False):
+    '''Write a matrix as comma separated values, atomically'''
+    if zero_diagonal:
+        matrix = matrix.copy()
+        np.fill_diagonal(matrix, 0)
+    tmppath = outpath + '.tmp'
+    with open(tmppath, 'w') as f:
+        np.savetxt(f, matrix, fmt='%.10g', delimiter=',')
+    os.replace(tmppath, outpath)
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Structural connectome builder from tck and a parcellation v%s
+Description: Build the streamline count matrix (and optionally the mean length and mean FA matrices) between the regions of a parcellation, from the whole-brain tractogram of all subjects found recursively in the input folder, like tck2connectome.
+    ''' % __version__
+    ep = '''The matrices are saved in each subject's folder: Connectome.csv (streamline counts), Connectome_length.csv and Connectome_fa.csv (with the --output name as the prefix).'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder, all subfolders containing the tractogram are considered as subjects.')
+    main_parser.add_argument('--tck', metavar='Allbrain.tck', type=str, required=False, default='Allbrain.tck',
+                        help='Filename of the tractogram in each subject folder (default: Allbrain.tck).')
+    main_parser.add_argument('--atlas', metavar='aalnative.nii', type=str, required=False, default='aalnative.nii',
+                        help='Filename of the parcellation (label image in the subject space) in each subject folder (default: aalnative.nii).')
+    main_parser.add_argument('-o', '--output', metavar='Connectome.csv', type=str, required=False, default='Connectome.csv',
+                        help='Filename of the count matrix saved in each subject folder (default: Connectome.csv).')
+    main_parser.add_argument('--length', action='store_true', required=False, default=False,
+                        help='Also save the mean streamline length (in mm) matrix.')
+    main_parser.add_argument('--fa', metavar='fa.nii', type=str, required=False, default=None,
+                        help='Filename of the FA map in each subject folder, to also save the matrix of the mean FA along the streamlines.')
+    main_parser.add_argument('--radius', metavar='4', type=float, required=False, default=4.0,
+                        help='Radius (in mm) of the search of the closest labelled voxel for endpoints outside of the parcellation (default: 4 as tck2connectome, 0 to disable).')
+    main_parser.add_argument('--zero-diagonal', action='store_true', required=False, default=False,
+                        help='Set the diagonal of the matrices to zero (like tck2connectome -zero_diagonal).')
+    main_parser.add_argument('--summary', metavar='connectomes.csv', type=str, required=False, default=None,
+                        help='Save a summary table of all subjects (streamlines, assigned streamlines, nodes, edges and density).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('--split', metavar='N', type=int, required=False, default=None,
+                        help='Number of ranges each tractogram is split in, for parallel processing (default: enough to use all processes).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show more output).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    subjects = find_subjects(inputpath, args.tck)
+    print('== Found %i subjects with %s in %s' % (len(subjects), args.tck, inputpath))
+    if not subjects:
+        return 1
+    jobs = args.jobs or multiprocessing.cpu_count()
+    split = args.split or max(1, -(-jobs // len(subjects)))
+    results, errors = cohort_connectomes(subjects, args.tck, args.atlas, faname=args.fa, radius=args.radius, split=split, jobs=jobs, verbose=args.verbose)
+
+    prefix = os.path.splitext(args.output)[0]
+    summary = []
+    for subjid, folder, res in results:
+        count = res['count']
+        write_matrix(count, os.path.join(folder, args.output), args.zero_diagonal)
+        if args.length:
+            write_matrix(mean_weights(res['length'], count), os.path.join(folder, prefix + '_length.csv'), args.zero_diagonal)
+        if args.fa:
+            write_matrix(mean_weights(res['fa'], count), os.path.join(folder, prefix + '_fa.csv'), args.zero_diagonal)
+        nnodes = count.shape[0]
+        offdiag = count[np.triu_indices(nnodes, 1)]
+        edges = int((offdiag > 0).sum())
+        summary.append({'subject': subjid, 'streamlines': res['streamlines'], 'assigned': res['assigned'], 'nodes': nnodes, 'edges': edges, 'density': float(edges) / max(1, nnodes * (nnodes - 1) // 2)})
+        print('-> %s: %i/%i streamlines assigned, %i edges' % (subjid, res['assigned'], res['streamlines'], edges))
+    if args.summary:
+        with open(fullpath(args.summary), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+            writer.writeheader()
+            writer.writerows(summary)
+    print('== Connectomes of %i subjects saved (%i errors)' % (len(results), len(errors)))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
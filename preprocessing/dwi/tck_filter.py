@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# tck_filter.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Vectorized ROI include/exclude streamline filtering
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: extracts several bundles (eg, corticospinal tract, arcuate fasciculus) from the whole-brain tractogram (Allbrain.tck) of all subjects of a cohort in one run, with include and exclude ROIs (mask images), like `tckedit -include roi1.nii -include roi2.nii -exclude roi3.nii Allbrain.tck bundle.tck` but for all bundles with a single read of the tractogram, instead of running tckgen or tckedit once per bundle.
+#
+# All the masks used by the bundles are combined in one bitmask image per voxel grid (bit m of a voxel is set if it is inside mask m, so up to 64 masks). The streamlines are read by chunks from a memory map of the tck file (see tck_io.py), all the points of a chunk are converted to voxel indices with one matrix product, and the bits of the voxels are looked up at once and OR-reduced per streamline, so that each streamline gets the set of masks it traverses. A bundle is then a test on these sets for all the streamlines of the chunk: all its include masks and none of its exclude masks, and the selected streamlines are appended to the bundle's tck file. Subjects are processed in parallel in a pool of processes.
+#
+# Each bundle is defined as NAME=mask1.nii,mask2.nii,-mask3.nii: the masks (in each subject's folder) must all be traversed, except those prefixed by - which must not be traversed. Mask voxels are those with a value above 0.5 (as MRtrix), and a streamline traverses a mask if one of its points is in a mask voxel (nearest voxel), so the tractogram step size must be small compared to the voxels (as with tckgen defaults). The bundles are saved in each subject's folder as NAME.tck.
+#
+# Usage:
+#   python tck_filter.py -i /path/to/patients/ --bundle "cst_left=motor_left.nii,brainstem.nii,-midline.nii" --bundle "cst_right=motor_right.nii,brainstem.nii,-midline.nii"
+#   python tck_filter.py -i /path/to/patients/ --tck Allbrain.tck --bundle "af_left=broca_left.nii,wernicke_left.nii" -j 8
+#
+# Required libraries: numpy, nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import os
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dti_stats import find_subjects, load_3d
+from tck_io import TckFile, TckWriter, CHUNK_POINTS, world_to_voxel, streamline_starts
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Maximum number of distinct masks (one bit each in the bitmask images)
+MAX_MASKS = 64
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def parse_bundle(spec):
+    '''Parse a bundle definition "NAME=mask1.nii,mask2.nii,-mask3.nii" into (name, include masks, exclude masks)'''
+    name, sep, masks = spec.partition('=')
+    masks = [m.strip() for m in masks.split(',') if m.strip()]
+    if not sep or not name.strip() or not masks:
+        raise ValueError('invalid bundle definition "%s", expected NAME=mask1.nii,mask2.nii,-mask3.nii' % spec)
+    include = [m for m in masks if not m.startswith('-')]
+    exclude = [m[1:] for m in masks if m.startswith('-')]
+    if not include:
+        raise ValueError('the bundle %s has no include mask' % name)
+    return name.strip(), include, exclude
+
+def build_bitmasks(folder, masknames):
+    '''Combine the masks in one bitmask image per voxel grid: bit m of a voxel is set if it is in the mask masknames[m]. Returns a list of (bitmask volume, affine).'''
+    dtype = np.uint64 if len(masknames) > 32 else np.uint32 if len(masknames) > 16 else np.uint16 if len(masknames) > 8 else np.uint8
+    grids = []
+    for m, maskname in enumerate(masknames):
+        img, shape = load_3d(os.path.join(folder, maskname))
+        inmask = np.asarray(img.dataobj).reshape(shape) > 0.5
+        for bits, affine in grids:
+            if bits.shape == shape and np.allclose(affine, img.affine, atol=1e-4):
+                break
+        else:
+            bits, affine = np.zeros(shape, dtype=dtype), img.affine
+            grids.append((bits, affine))
+        bits[inmask] |= dtype(1) << dtype(m)
+    return grids
+
+def traversed_masks(grids, points, lengths):
+    '''Set of the masks traversed by each streamline of a chunk, as a bitmask per streamline'''
+    dtype = grids[0][0].dtype.type
+    hits = np.zeros(len(lengths), dtype=dtype)
+    starts = streamline_starts(lengths)
+    for bits, affine in grids:
+        idx = np.rint(world_to_voxel(points, affine)).astype(np.int64)
+        inside = np.all((idx >= 0) & (idx < np.array(bits.shape)), axis=1)
+        pointbits = np.zeros(len(points), dtype=dtype)
+        pointbits[inside] = bits[tuple(idx[inside].T)]
+        hits |= np.bitwise_or.reduceat(pointbits, starts)
+    return hits
+
+
+
+#***********************************
+#                     ENGINE
+#***********************************
+
+def filter_subject(args):
+    '''Worker: extract all bundles of one subject with a single read of its tractogram. args is a tuple (subject id, folder, tck name, bundles as a list of (name, include masks, exclude masks), chunk size), so that it can be sent to a process pool. Returns (number of streamlines, dict of the number of streamlines per bundle).'''
+    subjid, folder, tckname, bundles, chunk_points = args
+    masknames = sorted(set(m for _, include, exclude in bundles for m in include + exclude))
+    grids = build_bitmasks(folder, masknames)
+    dtype = grids[0][0].dtype.type
+    # Include and exclude bitmasks of each bundle
+    tests = []
+    for name, include, exclude in bundles:
+        inc = dtype(sum(1 << masknames.index(m) for m in include))
+        exc = dtype(sum(1 << masknames.index(m) for m in exclude))
+        tests.append((name, inc, exc))
+    tck = TckFile(os.path.join(folder, tckname))
+    writers = [TckWriter(os.path.join(folder, name + '.tck'), tck.header) for name, _, _ in tests]
+    nstreamlines = 0
+    try:
+        for points, lengths in tck.chunks(chunk_points=chunk_points):
+            hits = traversed_masks(grids, points, lengths)
+            for (name, inc, exc), writer in zip(tests, writers):
+                selected = ((hits & inc) == inc) & ((hits & exc) == 0)
+                if selected.any():
+                    # Points of the selected streamlines
+                    keep = np.repeat(selected, lengths)
+                    writer.write(points[keep], lengths[selected])
+            nstreamlines += len(lengths)
+    except Exception:
+        for writer in writers:
+            writer.abort()
+        raise
+    for writer in writers:
+        writer.close()
+    return nstreamlines, dict((writer.path, writer.count) for writer in writers)
+
+def cohort_filter(subjects, tckname, bundles, chunk_points=CHUNK_POINTS, jobs=None, verbose=True):
+    '''Extract the bundles of all subjects (list of (subject id, folder)) in parallel. Returns the list of (subject id, number of streamlines, counts per bundle) and the list of errors. Subjects that fail are reported and skipped.'''
+    tasks = [(subjid, folder, tckname, bundles, chunk_points) for subjid, folder in subjects]
+    results = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(filter_subject, task) for task in tasks]
+        for i, ((subjid, _), future) in enumerate(zip(subjects, futures)):
+            try:
+                nstreamlines, counts = future.result()
+                results.append((subjid, nstreamlines, counts))
+                if verbose: print('-> Subject %i/%i %s: %s (of %i streamlines)' % (i+1, len(subjects), subjid, ', '.join('%s %i' % (os.path.basename(p), c) for p, c in counts.items()), nstreamlines))
+            except Exception as exc:
+                errors.append((subjid, exc))
+                print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+    return results, errors
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Vectorized ROI include/exclude streamline filtering v%s
+Description: Extract several bundles from the tractogram of all subjects found recursively in the input folder, with include and exclude masks (like tckedit -include/-exclude), with a single read of each tractogram.
+    ''' % __version__
+    ep = '''A bundle is defined as NAME=mask1.nii,mask2.nii,-mask3.nii (masks in each subject folder, those prefixed by - are excluded), and saved as NAME.tck in each subject folder.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder, all subfolders containing the tractogram are considered as subjects.')
+    main_parser.add_argument('--tck', metavar='Allbrain.tck', type=str, required=False, default='Allbrain.tck',
+                        help='Filename of the tractogram in each subject folder (default: Allbrain.tck).')
+    main_parser.add_argument('-b', '--bundle', metavar='NAME=roi1.nii,-roi2.nii', type=str, action='append', required=True,
+                        help='Definition of a bundle, can be repeated.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('--chunk', metavar='1048576', type=int, required=False, default=CHUNK_POINTS,
+                        help='Number of points read at once per tractogram (lower to reduce memory usage).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show more output).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    try:
+        bundles = [parse_bundle(spec) for spec in args.bundle]
+    except ValueError as exc:
+        main_parser.error(str(exc))
+    names = [b[0] for b in bundles]
+    if len(set(names)) != len(names) or os.path.splitext(args.tck)[0] in names:
+        main_parser.error('the bundles names must be unique and different from the tractogram name')
+    if len(set(m for _, include, exclude in bundles for m in include + exclude)) > MAX_MASKS:
+        main_parser.error('at most %i distinct masks can be used' % MAX_MASKS)
+
+    #### Main program
+    subjects = find_subjects(inputpath, args.tck)
+    print('== Found %i subjects with %s in %s' % (len(subjects), args.tck, inputpath))
+    results, errors = cohort_filter(subjects, args.tck, bundles, chunk_points=args.chunk, jobs=args.jobs, verbose=args.verbose)
+    print('== %i bundles extracted from %i subjects (%i errors)' % (len(bundles), len(results), len(errors)))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
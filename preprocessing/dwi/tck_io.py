@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# tck_io.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Streaming reader and writer of MRtrix tck tractograms
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: reads the streamlines of a tck file (as written by tckgen, eg Allbrain.tck) by chunks of points from a memory map, and writes tck files by chunks, for the tractography tools of this folder (tck_connectome.py, tck_filter.py...).
+#
+# A tck file is a text header (ending with END, with the offset of the data in the "file: . <offset>" field) followed by the points of all streamlines as float triplets (x, y, z in mm, scanner coordinates), each streamline being terminated by a NaN triplet, and the file by an Inf triplet. Instead of iterating over the streamlines one by one in Python, the points are read by chunks of complete streamlines, with the streamline boundaries found with vectorized operations, so that the tools can process hundreds of thousands of streamlines with numpy, with a bounded memory. A range of points can be given, so that several processes can each process a part of the same file (each process handles the streamlines starting in its range). The writer appends chunks of streamlines in the same form, and writes the final count in the header when it is closed.
+#
+# Usage (prints the header and counts the streamlines):
+#   python tck_io.py -i Allbrain.tck
+#
+# Required libraries: numpy.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import os
+import shlex
+import sys
+
+import numpy as np
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Datatypes of the points in a tck file
+DATATYPES = {'float32le': '<f4', 'float32be': '>f4', 'float64le': '<f8', 'float64be': '>f8'}
+# Default number of points per chunk (about 12 MB of float32 points)
+CHUNK_POINTS = 1024 * 1024
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def read_header(filepath):
+    '''Read the header of a tck file. Returns (dict of the header fields, data offset, numpy dtype of the points).'''
+    header = {}
+    with open(filepath, 'rb') as f:
+        if f.readline().strip() != b'mrtrix tracks':
+            raise ValueError('%s is not a tck file' % filepath)
+        for line in f:
+            line = line.decode('latin-1').strip()
+            if line == 'END':
+                break
+            key, _, value = line.partition(':')
+            header[key.strip()] = value.strip()
+        else:
+            raise ValueError('%s: the header has no END line' % filepath)
+    if 'file' not in header or 'datatype' not in header:
+        raise ValueError('%s: the header has no file or datatype field' % filepath)
+    offset = int(header['file'].split()[-1])
+    dtype = DATATYPES.get(header['datatype'].lower())
+    if dtype is None:
+        raise ValueError('%s: unsupported datatype %s' % (filepath, header['datatype']))
+    return header, offset, np.dtype(dtype)
+
+
+class TckFile(object):
+    '''Memory mapped tck file: the points (including the NaN and Inf delimiters) as a (rows, 3) array'''
+    def __init__(self, filepath):
+        self.path = filepath
+        self.header, self.offset, self.dtype = read_header(filepath)
+        nrows = (os.path.getsize(filepath) - self.offset) // (3 * self.dtype.itemsize)
+        self.data = np.memmap(filepath, dtype=self.dtype, mode='r', offset=self.offset, shape=(nrows, 3)) if nrows > 0 else np.zeros((0, 3), dtype=self.dtype)
+        # The data ends at the Inf triplet (usually the last row)
+        if nrows > 0 and np.isinf(self.data[-1, 0]):
+            self.data = self.data[:-1]
+        self.nrows = self.data.shape[0]
+
+    @property
+    def count(self):
+        '''Number of streamlines according to the header (may be wrong if the file was not completely written)'''
+        return int(self.header.get('count', '0'))
+
+    def ranges(self, n):
+        '''Split the rows in n ranges of about the same size, for n processes'''
+        bounds = np.linspace(0, self.nrows, n + 1).astype(np.int64)
+        return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+    def chunks(self, lo=0, hi=None, chunk_points=CHUNK_POINTS):
+        '''Iterate over the streamlines starting in the rows [lo, hi) by chunks of complete streamlines. Yields (points, lengths): the points of the streamlines of the chunk as a (npoints, 3) float64 array without the delimiters, and the number of points of each streamline (streamlines without points are dropped). A streamline that is not terminated by a delimiter (truncated file) is dropped.'''
+        hi = self.nrows if hi is None else min(hi, self.nrows)
+        # First streamline starting at or after lo: the row after a delimiter
+        start = lo
+        if lo > 0:
+            start = None
+            pos = lo - 1
+            while pos < hi and start is None:
+                window = self.data[pos:min(pos + chunk_points, self.nrows), 0]
+                delims = np.flatnonzero(~np.isfinite(window))
+                if delims.size:
+                    start = pos + int(delims[0]) + 1
+                pos += chunk_points
+            if start is None:
+                return
+        size = chunk_points
+        while start < hi:
+            window = np.asarray(self.data[start:min(start + size, self.nrows)], dtype=np.float64)
+            delims = np.flatnonzero(~np.isfinite(window[:, 0]))
+            # Only the streamlines starting before hi
+            delims = delims[np.concatenate([[start], start + delims[:-1] + 1]) < hi] if delims.size else delims
+            if delims.size == 0:
+                if start + size >= self.nrows:
+                    # truncated last streamline
+                    return
+                # a streamline longer than the chunk, read a bigger window
+                size *= 2
+                continue
+            end = int(delims[-1])
+            bounds = np.concatenate([[-1], delims])
+            lengths = np.diff(bounds) - 1
+            keep = np.ones(end + 1, dtype=bool)
+            keep[delims] = False
+            yield window[:end + 1][keep], lengths[lengths > 0]
+            start += end + 1
+            size = chunk_points
+
+class TckWriter(object):
+    '''Write a tck file by chunks of streamlines (in the form yielded by TckFile.chunks), the file is only complete (and renamed from .tmp) once closed'''
+    def __init__(self, filepath, header=None):
+        self.path = filepath
+        self.count = 0
+        # Keep the descriptive fields of the source header (eg, the tckgen parameters), the others are rewritten
+        fields = ['%s: %s' % (k, v) for k, v in (header or {}).items() if k not in ('file', 'datatype', 'count', 'total_count')]
+        text = 'mrtrix tracks\n' + ''.join(f + '\n' for f in fields) + 'datatype: Float32LE\ncount: '
+        self.count_pos = len(text.encode('latin-1'))
+        text += '%010i\n' % 0
+        # The offset field includes its own length
+        offset = len(text.encode('latin-1')) + len('file: . \nEND\n')
+        while len(text.encode('latin-1')) + len(('file: . %i\nEND\n' % offset)) != offset:
+            offset = len(text.encode('latin-1')) + len(('file: . %i\nEND\n' % offset))
+        text += 'file: . %i\nEND\n' % offset
+        self.f = open(filepath + '.tmp', 'wb')
+        self.f.write(text.encode('latin-1'))
+
+    def write(self, points, lengths):
+        '''Append streamlines: points (npoints, 3) without delimiters and the number of points of each streamline'''
+        lengths = np.asarray(lengths, dtype=np.int64)
+        out = np.full((len(points) + len(lengths), 3), np.nan, dtype='<f4')
+        # Each point is shifted by the number of delimiters before it
+        out[np.arange(len(points)) + np.repeat(np.arange(len(lengths)), lengths)] = points
+        self.f.write(out.tobytes())
+        self.count += len(lengths)
+
+    def close(self):
+        '''Write the end of the file and the final count'''
+        self.f.write(np.full(3, np.inf, dtype='<f4').tobytes())
+        self.f.seek(self.count_pos)
+        self.f.write(('%010i' % self.count).encode('latin-1'))
+        self.f.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        '''Close and delete the incomplete file'''
+        self.f.close()
+        os.remove(self.path + '.tmp')
+
+
+def world_to_voxel(points, affine):
+    '''Convert points in scanner coordinates (mm) to continuous voxel coordinates of an image'''
+    inv = np.linalg.inv(affine)
+    return points.dot(inv[:3, :3].T) + inv[:3, 3]
+
+def streamline_starts(lengths):
+    '''Index of the first point of each streamline in the concatenated points of a chunk'''
+    return np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+def streamline_lengths_mm(points, lengths):
+    '''Length in mm of each streamline of a chunk (sum of the lengths of its segments)'''
+    seglen = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1))
+    # Segments between the last point of a streamline and the first point of the next one are not part of any streamline
+    ends = np.cumsum(lengths)[:-1] - 1
+    seglen[ends] = 0
+    total = np.concatenate([[0.0], np.cumsum(seglen)])
+    starts = streamline_starts(lengths)
+    return total[starts + lengths - 1] - total[starts]
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Streaming reader and writer of MRtrix tck tractograms v%s
+Description: Print the header of a tck file and count its streamlines and points by chunks.
+    ''' % __version__
+    ep = ''''''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='Allbrain.tck', type=str, required=True,
+                        help='Path to the tck file.')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    if not os.path.exists(inputpath):
+        raise NameError('Specified input file does not exist. Please check the specified path')
+
+    #### Main program
+    tck = TckFile(inputpath)
+    for key, value in tck.header.items():
+        print('%s: %s' % (key, value))
+    nstreamlines = npoints = 0
+    for points, lengths in tck.chunks():
+        nstreamlines += len(lengths)
+        npoints += len(points)
+    print('== %i streamlines, %i points (header count: %i)' % (nstreamlines, npoints, tck.count))
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# tck_sample.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Along-tract sampling of scalar maps
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: samples scalar maps (the fa.nii and adc.nii written by tensor2metric in the DWI pipelines) along every streamline of a tractogram (Allbrain.tck), for all subjects of a cohort, like `tcksample -stat_tck mean` but for all subjects and several maps at once, and optionally with along-tract profiles, instead of only the global fslstats values.
+#
+# The streamlines are read by chunks of points from a memory map of the tck file (see tck_io.py), and the maps are sampled with a vectorized trilinear interpolation at all the points of a chunk at once, reading the 8 neighbouring voxels directly from the memory mapped image (so neither the tractogram nor the maps are fully loaded in memory). For each streamline, the number of points, the length (mm) and the mean and median of each map are written in a CSV table in the subject's folder (points outside of a map are ignored). With --profile N, each streamline is also resampled to N points equally spaced along its length, and the map values at these points are saved as a (streamlines x N) float32 array in a .npy file per map, written chunk by chunk (profiles follow the direction of each streamline as it was tracked). Subjects are processed in parallel in a pool of processes.
+#
+# Usage:
+#   python tck_sample.py -i /path/to/patients/
+#   python tck_sample.py -i /path/to/patients/ --image fa.nii --image adc.nii --profile 100 -j 8
+#
+# Required libraries: numpy, nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import os
+import shlex
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dti_stats import find_subjects, load_3d
+from tck_io import TckFile, CHUNK_POINTS, world_to_voxel, streamline_starts, streamline_lengths_mm
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+class ScalarMap(object):
+    '''Memory mapped 3D scalar map (the scaling of the NIfTI header is applied to the sampled values only)'''
+    def __init__(self, filepath):
+        img, shape = load_3d(filepath)
+        self.data = img.dataobj.get_unscaled().reshape(shape) if hasattr(img.dataobj, 'get_unscaled') else np.asarray(img.dataobj).reshape(shape)
+        slope, inter = getattr(img.dataobj, 'slope', 1.0), getattr(img.dataobj, 'inter', 0.0)
+        self.slope = 1.0 if slope is None or not np.isfinite(slope) or slope == 0 else float(slope)
+        self.inter = 0.0 if inter is None or not np.isfinite(inter) else float(inter)
+        self.affine = img.affine
+        self.shape = np.array(shape)
+
+    def sample(self, points):
+        '''Trilinear interpolation at points in scanner coordinates (mm). NaN outside of the map.'''
+        vox = world_to_voxel(points, self.affine)
+        inside = np.all((vox >= 0) & (vox <= self.shape - 1), axis=1)
+        # Lower corner of the cell, clamped so that the upper corner is in the volume (points on the last voxel get a weight 1 on it)
+        base = np.minimum(np.floor(vox[inside]).astype(np.int64), np.maximum(self.shape - 2, 0))
+        frac = vox[inside] - base
+        values = np.zeros(len(base))
+        for corner in np.ndindex(2, 2, 2):
+            idx = np.minimum(base + corner, self.shape - 1)
+            weight = np.prod(np.where(corner, frac, 1.0 - frac), axis=1)
+            values += weight * self.data[idx[:, 0], idx[:, 1], idx[:, 2]]
+        out = np.full(len(points), np.nan)
+        out[inside] = values * self.slope + self.inter
+        return out
+
+def group_stats(values, lengths):
+    '''Mean and median of the non-NaN values of each streamline of a chunk (NaN if a streamline has no value)'''
+    n = len(lengths)
+    ids = np.repeat(np.arange(n), lengths)
+    valid = ~np.isnan(values)
+    counts = np.bincount(ids[valid], minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(ids[valid], weights=values[valid], minlength=n) / counts
+    # Sort by streamline then by value (NaNs last in each streamline), the median is in the middle of the valid values
+    order = np.lexsort((values, ids))
+    ordered = values[order]
+    starts = streamline_starts(lengths)
+    has = counts > 0
+    low = starts + np.maximum(counts - 1, 0) // 2
+    high = starts + counts // 2
+    median = np.full(n, np.nan)
+    median[has] = (ordered[low[has]] + ordered[np.minimum(high, starts + lengths - 1)[has]]) / 2.0
+    return mean, median
+
+def raw_to_npy(rawpath, npypath, ncols, dtype='<f4'):
+    '''Convert a raw file of rows of ncols values (written by chunks) to a .npy file, copying it by blocks, and delete the raw file'''
+    nrows = os.path.getsize(rawpath) // (ncols * np.dtype(dtype).itemsize)
+    with open(npypath + '.tmp', 'wb') as fout:
+        np.lib.format.write_array_header_1_0(fout, {'descr': np.dtype(dtype).str, 'fortran_order': False, 'shape': (nrows, ncols)})
+        with open(rawpath, 'rb') as fin:
+            shutil.copyfileobj(fin, fout, 16 * 1024 * 1024)
+    os.replace(npypath + '.tmp', npypath)
+    os.remove(rawpath)
+
+def resample_streamlines(points, lengths, npoints):
+    '''Resample each streamline of a chunk to npoints equally spaced along its length. Returns a (streamlines, npoints, 3) array.'''
+    starts = streamline_starts(lengths)
+    lasts = starts + lengths - 1
+    seglen = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1))
+    seglen[lasts[:-1]] = 0
+    # Cumulative length along the whole chunk, constant between two streamlines
+    total = np.concatenate([[0.0], np.cumsum(seglen)])
+    target = total[starts][:, None] + np.linspace(0, 1, npoints)[None, :] * (total[lasts] - total[starts])[:, None]
+    # Segment [j, j+1] containing each target, restricted to the streamline
+    seg = np.searchsorted(total, target, side='right') - 1
+    seg = np.clip(seg, starts[:, None], np.maximum(lasts - 1, starts)[:, None])
+    nxt = np.minimum(seg + 1, lasts[:, None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(nxt > seg, (target - total[seg]) / (total[nxt] - total[seg]), 0.0)
+    w = np.clip(np.nan_to_num(w), 0, 1)[..., None]
+    return points[seg] * (1 - w) + points[nxt] * w
+
+
+
+#***********************************
+#                     ENGINE
+#***********************************
+
+def sample_subject(args):
+    '''Worker: sample the maps along all streamlines of one subject, and save the table (and the profiles) in its folder. args is a tuple (subject id, folder, tck name, images names, output name, profile points or 0, chunk size), so that it can be sent to a process pool. Returns (number of streamlines, sampled images names).'''
+    subjid, folder, tckname, imnames, outname, profile, chunk_points = args
+    tck = TckFile(os.path.join(folder, tckname))
+    imnames = [imname for imname in imnames if os.path.exists(os.path.join(folder, imname))]
+    if not imnames:
+        raise IOError('none of the images exist in %s' % folder)
+    maps = [ScalarMap(os.path.join(folder, imname)) for imname in imnames]
+    names = [os.path.splitext(os.path.splitext(imname)[0])[0] for imname in imnames]
+    columns = ['streamline', 'points', 'length'] + ['%s_%s' % (name, stat) for name in names for stat in ('mean', 'median')]
+    outpath = os.path.join(folder, outname)
+    # The profiles of each chunk are appended to a raw file per map, converted to .npy once the number of streamlines is known
+    prefix = os.path.splitext(tckname)[0]
+    npypaths = [os.path.join(folder, '%s_%s_profiles.npy' % (prefix, name)) for name in names] if profile else []
+    rawfiles = [open(npypath + '.raw', 'wb') for npypath in npypaths]
+    nstreamlines = 0
+    try:
+        with open(outpath + '.tmp', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for points, lengths in tck.chunks(chunk_points=chunk_points):
+                cols = [np.arange(nstreamlines, nstreamlines + len(lengths)), lengths, streamline_lengths_mm(points, lengths)]
+                if profile:
+                    resampled = resample_streamlines(points, lengths, profile).reshape(-1, 3)
+                for m, smap in enumerate(maps):
+                    cols.extend(group_stats(smap.sample(points), lengths))
+                    if profile:
+                        rawfiles[m].write(smap.sample(resampled).astype('<f4').tobytes())
+                writer.writerows(zip(*[c.tolist() for c in cols]))
+                nstreamlines += len(lengths)
+    except Exception:
+        # Do not leave incomplete files
+        for rawfile in rawfiles:
+            rawfile.close()
+            os.remove(rawfile.name)
+        if os.path.exists(outpath + '.tmp'):
+            os.remove(outpath + '.tmp')
+        raise
+    os.replace(outpath + '.tmp', outpath)
+    for rawfile, npypath in zip(rawfiles, npypaths):
+        rawfile.close()
+        raw_to_npy(npypath + '.raw', npypath, profile)
+    return nstreamlines, imnames
+
+def cohort_samples(subjects, tckname, imnames, outname, profile=0, chunk_points=CHUNK_POINTS, jobs=None, verbose=True):
+    '''Sample all subjects (list of (subject id, folder)) in parallel. Returns the list of (subject id, number of streamlines, sampled images) and the list of errors. Subjects that fail are reported and skipped.'''
+    tasks = [(subjid, folder, tckname, list(imnames), outname, profile, chunk_points) for subjid, folder in subjects]
+    results = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(sample_subject, task) for task in tasks]
+        for i, ((subjid, _), future) in enumerate(zip(subjects, futures)):
+            try:
+                nstreamlines, sampled = future.result()
+                results.append((subjid, nstreamlines, sampled))
+                if verbose: print('Subject %i/%i done: %s (%i streamlines, %s)' % (i+1, len(subjects), subjid, nstreamlines, ', '.join(sampled)))
+            except Exception as exc:
+                errors.append((subjid, exc))
+                print('ERROR: subject %s skipped: %s' % (subjid, exc), file=sys.stderr)
+    return results, errors
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Along-tract sampling of scalar maps v%s
+Description: Sample scalar maps (FA, ADC...) along every streamline of the tractogram of all subjects found recursively in the input folder, with trilinear interpolation, and save the mean and median per streamline (and optionally the along-tract profiles).
+    ''' % __version__
+    ep = '''The table is saved in each subject's folder (--output), and the profiles as <tck name>_<image name>_profiles.npy (load them with numpy.load).'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder, all subfolders containing the tractogram are considered as subjects.')
+    main_parser.add_argument('--tck', metavar='Allbrain.tck', type=str, required=False, default='Allbrain.tck',
+                        help='Filename of the tractogram in each subject folder (default: Allbrain.tck).')
+    main_parser.add_argument('--image', metavar='fa.nii', type=str, action='append', default=None,
+                        help='Filename of the map(s) to sample, in each subject folder (default: fa.nii and adc.nii, the missing ones are skipped). Can be repeated.')
+    main_parser.add_argument('-o', '--output', metavar='Allbrain_samples.csv', type=str, required=False, default=None,
+                        help='Filename of the table saved in each subject folder (default: <tck name>_samples.csv).')
+    main_parser.add_argument('--profile', metavar='N', type=int, required=False, default=0,
+                        help='Also save the along-tract profiles, each streamline being resampled to N points.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('--chunk', metavar='1048576', type=int, required=False, default=CHUNK_POINTS,
+                        help='Number of points read at once per tractogram (lower to reduce memory usage).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show more output).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    imnames = args.image or ['fa.nii', 'adc.nii']
+    outname = args.output or os.path.splitext(args.tck)[0] + '_samples.csv'
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    subjects = find_subjects(inputpath, args.tck)
+    print('== Found %i subjects with %s in %s' % (len(subjects), args.tck, inputpath))
+    results, errors = cohort_samples(subjects, args.tck, imnames, outname, profile=args.profile, chunk_points=args.chunk, jobs=args.jobs, verbose=args.verbose)
+    print('== %i streamlines of %i subjects sampled and saved in %s (%i errors)' % (sum(r[1] for r in results), len(results), outname, len(errors)))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# art_outliers.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        ART-style outliers detection (global signal and composite motion)
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: detects the outlier scans of all functional sessions of a dataset like the ART toolbox (art_batch), from the global signal and the composite motion, and writes the same art_regression_outliers_*.mat, art_regression_outliers_and_movement_*.mat and art_regression_timeseries_*.mat files that CONN imports. All sessions are processed in parallel processes, and since nothing is written in the current folder (unlike art_batch(), which writes a temporary config file there), there is no conflict between sessions, which is why the ART step of script_preproc_fmri_csg.m had to stay serial.
+#
+# For each session (a folder with a rp_*.txt realignment parameters file and the preprocessed functional images, selected by --prefix like get_prepfdata() in script_preproc_fmri_csg.m: 'wa' before smoothing, 's8wa' after smoothing with an 8mm kernel, see art_before_smoothing):
+# * the global signal of each volume is computed while streaming the volumes one by one (3D or 4D files), as the mean of the voxels above 1/8 of the mean of the volume (same as spm_global),
+# * the composite motion is the maximum displacement, between two consecutive scans, of the centres of the six faces of a 140x180x115mm bounding box around the brain, under the combined translations and rotations of the realignment parameters,
+# * the scan-to-scan differences of the global signal are converted to robust z-scores (median and 0.7413 x interquartile range), and a spike flags both scans around it (same for the composite motion),
+# * the scans above the global signal z-score threshold or above the composite motion threshold (in mm) are outliers.
+# The thresholds default to the ones of art_batch (z = 9, 2mm), use --preset to use the CONN presets instead (conservative: z = 3, 0.5mm; intermediate: z = 5, 0.9mm; liberal: z = 9, 2mm).
+#
+# The outputs are named after the first functional image of the session (eg, art_regression_outliers_and_movement_wauf0001.mat), in the session folder, and contain a R variable: one column per outlier scan (1 for this scan, 0 elsewhere), followed by the 6 realignment parameters for the _and_movement_ file, or the global signal z-score and composite motion for the _timeseries_ file. A summary of all sessions is saved in a CSV table.
+#
+# Usage:
+#   python art_outliers.py -i /root_pth --prefix wa -j 8
+#   python art_outliers.py -i /root_pth/COND/SUBJ/data/session1/rest --prefix s8wa --preset intermediate
+#
+# Required libraries: numpy, scipy, nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import glob
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import nibabel as nib
+import numpy as np
+from scipy.io import savemat
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Folders skipped when walking the data tree
+SKIP_DIRS = ['mprage', 'JOBS', '__MACOSX']
+# Thresholds (global signal z-score, composite motion in mm): art_batch defaults and CONN presets
+PRESETS = {'art_batch': (9.0, 2.0), 'conservative': (3.0, 0.5), 'intermediate': (5.0, 0.9), 'liberal': (9.0, 2.0)}
+# Centres of the six faces of the 140x180x115mm bounding box used for the composite motion, in mm
+BOX_POINTS = np.array([[70, 0, 0], [-70, 0, 0], [0, 90, 0], [0, -90, 0], [0, 0, 57.5], [0, 0, -57.5]], dtype=np.float64)
+# Columns of the summary table, in order
+COLUMNS = ['session', 'nscans', 'outliers', 'global_outliers', 'motion_outliers', 'percent', 'max_global_z', 'max_motion', 'error']
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def list_images(dirpath, prefix):
+    '''List the functional images of a folder starting with the prefix, like get_prepfdata() (.nii or .img, sorted)'''
+    regex = re.compile('^' + re.escape(prefix) + r'.+\.(img|nii)$')
+    return sorted(os.path.join(dirpath, f) for f in os.listdir(dirpath) if regex.match(f))
+
+def find_sessions(rootpath, prefix):
+    '''Find all the session folders (with a rp_*.txt file and functional images with the prefix) under rootpath'''
+    sessions = []
+    for dirpath, dirnames, filenames in os.walk(rootpath):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        if any(f.startswith('rp_') and f.endswith('.txt') for f in filenames) and list_images(dirpath, prefix):
+            sessions.append(dirpath)
+    return sessions
+
+def read_rp(dirpath):
+    '''Read the realignment parameters (translations in mm, rotations in radians) of a session'''
+    rpfiles = sorted(glob.glob(os.path.join(dirpath, 'rp_*.txt')))
+    if len(rpfiles) > 1:
+        raise ValueError('Several rp_*.txt files in %s, cannot know which one to use: %s' % (dirpath, ', '.join(os.path.basename(f) for f in rpfiles)))
+    return np.atleast_2d(np.loadtxt(rpfiles[0]))[:, :6]
+
+def global_signal(images):
+    '''Global signal of each volume (mean of the voxels above 1/8 of the volume mean, as spm_global), streaming one volume at a time'''
+    g = []
+    for filepath in images:
+        img = nib.load(filepath)
+        nvols = img.shape[3] if len(img.shape) > 3 else 1
+        for t in range(nvols):
+            vol = np.asarray(img.dataobj[..., t] if len(img.shape) > 3 else img.dataobj, dtype=np.float64)
+            vol = vol[np.isfinite(vol)]
+            g.append(vol[vol > vol.mean() / 8].mean() if vol.size else np.nan)
+    return np.array(g)
+
+def rotation_matrices(rp):
+    '''Rotation matrices of the realignment parameters, in the same order as spm_matrix (pitch about x, then roll about y, then yaw about z), shape (nscans, 3, 3)'''
+    n = rp.shape[0]
+    c, s = np.cos(rp[:, 3:6]), np.sin(rp[:, 3:6])
+    one, zero = np.ones(n), np.zeros(n)
+    R1 = np.stack([np.stack([one, zero, zero], -1), np.stack([zero, c[:, 0], s[:, 0]], -1), np.stack([zero, -s[:, 0], c[:, 0]], -1)], 1)
+    R2 = np.stack([np.stack([c[:, 1], zero, s[:, 1]], -1), np.stack([zero, one, zero], -1), np.stack([-s[:, 1], zero, c[:, 1]], -1)], 1)
+    R3 = np.stack([np.stack([c[:, 2], s[:, 2], zero], -1), np.stack([-s[:, 2], c[:, 2], zero], -1), np.stack([zero, zero, one], -1)], 1)
+    return np.matmul(np.matmul(R1, R2), R3)
+
+def composite_motion(rp):
+    '''Maximum displacement of the bounding box points between consecutive scans (0 for the first scan)'''
+    # Position of each point at each scan: (nscans, npoints, 3)
+    pos = np.einsum('tij,pj->tpi', rotation_matrices(rp), BOX_POINTS) + rp[:, None, :3]
+    disp = np.sqrt((np.diff(pos, axis=0) ** 2).sum(axis=-1)).max(axis=-1)
+    return np.concatenate([[0.0], disp])
+
+def robust_z(x):
+    '''Robust z-score, with the median and 0.7413 x interquartile range (as ART)'''
+    q25, q50, q75 = np.nanpercentile(x, [25, 50, 75])
+    sigma = 0.7413 * (q75 - q25)
+    return (x - q50) / (sigma if sigma > 0 else 1.0)
+
+def both_sides(x):
+    '''A scan-to-scan difference flags both scans around it: score of scan t is the max of the differences t-1 -> t and t -> t+1'''
+    x = np.abs(x)
+    return np.maximum(x, np.concatenate([x[1:], [0.0]]))
+
+def art_outliers(g, rp, global_threshold, motion_threshold):
+    '''Outliers scans from the global signal and realignment parameters. Returns (outliers mask, global z-score, composite motion, global mask, motion mask).'''
+    gz = both_sides(robust_z(np.concatenate([[0.0], np.diff(g)]))) # scan-to-scan differences
+    motion = both_sides(composite_motion(rp))
+    gmask = gz > global_threshold
+    mmask = motion > motion_threshold
+    return gmask | mmask, gz, motion, gmask, mmask
+
+def process_session(dirpath, prefix, global_threshold, motion_threshold):
+    '''Detect the outliers of a session and write the ART regressors files. Never raises, returns a summary row (with an error message if any).'''
+    row = {'session': dirpath, 'error': ''}
+    try:
+        images = list_images(dirpath, prefix)
+        rp = read_rp(dirpath)
+        g = global_signal(images)
+        if len(g) != rp.shape[0]:
+            raise ValueError('%i volumes but %i realignment parameters, check the prefix' % (len(g), rp.shape[0]))
+        outliers, gz, motion, gmask, mmask = art_outliers(g, rp, global_threshold, motion_threshold)
+        idx = np.flatnonzero(outliers)
+        R_outliers = np.zeros((len(g), len(idx)))
+        R_outliers[idx, np.arange(len(idx))] = 1
+        name = os.path.splitext(os.path.basename(images[0]))[0]
+        savemat(os.path.join(dirpath, 'art_regression_outliers_%s.mat' % name), {'R': R_outliers})
+        savemat(os.path.join(dirpath, 'art_regression_outliers_and_movement_%s.mat' % name), {'R': np.hstack([R_outliers, rp])})
+        savemat(os.path.join(dirpath, 'art_regression_timeseries_%s.mat' % name), {'R': np.column_stack([gz, motion])})
+        row.update({'nscans': len(g), 'outliers': len(idx), 'global_outliers': int(gmask.sum()), 'motion_outliers': int(mmask.sum()),
+                    'percent': round(100.0 * len(idx) / len(g), 2), 'max_global_z': round(float(np.nanmax(gz)), 3), 'max_motion': round(float(motion.max()), 3)})
+    except Exception as exc:
+        row['error'] = str(exc)
+    return row
+
+def write_summary(rows, outpath):
+    '''Write the summary table atomically'''
+    tmppath = outpath + '.tmp'
+    with open(tmppath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmppath, outpath)
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''ART-style outliers detection v%s
+Description: Detect the outlier scans of all functional sessions from the global signal and composite motion like art_batch, in parallel, and write the art_regression_outliers(_and_movement)_*.mat files for CONN.
+    ''' % __version__
+    ep = '''A session is any folder with a rp_*.txt file and functional images starting with --prefix.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root of the data tree, or to a session folder.')
+    main_parser.add_argument('-p', '--prefix', metavar='wa', type=str, required=False, default='wa',
+                        help='Prefix of the functional images to use (default: wa, ie, before smoothing, use eg s8wa for the smoothed images).')
+    main_parser.add_argument('--preset', type=str, choices=sorted(PRESETS), required=False, default='art_batch',
+                        help='Thresholds preset (default: art_batch, ie, z = 9 and 2mm).')
+    main_parser.add_argument('-z', '--global-threshold', metavar='9', type=float, required=False, default=None,
+                        help='Global signal z-score threshold (overrides the preset).')
+    main_parser.add_argument('-m', '--motion-threshold', metavar='2', type=float, required=False, default=None,
+                        help='Composite motion threshold in mm (overrides the preset).')
+    main_parser.add_argument('-o', '--output', metavar='art_outliers_summary.csv', type=str, required=False, default=None,
+                        help='Path to the summary table (default: art_outliers_summary.csv in the input folder).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=4,
+                        help='Number of sessions processed in parallel processes (default: 4).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    outpath = fullpath(args.output) if args.output else os.path.join(inputpath, 'art_outliers_summary.csv')
+    global_threshold = args.global_threshold if args.global_threshold is not None else PRESETS[args.preset][0]
+    motion_threshold = args.motion_threshold if args.motion_threshold is not None else PRESETS[args.preset][1]
+
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    sessions = find_sessions(inputpath, args.prefix)
+    if not sessions:
+        print('No session found (folder with a rp_*.txt file and images starting with %s) in %s' % (args.prefix, inputpath))
+        return 1
+    print('== Detecting outliers in %i sessions (global signal z > %g, composite motion > %gmm)...' % (len(sessions), global_threshold, motion_threshold))
+    rows = []
+    n = len(sessions)
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        for row in executor.map(process_session, sessions, [args.prefix] * n, [global_threshold] * n, [motion_threshold] * n):
+            if row['error']:
+                print('-> ERROR %s: %s' % (row['session'], row['error']))
+            else:
+                print('-> %s: %i/%i outliers (%i global, %i motion)' % (row['session'], row['outliers'], row['nscans'], row['global_outliers'], row['motion_outliers']))
+            rows.append(row)
+    write_summary(rows, outpath)
+    nerrors = sum(1 for r in rows if r['error'])
+    print('== Done, %i sessions processed, %i errors. Summary saved in %s' % (n - nerrors, nerrors, outpath))
+    return 1 if nerrors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
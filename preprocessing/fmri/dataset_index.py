@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# dataset_index.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#              Dataset tree indexer
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: index in one pass all the files of a dataset organized as expected by script_preproc_fmri_csg.m and conn_subjects_loader.m:
+#   /root_pth/<condition>/<subject>/data/<session>/<modality>/*.(nii|img|hdr|...)
+#   /root_pth/<condition>/<subject>/data/mprage/*.nii  (structural shared across sessions)
+# Each file is stored with its parsed condition, subject, session and modality, and its SPM prefix (eg, 'wa' for wafunc001.nii, 'rp_' for rp_func001.txt, '' for the raw files) in a SQLite database.
+#
+# Walking the tree with MATLAB's dir() (get_dirnames, get_data, regex_files...) can take minutes on network shares. Here, the directories of each tree level are listed in parallel threads with os.scandir. On subsequent runs, only the directories whose modification time changed are listed again (a directory's mtime changes when files are added, removed or renamed inside it), the others are taken from the database.
+#
+# The index can be exported as a JSON or .mat manifest (a flat list of files with their parsed fields), that MATLAB scripts can load instead of walking the tree, see manifest_regex_files.m.
+#
+# Usage:
+#   python dataset_index.py -i /root_pth -d index.sqlite -o manifest.mat
+#   python dataset_index.py -i /root_pth -d index.sqlite -o manifest.json --full   # ignore the cache and list everything again
+#
+# Required libraries: none. Optional: scipy to export .mat manifests.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import json
+import os
+import re
+import shlex
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+    import scipy.io as sio
+except ImportError:
+    sio = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Folders that are not conditions (eg, JOBS is where script_preproc_fmri_csg.m saves the batch files)
+EXCLUDED_CONDITIONS = ('JOBS',)
+# Name of the structural folder
+STRUCT_DIR = 'mprage'
+# A SPM/CAT12 prefix starts with a letter and is made of letters, digits and underscores (eg, a, wa, s8wa, rp_, mean, c1, mwp1). This avoids taking numbered files (eg, 1001.nii vs 001.nii) as derivatives of each other.
+PREFIX_REGEX = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+# Double extensions to strip before matching stems
+DOUBLE_EXTS = ('.nii.gz', '.tar.gz')
+
+FILES_COLUMNS = ['path', 'dir', 'name', 'condition', 'subject', 'session', 'modality', 'prefix', 'stem', 'ext', 'size', 'mtime']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    subdirs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    condition TEXT,
+    subject TEXT,
+    session TEXT,
+    modality TEXT,
+    prefix TEXT,
+    stem TEXT,
+    ext TEXT,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+CREATE INDEX IF NOT EXISTS files_subject ON files(condition, subject, session, modality);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def split_ext(name):
+    '''Split a filename into stem and extension, supporting double extensions like .nii.gz'''
+    lname = name.lower()
+    for ext in DOUBLE_EXTS:
+        if lname.endswith(ext):
+            return name[:-len(ext)], name[-len(ext):]
+    return os.path.splitext(name)
+
+def parse_relpath(reldir):
+    '''Parse the path of a directory relative to the root into (condition, subject, session, modality).
+    Fields that cannot be determined (because the directory is not deep enough or not in the expected layout) are empty strings.
+    The shared structural folder <subject>/data/mprage has an empty session and the modality 'mprage'.
+    Subfolders below the modality (eg, CAT12's mri/ or report/) inherit the fields of the modality folder.'''
+    parts = [p for p in reldir.replace('\\', '/').split('/') if p and p != '.']
+    condition = parts[0] if len(parts) > 0 else ''
+    subject = parts[1] if len(parts) > 1 else ''
+    session = modality = ''
+    if len(parts) > 3 and parts[2] == 'data':
+        if parts[3].lower() == STRUCT_DIR:
+            modality = parts[3]
+        else:
+            session = parts[3]
+            if len(parts) > 4:
+                modality = parts[4]
+    return condition, subject, session, modality
+
+def spm_prefixes(names):
+    '''Find the SPM prefix of each filename of a folder, by matching the stems (filenames without extension) against the stems of the raw files of the same folder.
+    A raw file is a file whose stem does not end with the stem of another file of the folder (with a valid prefix in front). Eg, in a folder with func001.nii, afunc001.nii, wafunc001.nii and rp_afunc001.txt, the prefixes are '', 'a', 'wa' and 'rp_a'.
+    Return a dict {filename: (prefix, stem of the raw file)}'''
+    stems = {}
+    for name in names:
+        stems[name] = split_ext(name)[0]
+    uniq = set(stems.values())
+    # Raw stems: not ending with another stem preceded by a valid prefix. Checking all suffixes of each stem is linear in the stem length, instead of comparing all pairs of files.
+    def longest_base(stem, candidates):
+        for i in range(1, len(stem)):
+            if stem[i:] in candidates and PREFIX_REGEX.match(stem[:i]):
+                return stem[i:]
+        return None
+    raw = set(s for s in uniq if longest_base(s, uniq) is None)
+    res = {}
+    for name, stem in stems.items():
+        if stem in raw:
+            res[name] = ('', stem)
+        else:
+            base = longest_base(stem, raw)
+            if base is None:
+                # derived from a derivative whose raw file is not in this folder anymore, use the shortest prefix we can find
+                base = longest_base(stem, uniq)
+            res[name] = (stem[:len(stem)-len(base)], base)
+    return res
+
+def list_dir(dirpath):
+    '''List a directory with os.scandir. Return (directory mtime, list of subdirectories names, list of (filename, size, mtime)).'''
+    subdirs = []
+    files = []
+    dmtime = os.stat(dirpath).st_mtime
+    for entry in os.scandir(dirpath):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.is_file():
+                st = entry.stat()
+                files.append((entry.name, st.st_size, st.st_mtime))
+        except OSError:
+            # file deleted in the meantime or unreadable (broken symlink...)
+            continue
+    subdirs.sort()
+    files.sort()
+    return dmtime, subdirs, files
+
+
+
+#***********************************
+#                      INDEX
+#***********************************
+
+class DatasetIndex(object):
+    '''SQLite index of all files of a dataset tree. Paths are stored relative to the root, with forward slashes.'''
+
+    def __init__(self, dbpath, rootpath=None):
+        self.dbpath = dbpath
+        self.db = sqlite3.connect(dbpath)
+        self.db.executescript(SCHEMA)
+        stored_root = self.get_meta('root')
+        if rootpath is None:
+            rootpath = stored_root
+        elif stored_root and os.path.normpath(stored_root) != os.path.normpath(rootpath):
+            raise ValueError('The index %s was built for another root folder (%s), please use another database file.' % (dbpath, stored_root))
+        if rootpath is None:
+            raise ValueError('No root folder specified and the index %s is empty.' % dbpath)
+        self.root = rootpath
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _abs(self, reldir):
+        return os.path.join(self.root, *reldir.split('/')) if reldir else self.root
+
+    def refresh(self, full=False, jobs=16, verbose=False):
+        '''Walk the tree level by level, listing the directories of a level in parallel threads. Directories with an unchanged mtime are not listed again (unless full is True).
+        Return a dict of counters: listed (directories read from disk), cached (directories taken from the index), removed (directories that disappeared).'''
+        cached = {}
+        if not full:
+            for path, mtime, subdirs in self.db.execute('SELECT path, mtime, subdirs FROM dirs'):
+                cached[path] = (mtime, json.loads(subdirs))
+        stats = {'listed': 0, 'cached': 0, 'removed': 0}
+        seen = set()
+
+        def visit(reldir):
+            '''Stat a directory and list it only if it changed. Return (reldir, listing or None if unchanged, subdirs or None if the directory disappeared)'''
+            abspath = self._abs(reldir)
+            try:
+                mtime = os.stat(abspath).st_mtime
+            except OSError:
+                return reldir, None, None
+            if reldir in cached and cached[reldir][0] == mtime:
+                return reldir, None, cached[reldir][1]
+            try:
+                listing = list_dir(abspath)
+            except OSError:
+                return reldir, None, None
+            return reldir, listing, listing[1]
+
+        frontier = ['']
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while frontier:
+                nextfrontier = []
+                for reldir, listing, subdirs in executor.map(visit, frontier):
+                    if subdirs is None:
+                        continue
+                    seen.add(reldir)
+                    if listing is None:
+                        stats['cached'] += 1
+                    else:
+                        stats['listed'] += 1
+                        self._store_dir(reldir, listing)
+                    for sub in subdirs:
+                        # Skip the JOBS folder at the root, it is not a condition
+                        if reldir == '' and sub in EXCLUDED_CONDITIONS:
+                            continue
+                        nextfrontier.append(reldir + '/' + sub if reldir else sub)
+                if verbose: print('Level done: %i directories' % len(frontier))
+                frontier = nextfrontier
+
+        # Remove directories (and their files) that disappeared
+        for reldir in set(cached) - seen:
+            self.db.execute('DELETE FROM dirs WHERE path = ?', (reldir,))
+            self.db.execute('DELETE FROM files WHERE dir = ?', (reldir,))
+            stats['removed'] += 1
+        if full:
+            stale = [r[0] for r in self.db.execute('SELECT path FROM dirs')]
+            for reldir in stale:
+                if reldir not in seen:
+                    self.db.execute('DELETE FROM dirs WHERE path = ?', (reldir,))
+                    self.db.execute('DELETE FROM files WHERE dir = ?', (reldir,))
+                    stats['removed'] += 1
+        self.set_meta('root', self.root)
+        self.set_meta('updated', time.time())
+        self.db.commit()
+        return stats
+
+    def _store_dir(self, reldir, listing):
+        '''Replace the stored files of a directory with a fresh listing. Files at the root are not part of the layout (and the index itself is usually stored there), so they are not stored.'''
+        dmtime, subdirs, files = listing
+        if not reldir:
+            files = []
+        condition, subject, session, modality = parse_relpath(reldir)
+        prefixes = spm_prefixes([f[0] for f in files])
+        rows = []
+        for name, size, mtime in files:
+            prefix, _ = prefixes[name]
+            stem, ext = split_ext(name)
+            path = reldir + '/' + name if reldir else name
+            rows.append((path, reldir, name, condition, subject, session, modality, prefix, stem, ext.lower(), size, mtime))
+        self.db.execute('DELETE FROM files WHERE dir = ?', (reldir,))
+        self.db.executemany('INSERT INTO files (%s) VALUES (%s)' % (', '.join(FILES_COLUMNS), ', '.join('?' * len(FILES_COLUMNS))), rows)
+        self.db.execute('INSERT OR REPLACE INTO dirs (path, mtime, subdirs) VALUES (?, ?, ?)', (reldir, dmtime, json.dumps(subdirs)))
+
+    def query(self, where='1', params=()):
+        '''Return the files matching an SQL condition as a list of dicts, eg: query("modality = ? AND prefix = ''", ('rest',))'''
+        cur = self.db.execute('SELECT %s FROM files WHERE %s ORDER BY path' % (', '.join(FILES_COLUMNS), where), params)
+        return [dict(zip(FILES_COLUMNS, row)) for row in cur]
+
+    def export_manifest(self, outpath, where='1', params=()):
+        '''Export the (optionally filtered) index as a JSON or .mat manifest. Paths are exported as absolute paths.'''
+        rows = self.query(where, params)
+        for row in rows:
+            row['path'] = self._abs(row['path'])
+            row['dir'] = self._abs(row['dir'])
+        if outpath.lower().endswith('.mat'):
+            if sio is None:
+                raise ImportError('scipy is required to export .mat manifests, please pip install scipy or use a .json output.')
+            # Struct of columns (cell arrays of strings and numeric vectors), much faster to load and filter in MATLAB than an array of structs
+            manifest = {}
+            for col in FILES_COLUMNS:
+                values = [row[col] for row in rows]
+                if col in ('size', 'mtime'):
+                    manifest[col] = np.array(values, dtype=np.float64).reshape(-1, 1)
+                else:
+                    cell = np.empty((len(values), 1), dtype=object)
+                    cell[:, 0] = values
+                    manifest[col] = cell
+            manifest['root'] = self.root
+            sio.savemat(outpath, {'manifest': manifest}, do_compression=True)
+        else:
+            with open(outpath, 'w') as f:
+                json.dump({'root': self.root, 'files': rows}, f, indent=0)
+        return len(rows)
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Dataset tree indexer v%s
+Description: Index all files of a /root_pth/<condition>/<subject>/data/<session>/<modality>/ tree into a SQLite database (with parsed condition, subject, session, modality and SPM prefix), and export a JSON/.mat manifest for MATLAB scripts.
+    ''' % __version__
+    ep = ''' '''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root of the dataset (root_pth).')
+    main_parser.add_argument('-d', '--database', metavar='index.sqlite', type=str, required=False, default=None,
+                        help='Path to the SQLite index (default: dataset_index.sqlite in the root folder).')
+    main_parser.add_argument('-o', '--output', metavar='manifest.mat', type=str, required=False, default=None,
+                        help='Export the index to a manifest (.mat or .json).')
+    main_parser.add_argument('--full', action='store_true', required=False, default=False,
+                        help='Ignore the cached listings and list all directories again.')
+    main_parser.add_argument('-j', '--jobs', metavar='16', type=int, required=False, default=16,
+                        help='Number of directories listed in parallel (threads).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show more output).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    rootpath = fullpath(args.input)
+    dbpath = fullpath(args.database) if args.database else os.path.join(rootpath, 'dataset_index.sqlite')
+
+    if not os.path.isdir(rootpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    t0 = time.time()
+    index = DatasetIndex(dbpath, rootpath)
+    try:
+        stats = index.refresh(full=args.full, jobs=args.jobs, verbose=args.verbose)
+        nfiles = index.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        print('== Index of %s updated in %.1fs: %i files, %i directories listed, %i unchanged, %i removed.' % (rootpath, time.time() - t0, nfiles, stats['listed'], stats['cached'], stats['removed']))
+        if args.output:
+            n = index.export_manifest(fullpath(args.output))
+            print('== Manifest of %i files saved to %s' % (n, args.output))
+    finally:
+        index.close()
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# diary_log_report.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Timing report of the diary logs of the preprocessing scripts
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: parses the diary logs written by script_preproc_fmri_csg.m and vbm_script_preproc_csg.m (<script>_<yyyy-mm-dd_HH-MM-ss>.txt) and reports how long each job, each SPM module and each subject took, with the errors and the slowest subjects, as CSV tables and one HTML page.
+#
+# The logs are read line by line (so multi-GB logs are never loaded in memory), several logs in parallel processes. The parser follows:
+# * the "=== SECTION ===" headers (sanity checks, smoothing jobs, ART...), which give the stage of the jobs that follow,
+# * the "---- PROCESSING JOB i/N FOR CONDITION X SUBJECT i (name) SESSION s MODALITY m ----" banners of run_jobs() (and the "---- PROCESSING CONDITION ... ----" banners of the resize, RSHRF and ART loops), which delimit the jobs and give the subject,
+# * the timestamped lines of spm_jobman ("dd-mmm-yyyy HH:MM:SS - Running job #1", "- Running 'Module'", "- Done    'Module'", "- Failed  'Module'", "- Done"), which give the start and end of each module and job,
+# * the MATLAB errors ("Error using", "Error in", "??? Error", "The following modules did not run").
+# In parallel processing mode (parfor), MATLAB prints the output of each job when it is done, so the jobs stay contiguous in the log and their durations are still measured from the spm_jobman timestamps.
+#
+# The durations of the jobs of each stage, and the total time of each subject, are compared with a robust z-score (median and MAD): the jobs and subjects above the threshold (--zthreshold) are flagged as outliers, to spot pathological subjects (eg, a failing segmentation that takes hours) and to plan the allocation of cluster jobs.
+#
+# Usage:
+#   python diary_log_report.py -i script_preproc_fmri_csg_2026-10-19_10-00-00.txt -o report
+#   python diary_log_report.py -i /path/to/logs/folder -o /path/to/report --zthreshold 3
+#
+# Required libraries: none (Python standard library only).
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import datetime
+import glob
+import html
+import os
+import re
+import shlex
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Diary logs filenames, as set in the preprocessing scripts: [mfilename() '_' datestr(now, 'yyyy-mm-dd_HH-MM-ss') '.txt']
+LOG_GLOB = '*_[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]_[0-9][0-9]-[0-9][0-9]-[0-9][0-9].txt'
+# Lines of the logs
+SECTION_REGEX = re.compile(r'^=== (.+?) ===\s*$')
+JOB_REGEX = re.compile(r'^---- PROCESSING JOB (\d+)/(\d+)(?: FOR (.*?))? ----\s*$')
+LOOP_REGEX = re.compile(r'^---- PROCESSING (CONDITION .*?) ----\s*$')
+SUBJECT_REGEX = re.compile(r'SUBJECT \d+ \((.+?)\)')
+TIMESTAMP = r'(\d{2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2}:\d{2})'
+SPMJOB_REGEX = re.compile(r'^' + TIMESTAMP + r' - Running job #(\d+)')
+MODULE_REGEX = re.compile(r'^' + TIMESTAMP + r" - (Running|Done|Failed|Skipped)\s+'(.+)'\s*$")
+DONE_REGEX = re.compile(r'^' + TIMESTAMP + r' - Done\s*$')
+ERROR_REGEX = re.compile(r'^(Error using|Error in|Error:|\?\?\? |The following modules did not run|Failed\s+\')')
+# Columns of the tables, in order
+JOB_COLUMNS = ['log', 'section', 'job', 'info', 'subject', 'start', 'end', 'duration', 'status', 'modules', 'errors', 'first_error', 'zscore', 'outlier']
+MODULE_COLUMNS = ['log', 'section', 'job', 'subject', 'module', 'start', 'end', 'duration', 'status']
+SUBJECT_COLUMNS = ['subject', 'jobs', 'failed', 'duration', 'zscore', 'outlier']
+ERROR_COLUMNS = ['log', 'line', 'section', 'job', 'subject', 'message']
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def find_logs(inputs):
+    '''List the diary logs from a list of files and folders'''
+    logs = []
+    for p in inputs:
+        p = fullpath(p)
+        if os.path.isdir(p):
+            logs.extend(sorted(glob.glob(os.path.join(p, LOG_GLOB))))
+        else:
+            logs.append(p)
+    return logs
+
+def parse_time(s):
+    '''Parse a spm_jobman timestamp (datestr(now) format, always in English)'''
+    return datetime.datetime.strptime(s, '%d-%b-%Y %H:%M:%S')
+
+def seconds(start, end):
+    return (end - start).total_seconds() if start is not None and end is not None else None
+
+def parse_log(filepath, max_errors=1000):
+    '''Parse a diary log line by line. Returns a dict with the lists of jobs, modules and errors records.'''
+    name = os.path.basename(filepath)
+    jobs, modules, errors = [], [], []
+    state = {'section': '', 'job': None, 'running': {}, 'loop': 0}
+
+    def close_job():
+        job = state['job']
+        if job is None:
+            return
+        # Modules still running when the job ended did not finish (crash or truncated log)
+        for module, start in state['running'].items():
+            modules.append({'log': name, 'section': job['section'], 'job': job['job'], 'subject': job['subject'], 'module': module,
+                            'start': start, 'end': None, 'duration': None, 'status': 'incomplete'})
+        if job['end'] is None:
+            job['end'] = job['last']
+            if job['status'] == 'ok' and job['start'] is not None:
+                job['status'] = 'incomplete' # spm_jobman started but never printed its final Done
+        job['duration'] = seconds(job['start'], job['end'])
+        del job['last']
+        jobs.append(job)
+        state['job'], state['running'] = None, {}
+
+    def open_job(jobid, info):
+        close_job()
+        m = SUBJECT_REGEX.search(info or '')
+        state['job'] = {'log': name, 'section': state['section'], 'job': jobid, 'info': info or '', 'subject': m.group(1) if m else (info or ''),
+                        'start': None, 'end': None, 'last': None, 'duration': None, 'status': 'ok', 'modules': 0, 'errors': 0, 'first_error': ''}
+
+    with open(filepath, 'r', encoding='latin-1', errors='replace') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line or line[0] not in '=-0123456789EeT?F':
+                continue # fast path: most lines of the log (SPM and toolboxes output) cannot match
+            m = SECTION_REGEX.match(line)
+            if m:
+                close_job()
+                state['section'], state['loop'] = m.group(1), 0
+                continue
+            m = JOB_REGEX.match(line)
+            if m:
+                open_job('%s/%s' % (m.group(1), m.group(2)), m.group(3))
+                continue
+            m = LOOP_REGEX.match(line)
+            if m:
+                state['loop'] += 1
+                open_job(str(state['loop']), m.group(1))
+                continue
+            job = state['job']
+            m = MODULE_REGEX.match(line)
+            if m and job is not None:
+                t, what, module = parse_time(m.group(1)), m.group(2), m.group(3)
+                job['start'] = job['start'] or t
+                job['last'] = t
+                if what == 'Running':
+                    state['running'][module] = t
+                else:
+                    start = state['running'].pop(module, None)
+                    job['modules'] += 1
+                    status = {'Done': 'ok', 'Failed': 'failed', 'Skipped': 'skipped'}[what]
+                    if status == 'failed':
+                        job['status'] = 'failed'
+                    modules.append({'log': name, 'section': job['section'], 'job': job['job'], 'subject': job['subject'], 'module': module,
+                                    'start': start, 'end': t, 'duration': seconds(start, t), 'status': status})
+                continue
+            m = SPMJOB_REGEX.match(line)
+            if m and job is not None:
+                t = parse_time(m.group(1))
+                job['start'] = job['start'] or t
+                job['last'] = t
+                continue
+            m = DONE_REGEX.match(line)
+            if m and job is not None:
+                job['end'] = job['last'] = parse_time(m.group(1))
+                continue
+            if ERROR_REGEX.match(line):
+                if job is not None:
+                    job['errors'] += 1
+                    job['first_error'] = job['first_error'] or line.strip()
+                    job['status'] = 'failed'
+                if len(errors) < max_errors:
+                    errors.append({'log': name, 'line': lineno, 'section': state['section'], 'job': job['job'] if job else '',
+                                   'subject': job['subject'] if job else '', 'message': line.strip()})
+    close_job()
+    return {'jobs': jobs, 'modules': modules, 'errors': errors}
+
+def robust_z(values):
+    '''Robust z-scores (median and MAD scaled to the standard deviation). None values stay None.'''
+    valid = [v for v in values if v is not None]
+    if len(valid) < 3:
+        return [None] * len(values)
+    med = statistics.median(valid)
+    mad = 1.4826 * statistics.median(abs(v - med) for v in valid)
+    if mad == 0:
+        return [None if v is None else 0.0 for v in values]
+    return [None if v is None else (v - med) / mad for v in values]
+
+def flag_outliers(jobs, zthreshold):
+    '''Robust z-score of the duration of each job relative to the jobs of the same section (stage), and per subject totals. Returns the subjects records sorted from the slowest.'''
+    sections = {}
+    for job in jobs:
+        sections.setdefault(job['section'], []).append(job)
+    for group in sections.values():
+        for job, z in zip(group, robust_z([j['duration'] for j in group])):
+            job['zscore'] = round(z, 2) if z is not None else None
+            job['outlier'] = int(z is not None and z > zthreshold)
+    subjects = {}
+    for job in jobs:
+        s = subjects.setdefault(job['subject'], {'subject': job['subject'], 'jobs': 0, 'failed': 0, 'duration': 0.0})
+        s['jobs'] += 1
+        s['failed'] += int(job['status'] != 'ok')
+        s['duration'] += job['duration'] or 0.0
+    subjects = sorted(subjects.values(), key=lambda s: -s['duration'])
+    for s, z in zip(subjects, robust_z([s['duration'] for s in subjects])):
+        s['zscore'] = round(z, 2) if z is not None else None
+        s['outlier'] = int(z is not None and z > zthreshold)
+    return subjects
+
+def module_summary(modules):
+    '''Count, total, median and max duration of each SPM module'''
+    groups = {}
+    for m in modules:
+        if m['duration'] is not None:
+            groups.setdefault(m['module'], []).append(m['duration'])
+    rows = [{'module': k, 'count': len(v), 'total': sum(v), 'median': statistics.median(v), 'max': max(v)} for k, v in groups.items()]
+    return sorted(rows, key=lambda r: -r['total'])
+
+def fmt(v):
+    '''Format a value for the tables'''
+    if v is None:
+        return ''
+    if isinstance(v, float):
+        return '%.2f' % v
+    if isinstance(v, datetime.datetime):
+        return v.strftime('%Y-%m-%d %H:%M:%S')
+    return v
+
+def write_csv(rows, columns, outpath):
+    with open(outpath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: fmt(row.get(k)) for k in columns})
+
+def html_table(rows, columns, highlight=None):
+    '''Render rows as an HTML table, the rows for which highlight(row) is true are highlighted'''
+    out = ['<table><tr>%s</tr>' % ''.join('<th>%s</th>' % html.escape(c) for c in columns)]
+    for row in rows:
+        cls = ' class="hl"' if highlight and highlight(row) else ''
+        out.append('<tr%s>%s</tr>' % (cls, ''.join('<td>%s</td>' % html.escape(str(fmt(row.get(c)))) for c in columns)))
+    out.append('</table>')
+    return '\n'.join(out)
+
+def write_html(outpath, logs, jobs, subjects, modsummary, errors, zthreshold, top=20):
+    '''Write the HTML report: summary, slowest subjects, outlier and slowest jobs, modules and errors'''
+    failed = [j for j in jobs if j['status'] != 'ok']
+    slowest = sorted([j for j in jobs if j['duration'] is not None], key=lambda j: -j['duration'])[:top]
+    total = sum(j['duration'] or 0.0 for j in jobs)
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>Diary logs timing report</title>',
+             '<style>body{font-family:sans-serif} table{border-collapse:collapse;margin-bottom:2em} td,th{border:1px solid #ccc;padding:2px 6px;font-size:small} th{background:#eee} tr.hl{background:#fdd}</style></head><body>',
+             '<h1>Diary logs timing report</h1>',
+             '<p>%i logs, %i jobs (%i failed or incomplete), %i subjects, total jobs time %.1f hours. Outliers: robust z-score &gt; %g.</p>' % (len(logs), len(jobs), len(failed), len(subjects), total / 3600.0, zthreshold),
+             '<p>Logs: %s</p>' % ', '.join(html.escape(os.path.basename(l)) for l in logs),
+             '<h2>Subjects, from the slowest</h2>', html_table(subjects, SUBJECT_COLUMNS, lambda r: r['outlier'] or r['failed']),
+             '<h2>Outlier jobs</h2>', html_table([j for j in jobs if j['outlier']], JOB_COLUMNS),
+             '<h2>%i slowest jobs</h2>' % top, html_table(slowest, JOB_COLUMNS, lambda r: r['outlier']),
+             '<h2>Failed or incomplete jobs</h2>', html_table(failed, JOB_COLUMNS),
+             '<h2>SPM modules, by total time</h2>', html_table(modsummary, ['module', 'count', 'total', 'median', 'max']),
+             '<h2>Errors</h2>', html_table(errors, ERROR_COLUMNS),
+             '</body></html>']
+    with open(outpath, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(parts))
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Diary logs timing report v%s
+Description: Parse the diary logs of script_preproc_fmri_csg.m and vbm_script_preproc_csg.m, and report the duration of each job, SPM module and subject, the errors and the slowest subjects, as CSV tables and an HTML page.
+    ''' % __version__
+    ep = '''Outputs: <output>_jobs.csv, <output>_modules.csv, <output>_subjects.csv, <output>_errors.csv and <output>.html.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, nargs='+', required=True,
+                        help='Diary log files, or folders containing diary logs (<script>_<yyyy-mm-dd_HH-MM-ss>.txt).')
+    main_parser.add_argument('-o', '--output', metavar='diary_report', type=str, required=False, default='diary_report',
+                        help='Path and prefix of the report files (default: diary_report in the current folder).')
+    main_parser.add_argument('-z', '--zthreshold', metavar='3.5', type=float, required=False, default=3.5,
+                        help='Robust z-score above which a job or subject is flagged as an outlier (default: 3.5).')
+    main_parser.add_argument('--max-errors', metavar='1000', type=int, required=False, default=1000,
+                        help='Maximum number of error lines kept per log (default: 1000).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=4,
+                        help='Number of logs parsed in parallel processes (default: 4).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    outprefix = fullpath(args.output)
+    outdir = os.path.dirname(outprefix)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    #### Main program
+    logs = find_logs(args.input)
+    missing = [l for l in logs if not os.path.isfile(l)]
+    if missing:
+        raise NameError('Specified log files do not exist: %s' % ', '.join(missing))
+    if not logs:
+        print('No diary log found.')
+        return 1
+    print('== Parsing %i diary logs...' % len(logs))
+    jobs, modules, errors = [], [], []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(logs)))) as executor:
+        for log, res in zip(logs, executor.map(parse_log, logs, [args.max_errors] * len(logs))):
+            print('-> %s: %i jobs, %i modules, %i errors' % (os.path.basename(log), len(res['jobs']), len(res['modules']), len(res['errors'])))
+            jobs.extend(res['jobs'])
+            modules.extend(res['modules'])
+            errors.extend(res['errors'])
+    subjects = flag_outliers(jobs, args.zthreshold)
+    modsummary = module_summary(modules)
+
+    write_csv(jobs, JOB_COLUMNS, outprefix + '_jobs.csv')
+    write_csv(modules, MODULE_COLUMNS, outprefix + '_modules.csv')
+    write_csv(subjects, SUBJECT_COLUMNS, outprefix + '_subjects.csv')
+    write_csv(errors, ERROR_COLUMNS, outprefix + '_errors.csv')
+    write_html(outprefix + '.html', logs, jobs, subjects, modsummary, errors, args.zthreshold)
+    outliers = [s['subject'] for s in subjects if s['outlier']]
+    print('== %i jobs, %i subjects, %i outlier subjects%s. Report saved in %s.html' % (len(jobs), len(subjects), len(outliers), (': ' + ', '.join(outliers)) if outliers else '', outprefix))
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
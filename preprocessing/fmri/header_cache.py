@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# header_cache.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        NIfTI/BIDS header cache scanner
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: read the headers of all NIfTI-1/NIfTI-2 (.nii, .nii.gz), Analyze (.hdr) images of a tree, along with their BIDS JSON sidecars, and cache the acquisition parameters (dims, pixdim, TR, slice_code, slice_duration, SliceTiming...) in one table keyed by path and mtime.
+#
+# The SANITY CHECKS loop of script_preproc_fmri_csg.m opens every functional file (spm_vol, autodetect_sliceorder) to check the number of slices and autodetect TR and slice order, which takes a long time on big datasets. Here only the first 348 bytes (NIfTI-1 and Analyze) or 540 bytes (NIfTI-2) of each image are read, in parallel threads, and files whose size and mtime did not change since the last scan are not read again at all.
+#
+# The cache can be a Parquet file (needs pandas and pyarrow) or a CSV file (readable in MATLAB with readtable). The slice timings are stored as a JSON list string.
+#
+# Usage:
+#   python header_cache.py -i /root_pth -c headers.csv
+#   python header_cache.py -i /root_pth -c headers.parquet --nslices 36   # also report images with another number of slices
+#   python header_cache.py -d /root_pth/dataset_index.sqlite -c headers.csv   # take the list of files from dataset_index.py instead of walking the tree
+#
+# Required libraries: none. Optional: pandas + pyarrow for Parquet caches.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import shlex
+import sqlite3
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Extensions of the files holding an image header
+HEADER_EXTS = ('.nii', '.nii.gz', '.hdr')
+# Columns of the cache table, in order
+COLUMNS = ['path', 'size', 'mtime', 'format', 'datatype', 'bitpix', 'ndim', 'nx', 'ny', 'nz', 'nt',
+           'dx', 'dy', 'dz', 'tr', 'xyzt_units', 'slice_dim', 'slice_code', 'slice_start', 'slice_end', 'slice_duration',
+           'scl_slope', 'scl_inter', 'vox_offset', 'qform_code', 'sform_code', 'descrip',
+           'json_path', 'json_mtime', 'json_tr', 'slice_timing', 'slice_encoding_direction', 'multiband_factor', 'error']
+# Types of the columns, to parse back the CSV cache
+INT_COLUMNS = ('size', 'datatype', 'bitpix', 'ndim', 'nx', 'ny', 'nz', 'nt', 'xyzt_units', 'slice_dim', 'slice_code', 'slice_start', 'slice_end', 'qform_code', 'sform_code', 'multiband_factor')
+FLOAT_COLUMNS = ('mtime', 'dx', 'dy', 'dz', 'tr', 'slice_duration', 'scl_slope', 'scl_inter', 'vox_offset', 'json_mtime', 'json_tr')
+# Multiplier to convert the time unit (xyzt_units & 0x38) to seconds
+TIME_UNITS = {0x08: 1.0, 0x10: 1e-3, 0x18: 1e-6}
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def is_header_file(name):
+    lname = name.lower()
+    return any(lname.endswith(ext) for ext in HEADER_EXTS)
+
+def sidecar_path(impath):
+    '''Path to the BIDS JSON sidecar of an image (same name with a .json extension)'''
+    if impath.lower().endswith('.nii.gz'):
+        return impath[:-7] + '.json'
+    return os.path.splitext(impath)[0] + '.json'
+
+def find_images(inputpath):
+    '''Find recursively all image header files'''
+    res = []
+    for dirpath, dirs, files in os.walk(inputpath):
+        dirs.sort()
+        for name in sorted(files):
+            if is_header_file(name):
+                res.append(os.path.join(dirpath, name))
+    return res
+
+def find_images_index(dbpath):
+    '''Get the image header files from a dataset_index.py SQLite index, without walking the tree'''
+    db = sqlite3.connect(dbpath)
+    try:
+        root = db.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()[0]
+        res = [os.path.join(root, *path.split('/')) for (path,) in db.execute('SELECT path FROM files ORDER BY path') if is_header_file(path)]
+    finally:
+        db.close()
+    return res
+
+
+
+#***********************************
+#                    HEADERS
+#***********************************
+
+def read_header_bytes(filepath, nbytes=540):
+    '''Read the first bytes of an image file, decompressing on the fly if gzipped (only the beginning of the stream is inflated)'''
+    with open(filepath, 'rb') as f:
+        magic = f.read(2)
+        f.seek(0)
+        if magic == b'\x1f\x8b':
+            with gzip.GzipFile(fileobj=f) as gz:
+                return gz.read(nbytes)
+        return f.read(nbytes)
+
+def parse_header(raw):
+    '''Parse a NIfTI-1, NIfTI-2 or Analyze 7.5 header from its raw bytes. Return a dict with the COLUMNS fields.'''
+    if len(raw) < 348:
+        raise ValueError('File too short to contain an image header')
+    # Detect the endianness and the version from sizeof_hdr
+    for endian in '<>':
+        sizeof_hdr = struct.unpack(endian + 'i', raw[:4])[0]
+        if sizeof_hdr in (348, 540):
+            break
+    else:
+        raise ValueError('Not a NIfTI/Analyze header (sizeof_hdr = %i)' % struct.unpack('<i', raw[:4])[0])
+    e = endian
+    h = {}
+    if sizeof_hdr == 540:
+        if len(raw) < 540:
+            raise ValueError('File too short to contain a NIfTI-2 header')
+        h['format'] = 'nifti2'
+        h['datatype'], h['bitpix'] = struct.unpack_from(e + 'hh', raw, 12)
+        dim = struct.unpack_from(e + '8q', raw, 16)
+        pixdim = struct.unpack_from(e + '8d', raw, 104)
+        h['vox_offset'] = struct.unpack_from(e + 'q', raw, 168)[0]
+        h['scl_slope'], h['scl_inter'] = struct.unpack_from(e + 'dd', raw, 176)
+        h['slice_duration'] = struct.unpack_from(e + 'd', raw, 208)[0]
+        h['slice_start'], h['slice_end'] = struct.unpack_from(e + 'qq', raw, 224)
+        descrip = raw[240:320]
+        h['qform_code'], h['sform_code'] = struct.unpack_from(e + 'ii', raw, 344)
+        h['slice_code'], h['xyzt_units'] = struct.unpack_from(e + 'ii', raw, 496)
+        dim_info = raw[524]
+    else:
+        magic = raw[344:348]
+        h['format'] = 'nifti1' if magic in (b'n+1\x00', b'ni1\x00') else 'analyze'
+        dim_info = raw[39]
+        dim = struct.unpack_from(e + '8h', raw, 40)
+        h['datatype'], h['bitpix'], h['slice_start'] = struct.unpack_from(e + 'hhh', raw, 70)
+        pixdim = struct.unpack_from(e + '8f', raw, 76)
+        h['vox_offset'], h['scl_slope'], h['scl_inter'] = struct.unpack_from(e + 'fff', raw, 108)
+        descrip = raw[148:228]
+        if h['format'] == 'nifti1':
+            h['slice_end'] = struct.unpack_from(e + 'h', raw, 120)[0]
+            h['slice_code'], h['xyzt_units'] = raw[122], raw[123]
+            h['slice_duration'] = struct.unpack_from(e + 'f', raw, 132)[0]
+            h['qform_code'], h['sform_code'] = struct.unpack_from(e + 'hh', raw, 252)
+        else:
+            # Analyze has no slice timing nor orientation fields (these bytes are used for other things)
+            dim_info = 0
+            h['slice_start'] = h['slice_end'] = h['slice_code'] = h['qform_code'] = h['sform_code'] = 0
+            h['slice_duration'] = 0.0
+            h['xyzt_units'] = 0
+    ndim = max(0, min(int(dim[0]), 7))
+    dims = list(dim[1:1+ndim]) + [1] * (4 - ndim)
+    h['ndim'] = ndim
+    h['nx'], h['ny'], h['nz'], h['nt'] = [int(d) for d in dims[:4]]
+    h['dx'], h['dy'], h['dz'] = [float(p) for p in pixdim[1:4]]
+    # The TR is stored in pixdim[4], in the unit given by xyzt_units (seconds if unspecified, as SPM does)
+    h['tr'] = float(pixdim[4]) * TIME_UNITS.get(h['xyzt_units'] & 0x38, 1.0) if ndim >= 4 else 0.0
+    h['slice_dim'] = (dim_info >> 4) & 0x03
+    h['descrip'] = descrip.split(b'\x00', 1)[0].decode('latin-1').strip()
+    return h
+
+def parse_sidecar(jsonpath):
+    '''Extract the acquisition parameters of a BIDS JSON sidecar'''
+    with open(jsonpath, 'r') as f:
+        js = json.load(f)
+    res = {'json_tr': float(js['RepetitionTime']) if 'RepetitionTime' in js else None,
+           'slice_timing': json.dumps(js['SliceTiming']) if 'SliceTiming' in js else None,
+           'slice_encoding_direction': js.get('SliceEncodingDirection'),
+           'multiband_factor': js.get('MultibandAccelerationFactor'),
+           }
+    return res
+
+def scan_file(impath, size=None, mtime=None):
+    '''Read the header (and the sidecar if any) of one image. Errors are stored in the row instead of being raised, so that one corrupted file does not stop the whole scan.'''
+    if size is None or mtime is None:
+        st = os.stat(impath)
+        size, mtime = st.st_size, st.st_mtime
+    row = dict.fromkeys(COLUMNS)
+    row.update({'path': impath, 'size': size, 'mtime': mtime})
+    try:
+        row.update(parse_header(read_header_bytes(impath)))
+    except Exception as exc:
+        row['error'] = str(exc)
+    jsonpath = sidecar_path(impath)
+    try:
+        jmtime = os.stat(jsonpath).st_mtime
+    except OSError:
+        jmtime = None
+    if jmtime is not None:
+        row['json_path'] = jsonpath
+        row['json_mtime'] = jmtime
+        try:
+            row.update(parse_sidecar(jsonpath))
+        except Exception as exc:
+            row['error'] = ((row['error'] + ' | ') if row['error'] else '') + 'Sidecar: %s' % exc
+    return row
+
+
+
+#***********************************
+#                      CACHE
+#***********************************
+
+def load_cache(cachepath):
+    '''Load a cache table as a dict {path: row}'''
+    if not os.path.exists(cachepath):
+        return {}
+    if cachepath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to read Parquet caches, please pip install pandas pyarrow or use a .csv cache.')
+        df = pd.read_parquet(cachepath)
+        rows = [{k: (None if (v is None or (isinstance(v, float) and v != v)) else v) for k, v in r.items()} for r in df.to_dict('records')]
+    else:
+        rows = []
+        with open(cachepath, 'r', newline='') as f:
+            for r in csv.DictReader(f):
+                for k, v in r.items():
+                    if v == '':
+                        r[k] = None
+                    elif k in INT_COLUMNS:
+                        r[k] = int(float(v))
+                    elif k in FLOAT_COLUMNS:
+                        r[k] = float(v)
+                rows.append(r)
+    return {r['path']: r for r in rows}
+
+def save_cache(rows, cachepath):
+    '''Save the rows (list of dicts) as a Parquet or CSV table, written to a temporary file first so that an interrupted save does not corrupt the previous cache'''
+    tmppath = cachepath + '.tmp'
+    if cachepath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to write Parquet caches, please pip install pandas pyarrow or use a .csv cache.')
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(tmppath, index=False)
+    else:
+        with open(tmppath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(tmppath, cachepath)
+
+def update_cache(impaths, cache, jobs=16):
+    '''Scan the images that are not in the cache or whose size, mtime or sidecar mtime changed. Return (rows in impaths order, number of files read).'''
+    def cached_or_scan(impath):
+        try:
+            st = os.stat(impath)
+        except OSError as exc:
+            row = dict.fromkeys(COLUMNS)
+            row.update({'path': impath, 'error': str(exc)})
+            return row, False
+        old = cache.get(impath)
+        if old is not None and old['size'] == st.st_size and old['mtime'] == st.st_mtime:
+            # Check that the sidecar did not appear, disappear or change either
+            try:
+                jmtime = os.stat(sidecar_path(impath)).st_mtime
+            except OSError:
+                jmtime = None
+            if jmtime == old['json_mtime']:
+                return old, False
+        return scan_file(impath, st.st_size, st.st_mtime), True
+
+    rows = []
+    nread = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for row, read in executor.map(cached_or_scan, impaths):
+            rows.append(row)
+            nread += read
+    return rows, nread
+
+def check_nslices(rows, nslices, func_dir_regex=None):
+    '''Return the rows of the functional images (whose folder name matches func_dir_regex, if provided) that do not have the expected number of slices'''
+    if func_dir_regex:
+        func_dir_regex = re.compile(func_dir_regex)
+        rows = [r for r in rows if func_dir_regex.search(os.path.basename(os.path.dirname(r['path'])))]
+    return [r for r in rows if r['nz'] is not None and r['nz'] != nslices]
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''NIfTI/BIDS header cache scanner v%s
+Description: Read only the headers of all NIfTI/Analyze images of a tree (and their BIDS JSON sidecars), and cache dims, voxel sizes, TR and slice timing infos in one table. Unchanged files are not read again on subsequent runs.
+    ''' % __version__
+    ep = ''' '''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=False, default=None,
+                        help='Path to the root folder to scan recursively.')
+    main_parser.add_argument('-d', '--database', metavar='dataset_index.sqlite', type=str, required=False, default=None,
+                        help='Take the list of files from a dataset_index.py index instead of walking the tree.')
+    main_parser.add_argument('-c', '--cache', metavar='headers.csv', type=str, required=True,
+                        help='Path to the cache table (.csv or .parquet), created if it does not exist.')
+    main_parser.add_argument('--nslices', metavar='N', type=int, required=False, default=0,
+                        help='If > 0, report all functional images that do not have this number of slices (like the sanity check in script_preproc_fmri_csg.m).')
+    main_parser.add_argument('--func-dir-regex', metavar='regex', type=str, required=False, default='(rest|func|task|tennis|navigation)',
+                        help='Regular expression matching the functional folders names, for --nslices (same as func_dir_regex in script_preproc_fmri_csg.m).')
+    main_parser.add_argument('-j', '--jobs', metavar='16', type=int, required=False, default=16,
+                        help='Number of files read in parallel (threads).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    cachepath = fullpath(args.cache)
+
+    if args.database:
+        impaths = find_images_index(fullpath(args.database))
+    elif args.input:
+        inputpath = fullpath(args.input)
+        if not os.path.isdir(inputpath):
+            raise NameError('Specified input path does not exist. Please check the specified path')
+        impaths = find_images(inputpath)
+    else:
+        main_parser.error('Please specify either --input or --database.')
+
+    #### Main program
+    t0 = time.time()
+    cache = load_cache(cachepath)
+    rows, nread = update_cache(impaths, cache, jobs=args.jobs)
+    save_cache(rows, cachepath)
+    errors = [r for r in rows if r['error']]
+    print('== %i images in cache %s (%i headers read, %i unchanged) in %.1fs.' % (len(rows), cachepath, nread, len(rows) - nread, time.time() - t0))
+    for r in errors:
+        print('WARNING: %s: %s' % (r['path'], r['error']), file=sys.stderr)
+
+    if args.nslices > 0:
+        wrong = check_nslices(rows, args.nslices, args.func_dir_regex)
+        for r in wrong:
+            print('ERROR: %s has %i slices instead of expected %i slices!' % (r['path'], r['nz'], args.nslices), file=sys.stderr)
+        if wrong:
+            return 1
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
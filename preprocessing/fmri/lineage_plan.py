@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# lineage_plan.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#     Derivative lineage graph and incremental re-processing planner
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: finds which subjects and stages of script_preproc_fmri_csg.m must be run again after the data or the parameters changed, instead of restoring a backup of the raw data and reprocessing everything.
+#
+# SPM marks the derivatives only by a filename prefix, so the lineage of the files of each functional folder (/root_pth/<condition>/<subject>/data/<session>/<modality>/) and of each structural folder (data/mprage/, with the mri/, report/ and label/ subfolders of CAT12) is reconstructed from the prefixes: the files are grouped by prefix (as in dataset_index.py), and the parent of a group is the group with the longest prefix that ends its own prefix, eg: f0001.nii -> af0001.nii (a) -> waf0001.nii (wa) -> s8waf0001.nii (s8wa) -> art_regression_outliers_s8waf0001.mat, and af0001.nii -> rp_af0001.txt, meanaf0001.nii. Each group is assigned to the stage that produced it from the part of the prefix it added: s8 -> smoothing, deconv_ -> rshrf, r after w -> resize, art_ -> art, SPM.mat -> spmgenart, everything else (slice timing, realignment, normalization, segmentation...) -> preproc.
+#
+# A group must be produced again if:
+#   * its input group is stale, or was modified after it (newer mtime, with a tolerance),
+#   * it has fewer files than its input (eg, an interrupted run),
+#   * its input changed since the last recorded run (eg, raw files replaced by other ones, even with older mtimes),
+#   * the parameters of its stage changed since the last recorded run: the parameters of script_preproc_fmri_csg.m (hashed per stage, eg smoothingkernel for the smoothing), or the latest batch job of the stage for this subject in the JOBS folder,
+#   * its stage has a batch job but no output at all.
+# The earliest stale stage of a functional folder is re-run, and all the next stages after it. When a structural folder is stale, the preproc stage of all the functional folders of the subject (or of the session, for a structural folder per session) is re-run.
+#
+# The state of a run (a fingerprint of each group, and the hashes of the parameters and batch jobs) is recorded with --record, which script_preproc_fmri_csg.m does at the end of a run with lineage_record_python = true. The plan is printed, saved as a CSV table (--csv) and as a list of jobs (-o) to run with run_jobs_pool.py --only.
+#
+# Usage:
+#   python lineage_plan.py -i /root_pth --record                               # after a successful run
+#   python lineage_plan.py -i /root_pth -o /root_pth/JOBS/jobs_plan.txt --csv plan.csv
+#   python run_jobs_pool.py -i /root_pth/JOBS --art /root_pth --only /root_pth/JOBS/jobs_plan.txt
+#
+# Required libraries: none (Python standard library only).
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import collections
+import csv
+import hashlib
+import json
+import os
+import re
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dataset_index import spm_prefixes
+from run_jobs_pool import find_jobs
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Stages of script_preproc_fmri_csg.m, in the order they run
+STAGE_ORDER = ['preproc', 'resize', 'rshrf', 'smoothing', 'spmgenart', 'art']
+# Parameters of script_preproc_fmri_csg.m that only affect one stage (the others affect the preproc stage, and so all the stages after it), and those that do not change the outputs
+STAGE_PARAMS = {'smoothingkernel': 'smoothing', 'smoothing_python': 'smoothing',
+                'resizeto3': 'resize', 'resizeto3_python': 'resize',
+                'enable_rshrf': 'rshrf',
+                'art_before_smoothing': 'spmgenart', 'motionRemovalTool': 'art', 'art_python': 'art'}
+IGNORED_PARAMS = ['root_pth', 'path_to_spm', 'path_to_art', 'parallel_processing', 'skip_preprocessing', 'slice_order_auto', 'lineage_record_python']
+# CAT12 writes its outputs in subfolders of the structural folder
+CAT12_SUBDIRS = ['mri', 'report', 'label']
+# Prefixes added per volume (the derivative has one file per input file), used to detect incomplete derivatives
+VOLUME_TOKEN_REGEX = re.compile(r'^(a|w|r|u|s\d*|deconv_)$')
+# Default state file, in the JOBS folder
+STATE_FILE = 'lineage_state.json'
+# Columns of the plan table
+COLUMNS = ['condition', 'subject', 'session', 'modality', 'stage', 'job', 'reasons']
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def parse_script_params(scriptpath):
+    '''Parameters of script_preproc_fmri_csg.m: the assignments between the "--- PARAMETERS" and "--- End of parameters" comments, as a dict {name: [values]} (a parameter can be assigned in several branches)'''
+    params = collections.OrderedDict()
+    inside = False
+    with open(scriptpath, 'r', encoding='latin-1') as f:
+        for line in f:
+            if line.startswith('% --- PARAMETERS'):
+                inside = True
+            elif line.startswith('% --- End of parameters'):
+                break
+            elif inside:
+                m = re.match(r'^\s*(\w+)\s*=\s*([^;%]*);', line)
+                if m:
+                    params.setdefault(m.group(1), []).append(m.group(2).strip())
+    return params
+
+def stage_param_hashes(params):
+    '''Hash of the parameters of each stage'''
+    perstage = collections.defaultdict(list)
+    for name, values in params.items():
+        if name not in IGNORED_PARAMS:
+            perstage[STAGE_PARAMS.get(name, 'preproc')].append('%s=%s' % (name, '|'.join(values)))
+    return {stage: digest('\n'.join(sorted(lines)).encode('utf-8')) for stage, lines in perstage.items()}
+
+def job_hash(filepath):
+    '''Hash of a batch job, without the 128 bytes header of the .mat file that contains its creation date'''
+    with open(filepath, 'rb') as f:
+        f.seek(128)
+        return digest(f.read())
+
+def list_files(dirpath, subdirs=()):
+    '''List the files of a folder (and of the given subfolders) as (relative name, size, mtime)'''
+    files = []
+    for sub in [''] + list(subdirs):
+        d = os.path.join(dirpath, sub)
+        if not os.path.isdir(d):
+            continue
+        for entry in os.scandir(d):
+            try:
+                if entry.is_file():
+                    st = entry.stat()
+                    files.append((sub + '/' + entry.name if sub else entry.name, st.st_size, st.st_mtime))
+            except OSError:
+                # file deleted in the meantime or unreadable (broken symlink...)
+                continue
+    return sorted(files)
+
+def find_folders(rootdir, func_regex):
+    '''Find the functional and structural folders of the data tree, with the indices of the session and modality as used in the names of the batch jobs (1-based, in alphabetical order)'''
+    regex = re.compile(func_regex)
+    folders = []
+    def subdirs(d):
+        return sorted(e.name for e in os.scandir(d) if e.is_dir() and e.name not in ('JOBS', '__MACOSX'))
+    for condition in subdirs(rootdir):
+        for subject in subdirs(os.path.join(rootdir, condition)):
+            datadir = os.path.join(rootdir, condition, subject, 'data')
+            if not os.path.isdir(datadir):
+                continue
+            sessions = subdirs(datadir)
+            for mprage in [s for s in sessions if s.lower() == 'mprage']:
+                folders.append({'path': os.path.join(datadir, mprage), 'condition': condition, 'subject': subject, 'session': '', 'modality': mprage, 'isess': '', 'imodal': '', 'structural': True})
+            sessions = [s for s in sessions if s.lower() != 'mprage']
+            for isess, session in enumerate(sessions):
+                modalities = subdirs(os.path.join(datadir, session))
+                for mprage in [m for m in modalities if m.lower() == 'mprage']:
+                    folders.append({'path': os.path.join(datadir, session, mprage), 'condition': condition, 'subject': subject, 'session': session, 'modality': mprage, 'isess': str(isess + 1), 'imodal': '', 'structural': True})
+                modalities = [m for m in modalities if regex.search(m)]
+                for imodal, modality in enumerate(modalities):
+                    folders.append({'path': os.path.join(datadir, session, modality), 'condition': condition, 'subject': subject, 'session': session, 'modality': modality,
+                                    'isess': str(isess + 1), 'imodal': str(imodal + 1), 'structural': False})
+    return folders
+
+def stage_of(token, parent):
+    '''Stage that produced a derivative, from the part of the prefix it added to its parent's prefix'''
+    if token.startswith('art_'):
+        return 'art'
+    if re.match(r'^s\d*$', token):
+        return 'smoothing'
+    if token == 'deconv_':
+        return 'rshrf'
+    if token == 'r' and 'w' in parent:
+        return 'resize'
+    return 'preproc'
+
+def build_lineage(files):
+    '''Lineage graph of the files of a folder: a dict {prefix: node}, each node with its parent prefix, stage, files, number of raw stems, mtimes and fingerprint. The parent of SPM.mat is the input of ART.'''
+    names = {}
+    for relname, size, mtime in files:
+        names.setdefault(relname.rsplit('/', 1)[-1], []).append((relname, size, mtime))
+    special = [n for n in names if n == 'SPM.mat']
+    prefixes = spm_prefixes([n for n in names if n not in special])
+    groups = collections.defaultdict(list)
+    for name, (prefix, stem) in prefixes.items():
+        groups[prefix].extend((f, stem) for f in names[name])
+    for name in special:
+        groups[name].extend((f, '') for f in names[name])
+    nodes = {}
+    for prefix in sorted(groups, key=len):
+        entries = groups[prefix]
+        if prefix in special:
+            parent, stage = None, 'spmgenart'
+        elif prefix == '':
+            parent, stage = None, 'raw'
+        else:
+            parent = next((prefix[i:] for i in range(1, len(prefix) + 1) if prefix[i:] in groups), '')
+            stage = stage_of(prefix[:len(prefix) - len(parent)], parent)
+        fingerprint = digest('\n'.join('%s %i %.0f' % f for f, _ in sorted(entries)).encode('utf-8'))
+        nodes[prefix] = {'prefix': prefix, 'parent': parent, 'stage': stage, 'token': prefix[:len(prefix) - len(parent or '')],
+                         'nfiles': len(entries), 'nstems': len(set(s for _, s in entries)),
+                         'min_mtime': min(f[2] for f, _ in entries), 'max_mtime': max(f[2] for f, _ in entries), 'fingerprint': fingerprint}
+    # SPM.mat is generated for ART on the same images
+    art = [n for n in nodes.values() if n['stage'] == 'art']
+    for name in special:
+        if art:
+            nodes[name]['parent'] = art[0]['parent']
+    return nodes
+
+def folder_key(folder):
+    return '/'.join(p for p in (folder['condition'], folder['subject'], folder['session'], folder['modality']) if p)
+
+def stale_nodes(folder, nodes, state, changed_stages, jobs, tolerance):
+    '''Find the stale nodes of a folder. Returns a dict {prefix: [reasons]}.'''
+    key = folder_key(folder)
+    recorded = state.get('nodes', {}).get(key, {})
+    stale = {}
+    def depth(prefix):
+        parent = nodes[prefix]['parent']
+        return 0 if parent is None or parent not in nodes else depth(parent) + 1
+    # Parents before their children
+    for prefix in sorted(nodes, key=depth):
+        node = nodes[prefix]
+        if node['stage'] == 'raw':
+            continue
+        reasons = []
+        parent = nodes.get(node['parent']) if node['parent'] is not None else None
+        if parent is not None:
+            pname = parent['prefix'] or 'raw'
+            if parent['prefix'] in stale:
+                reasons.append('input %s is stale' % pname)
+            if parent['max_mtime'] > node['max_mtime'] + tolerance:
+                reasons.append('input %s is newer' % pname)
+            if VOLUME_TOKEN_REGEX.match(node['token']) and node['nstems'] < parent['nstems']:
+                reasons.append('incomplete (%i/%i volumes)' % (node['nstems'], parent['nstems']))
+            if parent['prefix'] in recorded and recorded[parent['prefix']] != parent['fingerprint'] and recorded.get(prefix) == node['fingerprint']:
+                reasons.append('input %s changed since the last run' % pname)
+        if node['stage'] in changed_stages:
+            reasons.append(changed_stages[node['stage']])
+        jobkey = (node['stage'], folder['subject'], folder['isess'], folder['imodal'])
+        if jobkey in jobs and jobs[jobkey][1] is not None and state.get('jobs', {}).get('|'.join(jobkey), jobs[jobkey][1]) != jobs[jobkey][1]:
+            reasons.append('batch job changed')
+        if reasons:
+            stale[prefix] = reasons
+    return stale
+
+def plan(folders, lineages, state, changed_stages, jobs, tolerance, shared_mri=False):
+    '''Compute the stages to re-run for each functional folder. Returns the rows of the plan.'''
+    # Stale structural folders force the preproc of all the functional folders of the subject
+    structural = {}
+    for folder, nodes in zip(folders, lineages):
+        if folder['structural']:
+            stale = stale_nodes(folder, nodes, state, changed_stages, jobs, tolerance)
+            if stale:
+                structural[(folder['condition'], folder['subject'], folder['session'])] = 'structural %s' % ', '.join('%s: %s' % (p or 'raw', '; '.join(r)) for p, r in sorted(stale.items()))
+    rows = []
+    for folder, nodes in zip(folders, lineages):
+        if folder['structural']:
+            continue
+        reasons = collections.defaultdict(list)
+        for prefix, r in stale_nodes(folder, nodes, state, changed_stages, jobs, tolerance).items():
+            reasons[nodes[prefix]['stage']].append('%s: %s' % (prefix, '; '.join(r)))
+        present = set(n['stage'] for n in nodes.values()) | set(s for (s, subj, i, j) in jobs if (subj, i, j) == (folder['subject'], folder['isess'], folder['imodal']))
+        # A structural folder shared by all sessions has an empty session
+        for session in ('', folder['session']):
+            if (folder['condition'], folder['subject'], session) in structural:
+                reasons['preproc'].append(structural[(folder['condition'], folder['subject'], session)])
+        if not any(n['stage'] != 'raw' for n in nodes.values()):
+            reasons['preproc'].append('not processed yet')
+        # ART has no batch job, it is expected after the spmgenart stage
+        if 'spmgenart' in present:
+            present.add('art')
+        produced = set(n['stage'] for n in nodes.values())
+        for stage in STAGE_ORDER:
+            if stage in present and stage not in produced:
+                reasons[stage].append('no outputs')
+        first = min((STAGE_ORDER.index(s) for s in reasons if s in STAGE_ORDER), default=None)
+        if first is None:
+            continue
+        for stage in STAGE_ORDER[first:]:
+            if stage not in present and stage != 'preproc':
+                continue
+            if stage == 'art':
+                parts = [folder['condition'], folder['subject'], 'data', folder['session'], folder['modality']]
+                job = 'art_%s' % '_'.join(parts)
+            else:
+                job = jobs.get((stage, folder['subject'], folder['isess'], folder['imodal']), (None, None))[0] or ''
+                if stage == 'preproc' and shared_mri:
+                    job = jobs.get(('preproc', folder['subject'], '', ''), (None, None))[0] or job
+            rows.append({'condition': folder['condition'], 'subject': folder['subject'], 'session': folder['session'], 'modality': folder['modality'],
+                         'stage': stage, 'job': job, 'reasons': ' | '.join(reasons.get(stage, ['after %s' % STAGE_ORDER[first]]))})
+    return rows
+
+def latest_jobs(jobsdir, shared_mri=False):
+    '''Latest batch job of each stage, subject, session and modality, with its hash: {(stage, subject, isess, imodal): (job name, hash)}. With shared_mri, the latest preproc job of each subject is also stored with empty session and modality.'''
+    jobs = {}
+    if not os.path.isdir(jobsdir):
+        return jobs
+    for job in find_jobs(jobsdir):
+        jobs[(job.stage, job.subject, job.session, job.modality)] = (job.name, job_hash(job.target))
+    if shared_mri:
+        for job in find_jobs(jobsdir, ['preproc'], shared_mri=True):
+            jobs[('preproc', job.subject, '', '')] = (job.name, None)
+    return jobs
+
+def write_plan(rows, outpath):
+    '''Write the plan as a CSV table, atomically'''
+    tmppath = outpath + '.tmp'
+    with open(tmppath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmppath, outpath)
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Derivative lineage and incremental re-processing planner v%s
+Description: Reconstruct the lineage of the derivatives of each subject from the SPM prefixes, and find the minimal set of subjects and stages to re-run after the data or the parameters changed.
+    ''' % __version__
+    ep = '''Run with --record after each successful run, so that the next plans can detect the changes of the data and parameters.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/root_pth', type=str, required=True,
+                        help='Root folder of the data tree (with the conditions folders and the JOBS folder).')
+    main_parser.add_argument('--jobs-dir', metavar='/root_pth/JOBS', type=str, required=False, default=None,
+                        help='Folder of the batch jobs (default: JOBS in the root folder).')
+    main_parser.add_argument('--state', metavar='lineage_state.json', type=str, required=False, default=None,
+                        help='State of the last run (default: %s in the JOBS folder).' % STATE_FILE)
+    main_parser.add_argument('--script', metavar='script_preproc_fmri_csg.m', type=str, required=False, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script_preproc_fmri_csg.m'),
+                        help='Preprocessing script whose parameters are hashed (default: the one in the same folder as this tool).')
+    main_parser.add_argument('--record', action='store_true', required=False, default=False,
+                        help='Record the state of the current run instead of planning.')
+    main_parser.add_argument('-o', '--output', metavar='jobs_plan.txt', type=str, required=False, default=None,
+                        help='Save the list of jobs to run, for run_jobs_pool.py --only.')
+    main_parser.add_argument('--csv', metavar='plan.csv', type=str, required=False, default=None,
+                        help='Save the plan as a CSV table.')
+    main_parser.add_argument('--func-regex', metavar='regex', type=str, required=False, default='(rest|func|task|tennis|navigation)',
+                        help='Regex matching the functional (modalities) folders, as func_dir_regex in script_preproc_fmri_csg.m.')
+    main_parser.add_argument('--shared-mri', action='store_true', required=False, default=False,
+                        help='The preproc batch of a subject contains all its sessions (sharedmri_all = true), so plan its latest preproc job.')
+    main_parser.add_argument('--tolerance', metavar='seconds', type=float, required=False, default=60,
+                        help='An input is newer than its derivative only if its last modification is more than this later (default: 60s, the time SPM can take to update the headers after writing a derivative).')
+    main_parser.add_argument('-j', '--jobs', metavar='16', type=int, required=False, default=16,
+                        help='Number of folders listed in parallel threads (default: 16).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    rootpath = fullpath(args.input)
+    jobsdir = fullpath(args.jobs_dir) if args.jobs_dir else os.path.join(rootpath, 'JOBS')
+    statepath = fullpath(args.state) if args.state else os.path.join(jobsdir, STATE_FILE)
+    if not os.path.isdir(rootpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    folders = find_folders(rootpath, args.func_regex)
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        listings = list(executor.map(lambda folder: list_files(folder['path'], CAT12_SUBDIRS if folder['structural'] else ()), folders))
+    lineages = [build_lineage(files) for files in listings]
+    params = stage_param_hashes(parse_script_params(args.script)) if os.path.exists(args.script) else {}
+    jobs = latest_jobs(jobsdir, args.shared_mri)
+    print('== Found %i folders (%i structural), %i files, %i batch jobs' % (len(folders), sum(f['structural'] for f in folders), sum(len(l) for l in listings), len(jobs)))
+
+    if args.record:
+        state = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'params': params,
+                 'jobs': {'|'.join(k): h for k, (_, h) in jobs.items() if h is not None},
+                 'nodes': {folder_key(folder): {p: n['fingerprint'] for p, n in nodes.items()} for folder, nodes in zip(folders, lineages)}}
+        if not os.path.isdir(os.path.dirname(statepath)):
+            os.makedirs(os.path.dirname(statepath))
+        with open(statepath + '.tmp', 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(statepath + '.tmp', statepath)
+        print('== State of %i folders recorded in %s' % (len(folders), statepath))
+        return 0
+
+    state = {}
+    if os.path.exists(statepath):
+        with open(statepath, 'r') as f:
+            state = json.load(f)
+        print('-> Comparing with the run recorded on %s' % state.get('time'))
+    else:
+        print('-> No recorded run (%s), only the mtimes and completeness of the derivatives are compared' % statepath)
+    changed_stages = {stage: 'parameters of %s changed' % stage for stage, h in params.items() if stage in state.get('params', {}) and state['params'][stage] != h}
+    for stage in sorted(changed_stages):
+        print('-> Parameters of the %s stage changed since the last run' % stage)
+
+    rows = plan(folders, lineages, state, changed_stages, jobs, args.tolerance, args.shared_mri)
+    nfunc = sum(not f['structural'] for f in folders)
+    byfolder = collections.OrderedDict()
+    for row in rows:
+        byfolder.setdefault(tuple(row[c] for c in COLUMNS[:4]), []).append(row)
+    for key, frows in byfolder.items():
+        print('-- %s: %s' % ('/'.join(key), ', '.join(r['stage'] for r in frows)))
+        for r in frows:
+            print('   %s: %s' % (r['stage'], r['reasons']))
+    print('== %i of %i functional folders (%i subjects) to re-run, %i stages' % (len(byfolder), nfunc, len(set(k[:2] for k in byfolder)), len(rows)))
+    manual = sorted(set(r['stage'] for r in rows if not r['job']))
+    if manual:
+        print('-> No batch job for the stages %s, run script_preproc_fmri_csg.m for them (see the --csv table for the folders).' % ', '.join(manual))
+    if args.csv:
+        write_plan(rows, fullpath(args.csv))
+        print('-> Plan saved in %s' % fullpath(args.csv))
+    if args.output:
+        names = list(collections.OrderedDict.fromkeys(r['job'] for r in rows if r['job']))
+        with open(fullpath(args.output), 'w') as f:
+            f.write(''.join(n + '\n' for n in names))
+        print('-> %i jobs saved in %s, run them with run_jobs_pool.py --only' % (len(names), fullpath(args.output)))
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,43 @@
+function filesList = manifest_regex_files(manifest, dirpath, regex)
+% filesList = manifest_regex_files(manifest, dirpath, regex)
+% Same as regex_files(dirpath, regex) but using a manifest generated by
+% dataset_index.py instead of listing the directory (much faster on network shares).
+% input: manifest is either the path to a .mat manifest or the manifest
+% struct already loaded (load it once with: m = load('manifest.mat'); manifest = m.manifest;)
+% input: dirpath is the directory to list (only the files directly inside it are returned)
+% input: regex is a regular expression to filter the filenames
+% output: a cell array of full paths, or directly the string if there is only one file matched
+%
+% The manifest also contains the parsed condition, subject, session,
+% modality and SPM prefix of each file, so you can also filter directly, eg:
+% manifest.path(strcmp(manifest.modality, 'rest') & strcmp(manifest.prefix, 'wa'))
+%
+% Remember to refresh the manifest (python dataset_index.py) after adding or removing files.
+%
+% MIT License
+
+    % Load the manifest if a path is provided
+    if ischar(manifest)
+        m = load(manifest);
+        manifest = m.manifest;
+    end
+
+    % Normalize the directories separators so that paths generated on Windows or Linux can be compared
+    normdir = @(p) regexprep(strrep(p, '\', '/'), '/+$', '');
+    dirs = cellfun(normdir, manifest.dir(:), 'UniformOutput', false);
+    % Select the files in the directory
+    sel = strcmp(dirs, normdir(dirpath));
+    names = manifest.name(sel);
+    % Use regular expression to filter only the files we want
+    filesList = regexp(names(:)', regex, 'match');
+    % Remove empty matches
+    filesList = [filesList{:}];
+    % Prepend the full path before each filename (so that we get absolute paths)
+    if length(filesList) > 0
+        filesList = cellfun(@(f) fullfile(dirpath, f), filesList, 'UniformOutput', false);
+    end
+    % Return directly the string instead of the cell array if there is only one file matched
+    if length(filesList) == 1
+        filesList = filesList{1};
+    end
+end
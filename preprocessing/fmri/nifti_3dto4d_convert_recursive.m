@@ -4,6 +4,7 @@ function nifti_3dto4d_convert_recursive(rootpath, spmpath)
 % WARNING: will delete the 3D nifti files! Make a backup before!
 % Useful to avoid memory errors when processing (the dreaded "cant map view" error) when the nifti is too big.
 % This script needs both SPM (to convert from 3D to 4D) and dirPlus (https://github.com/kpeaton/dirPlus).
+% For big datasets, nifti_3dto4d_stream.py does the same without SPM and without loading the 3D files in memory.
 % by Stephen Larroque, 2017-2024, from the Coma Science Group, University of Liege
 %
 
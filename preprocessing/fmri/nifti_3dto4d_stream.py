@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# nifti_3dto4d_stream.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Streaming 3D to 4D NIfTI concatenator
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: concatenate recursively the 3D NIfTI (.nii, .nii.gz, .img/.hdr) files of each folder into one 4D NIfTI file, same as nifti_3dto4d_convert_recursive.m but without SPM and as a purely I/O bound pass.
+#
+# spm_file_merge (used by nifti_3dto4d_convert_recursive.m) loads all the input volumes, which is slow and memory hungry for sessions of 1000+ volumes (sleep, long resting-state). Here the 4D file is preallocated from the header of the first volume and the number of volumes, then the voxel data of each 3D file is copied straight into place, without decoding it: with os.copy_file_range or os.sendfile (zero-copy, the data never goes through Python) when available, else with buffered reads. This is possible when all volumes have the same datatype and scaling (scl_slope/scl_inter), which is the usual case. Only when they differ (eg, volumes converted separately with per-volume scaling) are the volumes reconciled: each one is then read (one volume at a time), scaled, and written as float32 (float64 if any input is float64 or a 32/64 bits integer) in the 4D file.
+#
+# The 4D file is named like nifti_3dto4d_convert_recursive.m does: <first 3D file name>_4d.nii. Folders where the 3D files do not all have the same dimensions are skipped with an error. Unlike nifti_3dto4d_convert_recursive.m, folders with less than --min-volumes 3D files (default: 2) are left as-is, so that the structural images are not converted.
+#
+# With --delete, the 4D file is first written to a temporary .part.nii file and verified (header read back, file size, and values of each volume compared to the 3D file), then renamed, and only then are the 3D files deleted. If anything fails, the temporary file is removed and the 3D files are left untouched.
+#
+# Usage:
+#   python nifti_3dto4d_stream.py -i /root_pth            # concatenate the 3D files of each folder, keep the 3D files
+#   python nifti_3dto4d_stream.py -i /root_pth --delete   # concatenate, verify, then delete the 3D files (like nifti_3dto4d_convert_recursive.m)
+#
+# Required libraries: nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import os
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+from nibabel.openers import ImageOpener
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Extensions of the 3D images to concatenate (.hdr files are opened through their .img)
+IMAGE_EXTS = ('.nii', '.nii.gz', '.img')
+# Suffix of the 4D files generated by this script and nifti_3dto4d_convert_recursive.m, never used as inputs
+OUTPUT_SUFFIX = '_4d.nii'
+# Size of the chunks of voxel data copied at once (in bytes)
+CHUNK_SIZE = 4 * 1024 * 1024
+# Suffix of the temporary files (before the extension so that they can be read back by nibabel), before they are verified and renamed
+PART_SUFFIX = '.part'
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def split_ext(filepath):
+    '''Split the filename and the image extension (handles .nii.gz)'''
+    if filepath.lower().endswith('.nii.gz'):
+        return filepath[:-7], filepath[-7:]
+    return os.path.splitext(filepath)
+
+def find_dirs(inputpath):
+    '''Find recursively all folders containing images, skipping the hidden folders (such as __MACOSX, which contains fake .nii files). Returns a dict folder -> sorted list of images.'''
+    dirs_images = {}
+    for dirpath, dirs, files in os.walk(inputpath):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__MACOSX')
+        images = [os.path.join(dirpath, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTS) and not f.startswith('.') and not f.endswith(OUTPUT_SUFFIX) and PART_SUFFIX + '.' not in f]
+        if images:
+            dirs_images[dirpath] = images
+    return dirs_images
+
+def is_3d(img):
+    '''Is the image a single volume?'''
+    shape = img.header.get_data_shape()
+    return len(shape) <= 3 or all(d == 1 for d in shape[3:])
+
+def scaling(img):
+    '''Get the (slope, inter) scaling of an image, as applied by nibabel (1, 0 if none)'''
+    return (float(getattr(img.dataobj, 'slope', 1.0)), float(getattr(img.dataobj, 'inter', 0.0)))
+
+def is_uncompressed(img):
+    '''Is the voxel data stored uncompressed on disk (so that it can be copied with zero-copy system calls)?'''
+    return split_ext(img.file_map['image'].filename)[1].lower() in ('.nii', '.img')
+
+def make_4d_header(img, nvols, dtype=None, slope_inter=(1.0, 0.0)):
+    '''Build the header of the 4D file from the header of the first 3D volume, in the same endianness so that the voxel data can be copied as-is'''
+    src_hdr = img.header
+    klass = nib.Nifti2Header if isinstance(src_hdr, nib.Nifti2Header) else nib.Nifti1Header
+    hdr = klass.from_header(src_hdr)
+    if not isinstance(src_hdr, nib.Nifti1Header):
+        # Analyze headers have no orientation, use the affine of the image (which includes the SPM .mat file if any)
+        hdr.set_qform(img.affine, 'scanner')
+        hdr.set_sform(img.affine, 'scanner')
+    if hdr.endianness != src_hdr.endianness:
+        hdr = hdr.as_byteswapped(src_hdr.endianness)
+    if dtype is not None:
+        hdr.set_data_dtype(dtype)
+    hdr.set_data_shape(tuple(src_hdr.get_data_shape()[:3]) + (nvols,))
+    hdr.set_slope_inter(*slope_inter)
+    hdr['vox_offset'] = 0 # let the header compute the minimal offset (after extensions)
+    return hdr
+
+def copy_range(src, dst, src_offset, dst_offset, nbytes):
+    '''Copy nbytes from the src file object at src_offset to the dst file object at dst_offset, using zero-copy system calls when available'''
+    dst.flush()
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < nbytes:
+                n = os.copy_file_range(src_fd, dst_fd, nbytes - copied, src_offset + copied, dst_offset + copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError: # eg, cross-filesystem copy on older kernels, fallback below
+            pass
+    if copied < nbytes and hasattr(os, 'sendfile'):
+        try:
+            os.lseek(dst_fd, dst_offset + copied, os.SEEK_SET)
+            while copied < nbytes:
+                n = os.sendfile(dst_fd, src_fd, src_offset + copied, nbytes - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass
+    if copied < nbytes:
+        src.seek(src_offset + copied)
+        dst.seek(dst_offset + copied)
+        copy_stream(src, dst, nbytes - copied)
+
+def copy_stream(src, dst, nbytes):
+    '''Copy nbytes from the current position of the src file object to the dst file object by chunks'''
+    remaining = nbytes
+    while remaining > 0:
+        buf = src.read(min(CHUNK_SIZE, remaining))
+        if not buf:
+            raise IOError('Unexpected end of file, %i bytes missing' % remaining)
+        dst.write(buf)
+        remaining -= len(buf)
+
+def check_volumes(imgs):
+    '''Check that all volumes can be concatenated, and decide if their voxel data can be copied as-is (raw) or must be reconciled.
+    Returns (raw, dtype, slope_inter, warnings).'''
+    first = imgs[0]
+    shape = first.header.get_data_shape()[:3]
+    warnings = []
+    for img in imgs[1:]:
+        if img.header.get_data_shape()[:3] != shape:
+            raise ValueError('%s has dimensions %s but %s has %s' % (img.get_filename(), img.header.get_data_shape()[:3], first.get_filename(), shape))
+        if not np.allclose(img.affine, first.affine, atol=1e-4):
+            warnings.append('%s has a different orientation than %s, the orientation of the first volume is used' % (img.get_filename(), first.get_filename()))
+    dtypes = set(img.get_data_dtype().str for img in imgs)
+    scalings = set(scaling(img) for img in imgs)
+    if len(dtypes) == 1 and len(scalings) == 1:
+        return True, None, scalings.pop(), warnings
+    # Reconcile the volumes with different datatypes or scalings, as floats in the endianness of the first volume
+    # float32 is exact for up to 16 bits integers (with scaling), use float64 for bigger integers or float64 inputs
+    dtype = np.float64 if any(img.get_data_dtype().itemsize > 4 or (img.get_data_dtype().kind in 'iu' and img.get_data_dtype().itemsize > 2) for img in imgs) else np.float32
+    warnings.append('volumes have different datatypes or scalings (%s), they are converted to %s' % (', '.join(sorted(dtypes)), np.dtype(dtype).name))
+    return False, dtype, (1.0, 0.0), warnings
+
+def concat_3d(images, outpath, delete=False, force=False):
+    '''Concatenate a list of 3D images into one 4D NIfTI file, preallocated and filled volume by volume.
+    If delete is True, the 4D file is written to a temporary file, verified, renamed, and only then the 3D files are deleted.
+    Returns a list of warnings.'''
+    if os.path.exists(outpath) and not force:
+        raise IOError('output file %s already exists (use --force to overwrite)' % outpath)
+    imgs = [nib.load(f) for f in images]
+    raw, dtype, slope_inter, warnings = check_volumes(imgs)
+    hdr = make_4d_header(imgs[0], len(imgs), dtype, slope_inter)
+    out_dtype = hdr.get_data_dtype()
+    nbytes = int(np.prod(hdr.get_data_shape()[:3])) * out_dtype.itemsize
+    tmppath = split_ext(outpath)[0] + PART_SUFFIX + '.nii' if delete else outpath
+    try:
+        with open(tmppath, 'wb') as f:
+            hdr.write_to(f)
+            offset = int(hdr['vox_offset'])
+            f.write(b'\x00' * (offset - f.tell()))
+            # Preallocate the whole 4D file, so that the filesystem can allocate it contiguously and we fail early if the disk is full
+            total = offset + nbytes * len(imgs)
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, total)
+                except OSError: # not supported by this filesystem
+                    f.truncate(total)
+            else:
+                f.truncate(total)
+            for i, img in enumerate(imgs):
+                dst_offset = offset + i * nbytes
+                with ImageOpener(img.file_map['image'].filename, 'rb') as src:
+                    if raw and is_uncompressed(img):
+                        copy_range(src, f, img.dataobj.offset, dst_offset, nbytes)
+                    elif raw:
+                        src.seek(img.dataobj.offset)
+                        f.seek(dst_offset)
+                        copy_stream(src, f, nbytes)
+                if not raw:
+                    data = np.asarray(img.dataobj, dtype=out_dtype).reshape(img.shape[:3])
+                    f.seek(dst_offset)
+                    f.write(data.tobytes(order='F'))
+        if delete:
+            verify_4d(tmppath, imgs, offset + nbytes * len(imgs))
+    except BaseException:
+        # Never leave a partial 4D file behind (the 3D files are still there)
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+    if delete:
+        os.replace(tmppath, outpath)
+        for f in images:
+            remove_image(f)
+    return warnings
+
+def verify_4d(outpath, imgs, expected_size):
+    '''Verify the 4D file: size, dimensions, and values of each volume (loaded one at a time) compared to the 3D files'''
+    if os.path.getsize(outpath) != expected_size:
+        raise IOError('%s: wrong size %i, expected %i' % (outpath, os.path.getsize(outpath), expected_size))
+    out = nib.load(outpath)
+    if out.shape != tuple(imgs[0].shape[:3]) + (len(imgs),):
+        raise IOError('%s: wrong shape %s' % (outpath, out.shape))
+    for i, img in enumerate(imgs):
+        if not np.allclose(out.dataobj[..., i], np.asarray(img.dataobj).reshape(img.shape[:3]), rtol=1e-6, atol=0, equal_nan=True):
+            raise IOError('%s: volume %i differs from %s' % (outpath, i + 1, img.get_filename()))
+
+def remove_image(filepath):
+    '''Remove an image and its associated files (for .img: the .hdr, and the .mat SPM might have written alongside)'''
+    stem, ext = split_ext(filepath)
+    paths = [filepath] + ([stem + '.hdr', stem + '.mat'] if ext.lower() == '.img' else [])
+    for p in paths:
+        if os.path.exists(p):
+            os.remove(p)
+
+def process_dir(args):
+    '''Concatenate the 3D images of one folder, never raises but returns the error'''
+    dirpath, images, min_volumes, delete, force = args
+    try:
+        images = [f for f in images if is_3d(nib.load(f))]
+        if len(images) < max(min_volumes, 1):
+            return {'dir': dirpath, 'outputs': None}
+        outpath = split_ext(images[0])[0] + OUTPUT_SUFFIX
+        warnings = concat_3d(images, outpath, delete=delete, force=force)
+        return {'dir': dirpath, 'outputs': outpath, 'nvols': len(images), 'warnings': warnings}
+    except Exception as exc:
+        return {'dir': dirpath, 'error': '%s: %s' % (exc.__class__.__name__, exc)}
+
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Streaming 3D to 4D NIfTI concatenator v%s
+Description: Concatenate recursively the 3D NIfTI files (.nii, .nii.gz, .img/.hdr) of each folder into one 4D NIfTI file (named <first file>%s), by copying the voxel data straight into a preallocated 4D file (zero-copy when possible). Several folders are processed in parallel.
+    ''' % (__version__, OUTPUT_SUFFIX)
+    ep = '''WARNING: with --delete the 3D files are deleted (after the 4D file was written and verified)! Make a backup before!'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder to walk recursively.')
+    main_parser.add_argument('--min-volumes', metavar='N', type=int, required=False, default=2,
+                        help='Minimum number of 3D files in a folder to concatenate them (default: 2, set to 1 to also convert single 3D files like nifti_3dto4d_convert_recursive.m).')
+    main_parser.add_argument('--delete', action='store_true', required=False, default=False,
+                        help='Write the 4D file, verify it, then delete the 3D files (atomic: on any error the 3D files are kept and the partial 4D file removed).')
+    main_parser.add_argument('-f', '--force', action='store_true', required=False, default=False,
+                        help='Overwrite existing 4D files.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=4,
+                        help='Number of folders processed in parallel (default: 4, this is I/O bound).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show each generated 4D file).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    dirs_images = find_dirs(inputpath)
+    print('== Found %i folders with nifti files in %s, concatenating the 3D ones...' % (len(dirs_images), inputpath))
+    nconverted = nerrors = 0
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        for res in executor.map(process_dir, [(d, imgs, args.min_volumes, args.delete, args.force) for d, imgs in sorted(dirs_images.items())]):
+            if 'error' in res:
+                nerrors += 1
+                print('ERROR: %s: %s' % (res['dir'], res['error']), file=sys.stderr)
+            elif res['outputs'] is not None:
+                nconverted += 1
+                for w in res['warnings']:
+                    print('WARNING: %s: %s' % (res['dir'], w), file=sys.stderr)
+                if args.verbose:
+                    print('-> %s: %i volumes%s' % (res['outputs'], res['nvols'], ' (3D files deleted)' if args.delete else ''))
+    print('== Done: %i 4D files written, %i errors.' % (nconverted, nerrors))
+    return 1 if nerrors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
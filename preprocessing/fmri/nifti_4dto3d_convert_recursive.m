@@ -4,6 +4,7 @@ function nifti_4dto3d_convert_recursive(rootpath, spmpath)
 % WARNING: will delete the 4D nifti files! Make a backup before!
 % Useful to avoid memory errors when processing (the dreaded "cant map view" error) when the nifti is too big.
 % This script needs both SPM (to convert from 4D to 3D) and dirPlus (https://github.com/kpeaton/dirPlus).
+% For big datasets, nifti_4dto3d_stream.py does the same without SPM, in parallel and without loading the whole 4D files in memory.
 % v1.2.0, 2017-2024, Stephen Larroque, Coma Science Group, University of Liege
 %
 
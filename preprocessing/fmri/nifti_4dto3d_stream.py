@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# nifti_4dto3d_stream.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Streaming 4D to 3D NIfTI splitter
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: split recursively all 4D NIfTI (.nii, .nii.gz, .img/.hdr) files into 3D NIfTI files (one per volume), same as nifti_4dto3d_convert_recursive.m but without SPM and with a bounded memory usage.
+#
+# nifti_4dto3d_convert_recursive.m goes through spm_file_split, which maps the whole 4D file and rewrites each volume, and big 4D files are precisely the ones that trigger the "Cant map view of file" error (see Note9 in script_preproc_fmri_csg.m). Here the voxel data of each volume is copied as raw bytes, by chunks, from the 4D file (compressed .nii.gz files are inflated on the fly, never on disk) to its 3D file, with a copy of the 4D header where only the dimensions are changed. So the datatype, endianness and scaling (scl_slope/scl_inter) are kept exactly as they were, and at most one chunk (smaller than a volume) is held in memory. Several 4D files are split concurrently in a pool of processes.
+#
+# The 3D files are named like spm_file_split does: <name>_00001.nii, <name>_00002.nii, etc. Compressed files are split into uncompressed .nii files (as nifti_4dto3d_convert_recursive.m does), and .img/.hdr pairs into .img/.hdr pairs.
+#
+# With --delete, each 4D file is converted atomically: all the volumes are first written to temporary .part files, then each one is verified (header read back, file size and checksum of the voxel data), and only if all volumes are fine are they renamed to their final names and the 4D file deleted. If anything fails, the temporary files are removed and the 4D file is left untouched.
+#
+# Usage:
+#   python nifti_4dto3d_stream.py -i /root_pth            # split all 4D files, keep the 4D files
+#   python nifti_4dto3d_stream.py -i /root_pth --delete   # split, verify, then delete the 4D files (like nifti_4dto3d_convert_recursive.m)
+#
+# Required libraries: nibabel.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import hashlib
+import os
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import nibabel as nib
+from nibabel.openers import ImageOpener
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Extensions of the images to split (.hdr files are opened through their .img)
+IMAGE_EXTS = ('.nii', '.nii.gz', '.img')
+# Size of the chunks of voxel data copied at once (in bytes)
+CHUNK_SIZE = 4 * 1024 * 1024
+# Suffix of the temporary files, before they are verified and renamed
+PART_SUFFIX = '.part'
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def split_ext(filepath):
+    '''Split the filename and the image extension (handles .nii.gz)'''
+    if filepath.lower().endswith('.nii.gz'):
+        return filepath[:-7], filepath[-7:]
+    return os.path.splitext(filepath)
+
+def find_images(inputpath):
+    '''Find recursively all NIfTI/Analyze images, skipping the hidden folders (such as __MACOSX, which contains fake .nii files)'''
+    images = []
+    for dirpath, dirs, files in os.walk(inputpath):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and d != '__MACOSX')
+        images.extend(os.path.join(dirpath, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTS) and not f.startswith('.'))
+    return images
+
+def nvolumes(img):
+    '''Number of volumes of an image (0 if the image cannot be split: more than 4 dimensions or bit-packed data)'''
+    shape = img.header.get_data_shape()
+    if len(shape) > 4 and any(d > 1 for d in shape[4:]):
+        return 0
+    if img.header.get_data_dtype().itemsize == 0:
+        return 0
+    return shape[3] if len(shape) >= 4 else 1
+
+def output_paths(filepath, nvols, outdir=None):
+    '''Get the paths of the 3D files (image, header or None) that spm_file_split would generate for each volume'''
+    stem, ext = split_ext(filepath)
+    if outdir is not None:
+        stem = os.path.join(outdir, os.path.basename(stem))
+    is_pair = ext.lower() == '.img'
+    paths = []
+    for i in range(1, nvols + 1):
+        base = '%s_%05i' % (stem, i)
+        paths.append((base + '.img', base + '.hdr') if is_pair else (base + '.nii', None))
+    return paths
+
+def make_3d_header(img):
+    '''Copy the 4D header and only change the dimensions (datatype, endianness, scaling, orientation and extensions are kept as-is)'''
+    hdr = img.header.copy()
+    hdr.set_data_shape(hdr.get_data_shape()[:3])
+    # nibabel moves the scaling from the header to the data proxy when loading, put it back since the raw (scaled) values are copied
+    slope, inter = getattr(img.dataobj, 'slope', 1.0), getattr(img.dataobj, 'inter', 0.0)
+    if slope != 1.0 or inter != 0.0:
+        hdr.set_slope_inter(slope, inter)
+    if 'vox_offset' in hdr:
+        hdr['vox_offset'] = 0 # let the header compute the minimal offset (after extensions) for single files, and 0 for pairs
+    return hdr
+
+def copy_bytes(src, dst, nbytes, hasher=None):
+    '''Copy nbytes from the src file object to the dst file object by chunks, optionally updating a hasher'''
+    remaining = nbytes
+    while remaining > 0:
+        buf = src.read(min(CHUNK_SIZE, remaining))
+        if not buf:
+            raise IOError('Unexpected end of file, %i bytes missing' % remaining)
+        dst.write(buf)
+        if hasher is not None:
+            hasher.update(buf)
+        remaining -= len(buf)
+
+def write_volume(src, hdr, imgpath, hdrpath, nbytes):
+    '''Write one 3D volume: the header, then nbytes of voxel data read from src. Returns the checksum of the voxel data.'''
+    hasher = hashlib.blake2b()
+    if hdrpath is not None:
+        with open(hdrpath, 'wb') as f:
+            hdr.write_to(f)
+        with open(imgpath, 'wb') as f:
+            copy_bytes(src, f, nbytes, hasher)
+    else:
+        with open(imgpath, 'wb') as f:
+            hdr.write_to(f)
+            # Pad up to the voxel offset (only needed if there are extensions)
+            f.write(b'\x00' * (int(hdr['vox_offset']) - f.tell()))
+            copy_bytes(src, f, nbytes, hasher)
+    return hasher.hexdigest()
+
+def verify_volume(imgpath, hdrpath, header_class, shape, offset, nbytes, digest):
+    '''Verify a written 3D volume: the header can be read back with the expected shape, the file has the expected size and the voxel data the expected checksum'''
+    with open(hdrpath if hdrpath is not None else imgpath, 'rb') as f:
+        hdr = header_class.from_fileobj(f)
+    if hdr.get_data_shape() != shape:
+        raise IOError('%s: wrong shape %s, expected %s' % (imgpath, hdr.get_data_shape(), shape))
+    if os.path.getsize(imgpath) != offset + nbytes:
+        raise IOError('%s: wrong size %i, expected %i' % (imgpath, os.path.getsize(imgpath), offset + nbytes))
+    hasher = hashlib.blake2b()
+    with open(imgpath, 'rb') as f:
+        f.seek(offset)
+        for buf in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(buf)
+    if hasher.hexdigest() != digest:
+        raise IOError('%s: checksum mismatch of the voxel data' % imgpath)
+
+def remove_files(paths):
+    '''Remove files, ignoring the missing ones'''
+    for p in paths:
+        if p is not None and os.path.exists(p):
+            os.remove(p)
+
+def source_files(filepath):
+    '''All the files making up an image (for .img: the .hdr, and the .mat SPM might have written alongside)'''
+    stem, ext = split_ext(filepath)
+    if ext.lower() != '.img':
+        return [filepath]
+    return [filepath] + [p for p in (stem + '.hdr', stem + '.mat') if os.path.exists(p)]
+
+def split_4d(filepath, delete=False, outdir=None, force=False):
+    '''Split one 4D image into 3D images, with at most one chunk of voxel data in memory.
+    If delete is True, the volumes are written to temporary files, verified, renamed, and only then the 4D file is deleted.
+    Returns the list of paths of the 3D images, or None if the file is not a 4D image.'''
+    img = nib.load(filepath)
+    nvols = nvolumes(img)
+    shape = img.header.get_data_shape()
+    if nvols == 0:
+        raise ValueError('%s: cannot split an image of shape %s and datatype %s' % (filepath, shape, img.header.get_data_dtype()))
+    if len(shape) < 4 or nvols < 2:
+        return None
+    paths = output_paths(filepath, nvols, outdir)
+    if not force:
+        existing = [p for pair in paths for p in pair if p is not None and os.path.exists(p)]
+        if existing:
+            raise IOError('%s: output file %s already exists (use --force to overwrite)' % (filepath, existing[0]))
+    # Temporary paths, renamed only after verification, so that an interrupted conversion never leaves truncated 3D files with their final names
+    tmppaths = [tuple(p + PART_SUFFIX if p is not None else None for p in pair) for pair in paths] if delete else paths
+
+    hdr = make_3d_header(img)
+    nbytes = int(np.prod(shape[:3])) * img.header.get_data_dtype().itemsize
+    src_offset = img.dataobj.offset
+    srcpath = img.file_map['image'].filename
+    digests = []
+    try:
+        # ImageOpener inflates .nii.gz on the fly, volumes are read sequentially so there is no need to seek back
+        with ImageOpener(srcpath, 'rb') as src:
+            src.seek(src_offset)
+            for imgpath, hdrpath in tmppaths:
+                digests.append(write_volume(src, hdr, imgpath, hdrpath, nbytes))
+        if delete:
+            dst_offset = 0 if paths[0][1] is not None else int(hdr['vox_offset'])
+            for (imgpath, hdrpath), digest in zip(tmppaths, digests):
+                verify_volume(imgpath, hdrpath, hdr.__class__, shape[:3], dst_offset, nbytes, digest)
+    except BaseException:
+        # Never leave a partial conversion behind (the 4D file is still there)
+        for pair in tmppaths:
+            remove_files(pair)
+        raise
+    if delete:
+        for pair, tmppair in zip(paths, tmppaths):
+            for p, tmpp in zip(pair, tmppair):
+                if p is not None:
+                    os.replace(tmpp, p)
+        remove_files(source_files(filepath))
+    return [imgpath for imgpath, _ in paths]
+
+def process_file(args):
+    '''Worker for the process pool, never raises but returns the error'''
+    filepath, delete, outdir, force = args
+    try:
+        return {'file': filepath, 'outputs': split_4d(filepath, delete=delete, outdir=outdir, force=force)}
+    except Exception as exc:
+        return {'file': filepath, 'error': '%s: %s' % (exc.__class__.__name__, exc)}
+
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Streaming 4D to 3D NIfTI splitter v%s
+Description: Split recursively all 4D NIfTI files (.nii, .nii.gz, .img/.hdr) into 3D NIfTI files (one per volume, named like spm_file_split), without ever loading more than a chunk of a volume in memory. Several files are split in parallel.
+    ''' % __version__
+    ep = '''WARNING: with --delete the 4D files are deleted (after all volumes were written and verified)! Make a backup before!'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root folder to walk recursively, or path to a single 4D file.')
+    main_parser.add_argument('-o', '--output', metavar='/some/path', type=str, required=False, default=None,
+                        help='Folder where to write the 3D files (default: alongside each 4D file).')
+    main_parser.add_argument('--delete', action='store_true', required=False, default=False,
+                        help='Write all the volumes, verify them, then delete the 4D file (atomic: on any error the 4D file is kept and the partial outputs removed).')
+    main_parser.add_argument('-f', '--force', action='store_true', required=False, default=False,
+                        help='Overwrite existing 3D files.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show each converted file).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    outdir = fullpath(args.output) if args.output else None
+
+    if os.path.isfile(inputpath):
+        images = [inputpath]
+    elif os.path.isdir(inputpath):
+        images = find_images(inputpath)
+    else:
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if outdir is not None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    #### Main program
+    print('== Found %i nifti files in %s, splitting the 4D ones...' % (len(images), inputpath))
+    nconverted = nerrors = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for res in executor.map(process_file, [(f, args.delete, outdir, args.force) for f in images]):
+            if 'error' in res:
+                nerrors += 1
+                print('ERROR: %s' % res['error'], file=sys.stderr)
+            elif res['outputs'] is not None:
+                nconverted += 1
+                if args.verbose:
+                    print('-> %s: %i volumes%s' % (res['file'], len(res['outputs']), ' (4D file deleted)' if args.delete else ''))
+    print('== Done: %i 4D files split, %i errors.' % (nconverted, nerrors))
+    return 1 if nerrors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# reslice_img.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Chunked multithreaded image reslicer
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: resample images to a given voxel size and bounding box, same as resize_img.m (used for resizeto3 in script_preproc_fmri_csg.m) but without SPM, with vectorized interpolation and in parallel threads.
+#
+# resize_img.m reslices the images one by one and plane by plane through spm_slice_vol. Here the target grid is computed from the affine exactly as resize_img.m does (voxel [1 1 1] of the output is the minimum corner of the bounding box, and the number of voxels is rounded up if the maximum corner is more than a tenth of a voxel over), then each output slab of planes is interpolated at once with scipy.ndimage.map_coordinates, reading only the input planes this slab needs, so that the memory usage stays bounded whatever the size of the images. All the volumes (of all the 3D and 4D input files) are resliced in parallel threads.
+#
+# As with resize_img.m, the output images are prefixed with 'r' and keep the datatype and scaling of the input images (values are rounded and clipped for integer datatypes), voxels outside of the input image are set to 0, and --mask re-rounds the interpolated values (to avoid growing/shrinking binary masks because of the linear interpolation). Compressed .nii.gz inputs are written as uncompressed .nii files.
+#
+# To check the equivalence with resize_img.m on your data, reslice one image with both and compare with --compare, eg:
+#   python reslice_img.py -i sample.nii --voxdim 3 3 3 --prefix py_ --compare rsample.nii
+# which prints the differences of dimensions, orientation and values, and fails if they exceed 1 quantization step (or 1e-4 of the value range for float images).
+#
+# Usage:
+#   python reslice_img.py -i /path/to/session --voxdim 3 3 3              # same as resize_img(files, [3 3 3], nan(2,3)) on all images of the folder
+#   python reslice_img.py -i mask.nii --voxdim 2 2 2 --bb -78 -112 -70 78 76 85 --mask
+#   python reslice_img.py --filelist files.txt --voxdim 3 3 3 -j 8      # one image path per line, as generated by script_preproc_fmri_csg.m
+#
+# Required libraries: nibabel, scipy.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import map_coordinates
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Extensions of the images to reslice (.hdr files are opened through their .img)
+IMAGE_EXTS = ('.nii', '.nii.gz', '.img')
+# Tolerance (in voxels) to still sample points that fall just outside of the input image (due to rounding errors on the grid edges), same as TINY in SPM's spm_slice_vol
+TINY = 5e-2
+# Interpolation orders
+INTERP_ORDERS = {'nearest': 0, 'trilinear': 1}
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def split_ext(filepath):
+    '''Split the filename and the image extension (handles .nii.gz)'''
+    if filepath.lower().endswith('.nii.gz'):
+        return filepath[:-7], filepath[-7:]
+    return os.path.splitext(filepath)
+
+def list_images(inputpaths, regex=None):
+    '''Expand the input paths (files or folders, not recursive) into a list of images, optionally filtering the filenames with a regex'''
+    images = []
+    for p in inputpaths:
+        p = fullpath(re.sub(r',\d+$', '', p.strip())) # remove the SPM frame number if any (eg, file.nii,1)
+        if os.path.isdir(p):
+            images.extend(os.path.join(p, f) for f in sorted(os.listdir(p)) if f.lower().endswith(IMAGE_EXTS) and (regex is None or re.search(regex, f)))
+        elif os.path.isfile(p):
+            images.append(p)
+        else:
+            raise NameError('Specified input path does not exist: %s' % p)
+    # Remove duplicates (such as the frames of an expanded 4D file) but keep the order
+    seen = set()
+    return [f for f in images if not (f in seen or seen.add(f))]
+
+def world_bb(affine, shape):
+    '''Bounding box (min and max corners in world mm coordinates) of an image, as world_bb in resize_img.m'''
+    d = np.asarray(shape[:3], dtype=np.float64) - 1
+    corners = np.array([[i, j, k, 1.0] for i in (0, d[0]) for j in (0, d[1]) for k in (0, d[2])]).T
+    tc = affine[:3, :].dot(corners)
+    return np.vstack([tc.min(axis=1), tc.max(axis=1)])
+
+def target_grid(affine, shape, voxdim, bb):
+    '''Compute the affine and dimensions of the output grid, as resize_img.m does. NaNs in voxdim (3) or bb (2x3) are replaced by the values of the input image.'''
+    voxdim = np.array(voxdim, dtype=np.float64).reshape(3)
+    bb = np.array(bb, dtype=np.float64).reshape(2, 3)
+    if np.isnan(voxdim).any():
+        # Voxel sizes from the affine (spm_imatrix), always positive: resize_img.m would fail on a negative (flipped) voxel size
+        vvoxdim = np.sqrt((affine[:3, :3] ** 2).sum(axis=0))
+        voxdim[np.isnan(voxdim)] = vvoxdim[np.isnan(voxdim)]
+    mn, mx = bb[0].copy(), bb[1].copy()
+    if np.isnan(bb).any():
+        vbb = world_bb(affine, shape)
+        mn[np.isnan(mn)] = vbb[0][np.isnan(mn)]
+        mx[np.isnan(mx)] = vbb[1][np.isnan(mx)]
+    # voxel 0 of the output maps to the bb min corner (voxel [1 1 1] in SPM's 1-based convention)
+    out_affine = np.eye(4)
+    out_affine[:3, :3] = np.diag(voxdim)
+    out_affine[:3, 3] = mn
+    # voxel coords of the bb max corner gives the number of voxels required (round up if more than a tenth of a voxel over)
+    imgdim = np.ceil((mx - mn) / voxdim + 1 - 0.1).astype(int)
+    if (imgdim < 1).any():
+        raise ValueError('Empty output grid %s, check the bounding box %s and voxel sizes %s' % (imgdim.tolist(), [mn.tolist(), mx.tolist()], voxdim.tolist()))
+    return out_affine, tuple(int(d) for d in imgdim)
+
+def to_disk(values, dtype, slope, inter):
+    '''Convert values to their representation on disk with the given datatype and scaling (rounded and clipped for integer datatypes, NaNs set to 0), as spm_write_plane does'''
+    raw = (values - inter) / slope if (slope != 1.0 or inter != 0.0) else values
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        raw = np.nan_to_num(np.rint(raw), nan=0.0)
+        raw = np.clip(raw, info.min, info.max)
+    return raw.astype(dtype)
+
+def resample_slab(dataobj, inv_map, out_shape, k0, k1, order, ismask, frame=None):
+    '''Interpolate the output planes k0:k1 of one volume. Only the input planes needed by this slab are read.'''
+    in_shape = dataobj.shape[:3]
+    ii, jj, kk = np.meshgrid(np.arange(out_shape[0]), np.arange(out_shape[1]), np.arange(k0, k1), indexing='ij')
+    coords = np.tensordot(inv_map[:3, :3], np.stack([ii, jj, kk]).astype(np.float64), axes=1)
+    coords += inv_map[:3, 3].reshape(3, 1, 1, 1)
+    out = np.zeros(coords.shape[1:], dtype=np.float64)
+    # Points that fall just outside because of rounding errors are snapped on the edges, points really outside stay at 0
+    inside = np.ones(out.shape, dtype=bool)
+    for ax in range(3):
+        inside &= (coords[ax] >= -TINY) & (coords[ax] <= in_shape[ax] - 1 + TINY)
+        np.clip(coords[ax], 0, in_shape[ax] - 1, out=coords[ax])
+    if not inside.any():
+        return out
+    # Read only the range of input planes needed (plus one for the interpolation)
+    zlo = int(np.floor(coords[2][inside].min()))
+    zhi = min(in_shape[2], int(np.floor(coords[2][inside].max())) + 2)
+    slicer = (slice(None), slice(None), slice(zlo, zhi)) + ((frame,) if frame is not None else ())
+    data = np.asarray(dataobj[slicer], dtype=np.float64).reshape(in_shape[:2] + (zhi - zlo,))
+    coords[2] -= zlo
+    out[inside] = map_coordinates(data, coords[:, inside], order=order, mode='nearest', prefilter=False)
+    if ismask:
+        out = np.round(out)
+    return out
+
+def prepare_output(inpath, outpath, img, out_affine, out_shape):
+    '''Write the header of the output image (copy of the input header with the new grid, same datatype and scaling) and preallocate its data. Returns (header, path of the data file, offset of the data).'''
+    src_hdr = img.header
+    is_pair = split_ext(outpath)[1].lower() == '.img'
+    if isinstance(src_hdr, nib.Nifti1Header):
+        klass = src_hdr.__class__ if not is_pair else (nib.nifti2.Nifti2PairHeader if isinstance(src_hdr, nib.Nifti2Header) else nib.nifti1.Nifti1PairHeader)
+    else:
+        klass = nib.nifti1.Nifti1PairHeader if is_pair else nib.Nifti1Header
+    hdr = klass.from_header(src_hdr)
+    if hdr.endianness != src_hdr.endianness:
+        hdr = hdr.as_byteswapped(src_hdr.endianness)
+    hdr.set_data_shape(tuple(out_shape) + tuple(src_hdr.get_data_shape()[3:]))
+    qcode = int(src_hdr['qform_code']) if 'qform_code' in src_hdr and src_hdr['qform_code'] > 0 else 2
+    scode = int(src_hdr['sform_code']) if 'sform_code' in src_hdr and src_hdr['sform_code'] > 0 else 2
+    hdr.set_qform(out_affine, qcode)
+    hdr.set_sform(out_affine, scode)
+    slope, inter = float(getattr(img.dataobj, 'slope', 1.0)), float(getattr(img.dataobj, 'inter', 0.0))
+    hdr.set_slope_inter(slope, inter)
+    hdr['vox_offset'] = 0 # let the header compute the minimal offset (after extensions) for single files, and 0 for pairs
+    nbytes = int(np.prod(hdr.get_data_shape())) * hdr.get_data_dtype().itemsize
+    if is_pair:
+        with open(split_ext(outpath)[0] + '.hdr', 'wb') as f:
+            hdr.write_to(f)
+        offset = 0
+        with open(outpath, 'wb') as f:
+            f.truncate(nbytes)
+    else:
+        with open(outpath, 'wb') as f:
+            hdr.write_to(f)
+            offset = int(hdr['vox_offset'])
+            f.write(b'\x00' * (offset - f.tell()))
+            f.truncate(offset + nbytes)
+    return hdr, offset
+
+def reslice_volume(args):
+    '''Reslice one volume (frame of a 3D or 4D image) into the preallocated output, slab by slab'''
+    img, outpath, offset, out_affine, out_shape, dtype, slope_inter, frame, order, ismask, slab_size = args
+    inv_map = np.linalg.solve(img.affine, out_affine) # output voxel -> input voxel
+    plane_bytes = out_shape[0] * out_shape[1] * dtype.itemsize
+    frame_offset = offset + (frame or 0) * plane_bytes * out_shape[2]
+    # Each thread writes its own volume at its own offset, so no lock is needed
+    with open(outpath, 'r+b') as f:
+        for k0 in range(0, out_shape[2], slab_size):
+            k1 = min(out_shape[2], k0 + slab_size)
+            values = resample_slab(img.dataobj, inv_map, out_shape, k0, k1, order, ismask, frame)
+            f.seek(frame_offset + k0 * plane_bytes)
+            f.write(to_disk(values, dtype, *slope_inter).tobytes(order='F'))
+    return outpath, frame
+
+def output_path(inpath, prefix):
+    '''Path of the resliced image: prefixed, in the same folder, and uncompressed'''
+    stem, ext = split_ext(inpath)
+    if ext.lower() == '.nii.gz':
+        ext = '.nii'
+    return os.path.join(os.path.dirname(stem), prefix + os.path.basename(stem) + ext)
+
+def reslice_images(images, voxdim, bb, ismask=False, interp='trilinear', prefix='r', slab_size=16, jobs=None, verbose=False):
+    '''Reslice all the images to the given voxel size and bounding box (NaNs = as input), all volumes in parallel threads. Returns the list of output paths.'''
+    tasks = []
+    outpaths = []
+    for inpath in images:
+        img = nib.load(inpath)
+        if len(img.shape) > 4:
+            raise ValueError('%s: images with more than 4 dimensions are not supported' % inpath)
+        out_affine, out_shape = target_grid(img.affine, img.shape, voxdim, bb)
+        outpath = output_path(inpath, prefix)
+        hdr, offset = prepare_output(inpath, outpath, img, out_affine, out_shape)
+        slope_inter = hdr.get_slope_inter()
+        slope_inter = (1.0 if slope_inter[0] is None else slope_inter[0], 0.0 if slope_inter[1] is None else slope_inter[1])
+        frames = range(img.shape[3]) if len(img.shape) == 4 else [None]
+        for frame in frames:
+            tasks.append((img, outpath, offset, out_affine, out_shape, hdr.get_data_dtype(), slope_inter, frame, INTERP_ORDERS[interp], ismask, slab_size))
+        outpaths.append(outpath)
+        if verbose:
+            print('-> %s: %s -> %s, voxel size %s' % (inpath, img.shape[:3], out_shape, np.diag(out_affine)[:3].tolist()))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(reslice_volume, tasks))
+    return outpaths
+
+def compare_images(outpath, refpath):
+    '''Compare a resliced image with a reference (eg, the output of resize_img.m on the same image). Returns (ok, report lines).'''
+    out, ref = nib.load(outpath), nib.load(refpath)
+    lines = []
+    if out.shape != ref.shape:
+        return False, ['dimensions differ: %s vs reference %s' % (out.shape, ref.shape)]
+    maxaff = np.abs(out.affine - ref.affine).max()
+    lines.append('max affine difference: %g' % maxaff)
+    # Tolerance: 1 quantization step for integer images, else 1e-4 of the value range
+    if ref.get_data_dtype().kind in 'iu':
+        tol = float(getattr(ref.dataobj, 'slope', 1.0)) * 1.0001
+    else:
+        tol = None
+    maxdiff = meandiff = 0.0
+    nover = ntotal = 0
+    vmin, vmax = np.inf, -np.inf
+    frames = range(ref.shape[3]) if len(ref.shape) == 4 else [None]
+    for frame in frames:
+        sl = (Ellipsis,) if frame is None else (Ellipsis, frame)
+        a = np.asarray(out.dataobj[sl], dtype=np.float64)
+        b = np.asarray(ref.dataobj[sl], dtype=np.float64)
+        vmin, vmax = min(vmin, np.nanmin(b)), max(vmax, np.nanmax(b))
+        diff = np.abs(np.nan_to_num(a) - np.nan_to_num(b))
+        maxdiff = max(maxdiff, diff.max())
+        meandiff += diff.sum()
+        ntotal += diff.size
+        if tol is not None:
+            nover += int((diff > tol).sum())
+    if tol is None:
+        tol = 1e-4 * max(vmax - vmin, np.finfo(np.float64).eps)
+    lines.append('max value difference: %g (tolerance %g), mean: %g, value range of reference: [%g, %g]' % (maxdiff, tol, meandiff / ntotal, vmin, vmax))
+    if nover:
+        lines.append('%i/%i voxels differ by more than the tolerance' % (nover, ntotal))
+    return maxaff < 1e-3 and maxdiff <= tol, lines
+
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Chunked multithreaded image reslicer v%s
+Description: Resample images to the specified voxel size and bounding box, same as resize_img.m but without SPM: slab by slab vectorized interpolation (bounded memory), all volumes in parallel threads. Output images are prefixed with 'r' (by default) and keep the datatype and scaling of the input images.
+    ''' % __version__
+    ep = '''Note: NaN in --voxdim or --bb means "as input", as in resize_img.m. Compressed .nii.gz inputs are written as uncompressed .nii.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, nargs='+', required=False, default=[],
+                        help='Images to reslice, or folders (not recursive) containing the images to reslice.')
+    main_parser.add_argument('--filelist', metavar='files.txt', type=str, required=False, default=None,
+                        help='Text file with the paths of the images to reslice, one per line (SPM frame numbers like file.nii,1 are ignored).')
+    main_parser.add_argument('-r', '--regex', metavar='regex', type=str, required=False, default=None,
+                        help='Regular expression to filter the filenames in the input folders.')
+    main_parser.add_argument('--voxdim', metavar='mm', type=float, nargs=3, required=False, default=[3.0, 3.0, 3.0],
+                        help='Voxel size of the output images (default: 3 3 3, nan for "as input").')
+    main_parser.add_argument('--bb', metavar='mm', type=float, nargs=6, required=False, default=[np.nan] * 6,
+                        help='Bounding box as xmin ymin zmin xmax ymax zmax in world mm coordinates (default: nan, that is the whole input image).')
+    main_parser.add_argument('--mask', action='store_true', required=False, default=False,
+                        help='Re-round the interpolated values of binary masks (same as ismask in resize_img.m).')
+    main_parser.add_argument('--interp', type=str, choices=sorted(INTERP_ORDERS), required=False, default='trilinear',
+                        help='Interpolation method (default: trilinear, as resize_img.m).')
+    main_parser.add_argument('--prefix', metavar='r', type=str, required=False, default='r',
+                        help='Prefix of the output images (default: r).')
+    main_parser.add_argument('--slab', metavar='N', type=int, required=False, default=16,
+                        help='Number of output planes interpolated at once (default: 16, lower to reduce the memory usage).')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel threads (default: number of CPUs + 4).')
+    main_parser.add_argument('--compare', metavar='rimage.nii', type=str, required=False, default=None,
+                        help='Compare the output with a reference image (eg, resliced by resize_img.m), only with one input image. Fails if they differ by more than the tolerance.')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show each resliced image).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+
+    inputs = list(args.input)
+    if args.filelist:
+        with open(args.filelist, 'r') as f:
+            inputs.extend(line for line in f if line.strip())
+    if not inputs:
+        main_parser.error('no input image, use -i or --filelist')
+    images = list_images(inputs, args.regex)
+    if args.compare and len(images) != 1:
+        main_parser.error('--compare needs exactly one input image (got %i)' % len(images))
+
+    #### Main program
+    print('== Reslicing %i images to voxel size %s...' % (len(images), args.voxdim))
+    outpaths = reslice_images(images, args.voxdim, np.array(args.bb).reshape(2, 3), ismask=args.mask, interp=args.interp, prefix=args.prefix, slab_size=max(1, args.slab), jobs=args.jobs, verbose=args.verbose)
+    print('== Done: %i images resliced.' % len(outpaths))
+    if args.compare:
+        ok, lines = compare_images(outpaths[0], fullpath(args.compare))
+        print('== Comparison of %s with %s:' % (outpaths[0], args.compare))
+        for line in lines:
+            print('   %s' % line)
+        print('== %s' % ('EQUIVALENT' if ok else 'DIFFERENT'))
+        return 0 if ok else 1
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# run_jobs_pool.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Work-stealing runner for the SPM batch jobs of script_preproc_fmri_csg.m
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: runs the batch jobs that script_preproc_fmri_csg.m saves in the JOBS subfolder (jobs_<stage>_mode<X>_<subject>[_session<i>_modality<j>]_<timestamp>.mat) across N headless MATLAB workers, plus ART (art_batch) on each functional folder, as an alternative to run_jobs() and its single parfor.
+#
+# Each worker is a separate MATLAB process started in its own working directory (workers/worker<N>/), so that art_batch(), which writes a temporary config file in the current folder, can run in parallel without the workers overwriting each other's config (the reason why ART is serial in script_preproc_fmri_csg.m).
+#
+# The jobs are ordered by estimated cost, the heaviest first (the preproc jobs, which include the structural segmentation, before the smoothing, SPM.mat generation and ART jobs), and spread over one queue per worker. When a worker's queue is empty, it steals the cheapest remaining job from the most loaded queue, so that the workers stay busy until the end. The cost of a job is estimated from the duration of the same job in a previous report (--history) if available, else from its stage and the size of its batch file. The stages of a subject run in order (preproc, rshrf, smoothing, spmgenart, art): a job only starts when all the jobs of the previous stages of the same subject are done, and is skipped if one of them failed.
+#
+# Each job can be retried (--retries) and killed after a timeout (--timeout). Every attempt is recorded in a report (CSV, or Parquet with pandas and pyarrow) with the worker, status, return code, start time and duration, and the output of each attempt is saved in workers/logs/. This report can be reused as --history for the next run.
+#
+# A stub worker (--stub) replaces MATLAB by a small Python process that writes a config file in its working directory like art_batch(), sleeps and checks that the config file was not overwritten, to test the scheduling without MATLAB.
+#
+# Usage:
+#   python run_jobs_pool.py -i /root_pth/JOBS -j 4 --addpath /path/to/spm12 --addpath /path/to/art --art /root_pth
+#   python run_jobs_pool.py -i /root_pth/JOBS -j 4 --stub --stub-time 0.5 --stub-fail 0.2 --retries 2
+#   python run_jobs_pool.py -i /root_pth/JOBS --stages smoothing spmgenart --history /root_pth/JOBS/workers/jobs_report.csv
+#
+# Required libraries: none (Python standard library only). Optional: pandas + pyarrow for Parquet reports.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import collections
+import csv
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Filenames of the batch jobs saved by save_batch() in script_preproc_fmri_csg.m
+JOB_REGEX = re.compile(r'^jobs_(?P<stage>[A-Za-z0-9]+)_mode(?P<mode>[\d.]+)_(?P<subject>.+?)(?:_session(?P<session>\d+)_modality(?P<modality>\d+))?_(?P<timestamp>\d{8}T\d{6})\.mat$')
+# Order of the stages of a subject, and their default relative cost (the preproc jobs include the structural segmentation)
+STAGE_ORDER = ['preproc', 'rshrf', 'smoothing', 'spmgenart', 'art']
+STAGE_COSTS = {'preproc': 60.0, 'rshrf': 10.0, 'smoothing': 3.0, 'spmgenart': 1.0, 'art': 2.0}
+DEFAULT_COST = 5.0
+# Folders skipped when walking the data tree for ART
+SKIP_DIRS = ['mprage', 'JOBS', '__MACOSX']
+# Columns of the report, in order
+COLUMNS = ['job', 'stage', 'subject', 'session', 'modality', 'cost', 'worker', 'attempt', 'status', 'returncode', 'start', 'duration', 'log']
+
+# MATLAB code run by a worker for a batch job and for ART (the paths are inserted as quoted MATLAB strings, see matlab_quote()). On error, the report is printed and MATLAB exits with code 1.
+MATLAB_JOB = "try, cd({workdir}); {addpath}spm('defaults', 'FMRI'); spm_jobman('initcfg'); load({target}); spm_jobman('run', matlabbatch); fclose all; close all; catch err, disp(getReport(err)); exit(1); end; exit(0);"
+MATLAB_ART = "try, cd({workdir}); {addpath}art_batch({target}); fclose all; close all; catch err, disp(getReport(err)); exit(1); end; exit(0);"
+# Stub worker: writes a config file in the working directory like art_batch(), sleeps, then fails if another worker overwrote the config file, or randomly with the given failure rate
+STUB_CODE = '''import os, random, sys, time
+target, sleep, failrate = sys.argv[1], float(sys.argv[2]), float(sys.argv[3])
+with open('stub_config.txt', 'w') as f:
+    f.write(target)
+time.sleep(sleep)
+with open('stub_config.txt', 'r') as f:
+    intact = (f.read() == target)
+print('stub worker ran %s in %s (config file intact: %s)' % (target, os.getcwd(), intact))
+sys.exit(0 if intact and random.random() >= failrate else 1)
+'''
+
+
+class Job(object):
+    '''A batch job file or an ART run, with its stage, subject and estimated cost'''
+    def __init__(self, name, target, stage, subject, session='', modality='', cost=DEFAULT_COST):
+        self.name = name
+        self.target = target
+        self.stage = stage
+        self.subject = subject
+        self.session = session
+        self.modality = modality
+        self.cost = cost
+
+    @property
+    def rank(self):
+        '''Order of the stage of this job for its subject (unknown stages go last)'''
+        return STAGE_ORDER.index(self.stage) if self.stage in STAGE_ORDER else len(STAGE_ORDER)
+
+    @property
+    def key(self):
+        return (self.stage, self.subject, self.session, self.modality)
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def matlab_quote(s):
+    '''Quote a string as a MATLAB char literal'''
+    return "'" + s.replace("'", "''") + "'"
+
+def find_jobs(jobsdir, stages=None, shared_mri=False):
+    '''Find the batch jobs in the JOBS folder. Only the latest file of each job is kept (the JOBS folder accumulates the batches of all runs).
+    With shared_mri, only the latest preproc job of each subject is kept, since the batch of a subject is saved again for each session/modality it is extended with.'''
+    latest = {}
+    for f in sorted(os.listdir(jobsdir)):
+        m = JOB_REGEX.match(f)
+        if not m or (stages and m.group('stage') not in stages):
+            continue
+        session, modality = m.group('session') or '', m.group('modality') or ''
+        key = (m.group('stage'), m.group('mode'), m.group('subject'))
+        if not (shared_mri and m.group('stage') == 'preproc'):
+            key += (session, modality)
+        if key not in latest or m.group('timestamp') >= latest[key][0]:
+            latest[key] = (m.group('timestamp'), Job(os.path.splitext(f)[0], os.path.join(jobsdir, f), m.group('stage'), m.group('subject'), session, modality))
+    return [job for _, job in latest.values()]
+
+def find_art_jobs(rootdir, func_regex):
+    '''One ART job per functional folder (/root_pth/<condition>/<subject>/data/<session>/<modality>/), on the SPM.mat generated by the spmgenart jobs'''
+    jobs = []
+    regex = re.compile(func_regex)
+    for dirpath, dirnames, _ in os.walk(rootdir):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        parts = os.path.relpath(dirpath, rootdir).split(os.sep)
+        if len(parts) == 5 and parts[2] == 'data' and regex.search(parts[4]):
+            dirnames[:] = []
+            jobs.append(Job('art_%s' % '_'.join(parts), os.path.join(dirpath, 'SPM.mat'), 'art', parts[1], parts[3], parts[4]))
+    return jobs
+
+def load_history(filepath):
+    '''Durations of the successful jobs of a previous report, by (stage, subject, session, modality)'''
+    if filepath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to read Parquet files, please pip install pandas pyarrow or use a .csv report.')
+        rows = pd.read_parquet(filepath).astype(str).to_dict('records')
+    else:
+        with open(filepath, 'r', newline='') as f:
+            rows = list(csv.DictReader(f))
+    return {(r['stage'], r['subject'], r['session'], r['modality']): float(r['duration']) for r in rows if r['status'] == 'ok'}
+
+def estimate_costs(jobs, history=None):
+    '''Set the estimated cost of each job: its previous duration if known, else the cost of its stage scaled by the size of its batch file relative to the other jobs of the same stage'''
+    sizes = collections.defaultdict(list)
+    for job in jobs:
+        job.size = os.path.getsize(job.target) if job.target.endswith('.mat') and os.path.exists(job.target) and job.stage != 'art' else 0
+        sizes[job.stage].append(job.size)
+    means = {stage: float(sum(s)) / len(s) for stage, s in sizes.items()}
+    for job in jobs:
+        if history and job.key in history:
+            job.cost = history[job.key]
+        else:
+            job.cost = STAGE_COSTS.get(job.stage, DEFAULT_COST) * (job.size / means[job.stage] if means[job.stage] > 0 else 1.0)
+    return jobs
+
+def worker_command(job, workdir, args):
+    '''Command line of a worker for a job'''
+    if args.stub:
+        return [sys.executable, '-c', STUB_CODE, job.target, str(args.stub_time), str(args.stub_fail)]
+    addpath = ''.join('addpath(%s); ' % matlab_quote(p) for p in args.addpath)
+    code = (MATLAB_ART if job.stage == 'art' else MATLAB_JOB).format(workdir=matlab_quote(workdir), addpath=addpath, target=matlab_quote(job.target))
+    return [args.matlab] + shlex.split(args.matlab_args) + [code]
+
+def run_command(cmd, workdir, logpath, timeout=None):
+    '''Run a worker command in its working directory, with its output saved in a log file. Returns (status, returncode).'''
+    with open(logpath, 'w') as log:
+        popen_args = dict(cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        if os.name == 'posix':
+            popen_args['start_new_session'] = True # to kill MATLAB and all its children on timeout
+        proc = subprocess.Popen(cmd, **popen_args)
+        try:
+            returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if os.name == 'posix':
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+            proc.wait()
+            return 'timeout', None
+    return ('ok' if returncode == 0 else 'failed'), returncode
+
+
+class WorkStealingPool(object):
+    '''Runs jobs on N workers, each with its own queue and working directory, stealing jobs from the other queues when its own is empty'''
+    def __init__(self, jobs, njobs, workdir, args):
+        self.args = args
+        self.workdir = workdir
+        self.njobs = njobs
+        self.cond = threading.Condition()
+        self.rows = []
+        self.failed = set() # (subject, stage rank) of the jobs that failed after all retries
+        self.running = collections.Counter() # (subject, stage rank) of the running jobs
+        # Longest processing time first: each job goes to the least loaded queue, so each queue is sorted from the most to the least costly job
+        self.queues = [collections.deque() for _ in range(njobs)]
+        self.loads = [0.0] * njobs
+        for job in sorted(jobs, key=lambda j: (-j.cost, j.rank)):
+            i = self.loads.index(min(self.loads))
+            self.queues[i].append(job)
+            self.loads[i] += job.cost
+
+    def _pending_ranks(self, subject):
+        '''Stage ranks of the jobs of a subject that are queued or running'''
+        ranks = set(rank for (subj, rank) in self.running if subj == subject and self.running[(subj, rank)] > 0)
+        ranks.update(job.rank for q in self.queues for job in q if job.subject == subject)
+        return ranks
+
+    def _ready(self, job):
+        return all(rank >= job.rank for rank in self._pending_ranks(job.subject))
+
+    def _blocked(self, job):
+        return any(subj == job.subject and rank < job.rank for subj, rank in self.failed)
+
+    def _skip_blocked(self):
+        '''Skip the queued jobs whose previous stages failed'''
+        for q in self.queues:
+            for job in [j for j in q if self._blocked(j)]:
+                q.remove(job)
+                self.loads[self.queues.index(q)] -= job.cost
+                self.failed.add((job.subject, job.rank))
+                self.rows.append(self._row(job, '', 0, 'skipped', None, None, 0.0, ''))
+                print('-> Skipped %s (a previous stage of subject %s failed)' % (job.name, job.subject))
+
+    def _take(self, i):
+        '''Take the first ready job of queue i, else steal the cheapest ready job from the most loaded queue. Returns None if all queues are empty, False if no job is ready yet.'''
+        self._skip_blocked()
+        if not any(self.queues):
+            return None
+        for job in self.queues[i]:
+            if self._ready(job):
+                self.queues[i].remove(job)
+                self.loads[i] -= job.cost
+                return job
+        for v in sorted(range(self.njobs), key=lambda v: -self.loads[v]):
+            if v == i:
+                continue
+            for job in reversed(self.queues[v]):
+                if self._ready(job):
+                    self.queues[v].remove(job)
+                    self.loads[v] -= job.cost
+                    print('-> Worker %i stole %s from worker %i' % (i, job.name, v))
+                    return job
+        return False
+
+    def _row(self, job, worker, attempt, status, returncode, start, duration, logpath):
+        return {'job': job.name, 'stage': job.stage, 'subject': job.subject, 'session': job.session, 'modality': job.modality,
+                'cost': round(job.cost, 3), 'worker': worker, 'attempt': attempt, 'status': status,
+                'returncode': '' if returncode is None else returncode,
+                'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start)) if start else '',
+                'duration': round(duration, 3), 'log': logpath}
+
+    def _worker(self, i):
+        workdir = os.path.join(self.workdir, 'worker%i' % i)
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        while True:
+            with self.cond:
+                job = self._take(i)
+                while job is False:
+                    self.cond.wait()
+                    job = self._take(i)
+                if job is None:
+                    self.cond.notify_all()
+                    return
+                self.running[(job.subject, job.rank)] += 1
+            status = None
+            for attempt in range(1, self.args.retries + 2):
+                logpath = os.path.join(self.workdir, 'logs', '%s_attempt%i.log' % (job.name, attempt))
+                print('-> Worker %i: %s (attempt %i, estimated cost %.1f)' % (i, job.name, attempt, job.cost))
+                start = time.time()
+                try:
+                    status, returncode = run_command(worker_command(job, workdir, self.args), workdir, logpath, self.args.timeout)
+                except Exception as exc:
+                    status, returncode = 'error: %s' % exc, None
+                duration = time.time() - start
+                with self.cond:
+                    self.rows.append(self._row(job, i, attempt, status, returncode, start, duration, logpath))
+                print('-> Worker %i: %s %s in %.1fs' % (i, job.name, status, duration))
+                if status == 'ok':
+                    break
+            with self.cond:
+                self.running[(job.subject, job.rank)] -= 1
+                if status != 'ok':
+                    self.failed.add((job.subject, job.rank))
+                self.cond.notify_all()
+
+    def run(self):
+        logsdir = os.path.join(self.workdir, 'logs')
+        if not os.path.isdir(logsdir):
+            os.makedirs(logsdir)
+        threads = [threading.Thread(target=self._worker, args=(i,)) for i in range(self.njobs)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.rows
+
+def write_report(rows, outpath):
+    '''Write the report atomically, as CSV, or as Parquet if the extension is .parquet (needs pandas and pyarrow)'''
+    tmppath = outpath + '.tmp'
+    if outpath.lower().endswith('.parquet'):
+        if pd is None:
+            raise ImportError('pandas (and pyarrow) is required to write Parquet files, please pip install pandas pyarrow or use a .csv output.')
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(tmppath, index=False)
+    else:
+        with open(tmppath, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(tmppath, outpath)
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Work-stealing runner for SPM batch jobs v%s
+Description: Run the batch jobs saved in the JOBS folder by script_preproc_fmri_csg.m, and ART, across N headless MATLAB workers with their own working directories, heaviest jobs first, with retries, timeouts and a report of all attempts.
+    ''' % __version__
+    ep = '''Use --stub to test without MATLAB. The stages of each subject run in order (%s).''' % ', '.join(STAGE_ORDER)
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/root_pth/JOBS', type=str, required=True,
+                        help='Path to the JOBS folder containing the jobs_*.mat batch files.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=4,
+                        help='Number of workers, ie, of MATLAB processes running at the same time (default: 4).')
+    main_parser.add_argument('--stages', metavar='preproc', type=str, nargs='+', required=False, default=None,
+                        help='Only run the jobs of these stages (default: all the jobs found).')
+    main_parser.add_argument('--shared-mri', action='store_true', required=False, default=False,
+                        help='Keep only the latest preproc job of each subject (use it if sharedmri_all was enabled, since the batch of a subject is then saved once per session/modality).')
+    main_parser.add_argument('--art', metavar='/root_pth', type=str, required=False, default=None,
+                        help='Also run art_batch() on the SPM.mat of each functional folder of this data tree, after the other jobs of the same subject.')
+    main_parser.add_argument('--func-regex', metavar='regex', type=str, required=False, default='(rest|func|task|tennis|navigation)',
+                        help='Regex to match the functional/modalities directories for --art (default: same as func_dir_regex in script_preproc_fmri_csg.m).')
+    main_parser.add_argument('--only', metavar='jobs_plan.txt', type=str, required=False, default=None,
+                        help='Only run the jobs listed in this file (one job name per line, eg the reduced list of lineage_plan.py).')
+    main_parser.add_argument('--history', metavar='jobs_report.csv', type=str, required=False, default=None,
+                        help='Report of a previous run, to estimate the cost of each job from its previous duration.')
+    main_parser.add_argument('--retries', metavar='N', type=int, required=False, default=1,
+                        help='Number of retries of a failed or timed out job (default: 1).')
+    main_parser.add_argument('--timeout', metavar='seconds', type=float, required=False, default=None,
+                        help='Kill a job after this number of seconds (default: no timeout).')
+    main_parser.add_argument('-w', '--workdir', metavar='/some/path', type=str, required=False, default=None,
+                        help='Folder for the working directories and logs of the workers (default: the workers subfolder of the JOBS folder).')
+    main_parser.add_argument('-o', '--output', metavar='jobs_report.csv', type=str, required=False, default=None,
+                        help='Path to the report (.csv or .parquet, default: jobs_report.csv in the workdir).')
+    main_parser.add_argument('--matlab', metavar='matlab', type=str, required=False, default='matlab',
+                        help='Path to the MATLAB executable (default: matlab).')
+    main_parser.add_argument('--matlab-args', metavar='"-nodisplay -r"', type=str, required=False, default='-nodisplay -nosplash -nodesktop -r',
+                        help='Arguments to MATLAB before the code to run (default: "-nodisplay -nosplash -nodesktop -r").')
+    main_parser.add_argument('--addpath', metavar='/path/to/spm12', type=str, action='append', required=False, default=[],
+                        help='Path to add in the MATLAB path of the workers (SPM, toolboxes, ART), can be given several times.')
+    main_parser.add_argument('--dry-run', action='store_true', required=False, default=False,
+                        help='Only print the jobs with their estimated cost and worker queue, do not run them.')
+    main_parser.add_argument('--stub', action='store_true', required=False, default=False,
+                        help='Use a stub Python worker instead of MATLAB, to test the scheduling.')
+    main_parser.add_argument('--stub-time', metavar='seconds', type=float, required=False, default=0.2,
+                        help='Duration of each stub job (default: 0.2).')
+    main_parser.add_argument('--stub-fail', metavar='0.0', type=float, required=False, default=0.0,
+                        help='Failure rate of the stub jobs, to test the retries (default: 0).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+    workdir = fullpath(args.workdir) if args.workdir else os.path.join(inputpath, 'workers')
+    outpath = fullpath(args.output) if args.output else os.path.join(workdir, 'jobs_report.csv')
+
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if args.art and not os.path.isdir(args.art):
+        raise NameError('Specified data tree for --art does not exist. Please check the specified path')
+    if args.jobs < 1:
+        main_parser.error('the number of workers must be at least 1')
+
+    #### Main program
+    jobs = find_jobs(inputpath, args.stages, args.shared_mri)
+    if args.art:
+        jobs.extend(find_art_jobs(fullpath(args.art), args.func_regex))
+    if args.only:
+        with open(fullpath(args.only), 'r') as f:
+            only = set(line.strip() for line in f if line.strip())
+        jobs = [job for job in jobs if job.name in only]
+    if not jobs:
+        print('No job found in %s' % inputpath)
+        return 1
+    history = load_history(fullpath(args.history)) if args.history else None
+    estimate_costs(jobs, history)
+    pool = WorkStealingPool(jobs, min(args.jobs, len(jobs)), workdir, args)
+    print('== Found %i jobs (%s), running on %i workers' % (len(jobs), ', '.join('%s: %i' % (s, n) for s, n in sorted(collections.Counter(j.stage for j in jobs).items())), pool.njobs))
+    if args.dry_run:
+        for i, q in enumerate(pool.queues):
+            print('-- Worker %i (estimated load %.1f):' % (i, pool.loads[i]))
+            for job in q:
+                print('   %s (%s, estimated cost %.1f)' % (job.name, job.stage, job.cost))
+        return 0
+
+    start = time.time()
+    rows = pool.run()
+    write_report(rows, outpath)
+    final = {}
+    for row in rows:
+        final[row['job']] = row['status']
+    counts = collections.Counter(final.values())
+    print('== All jobs done in %.1fs: %s. Report saved in %s' % (time.time() - start, ', '.join('%i %s' % (n, s) for s, n in sorted(counts.items())), outpath))
+    return 0 if counts.get('ok', 0) == len(final) else 1
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -83,9 +83,11 @@ refslice = 'first';  % reference slice for slice timing correction. Can either b
 %keep_normalized_timeseries = 1; % 1: keep, 0: delete % DEPRECATED: normalized timeseries are kept in any case (user can always delete afterward)
 % Smoothing kernel (isotropic)
 smoothingkernel = 8;
+smoothing_python = false; % use smooth_img.py (needs Python 3 with nibabel and scipy) instead of spm_smooth to smooth, much faster as all volumes of all sessions are smoothed in parallel processes
 % Resize/resample/reslice functionals to 3x3x3 before smoothing
 % NOTE: if you have multiband BOLD, please disable this, else your BOLD may end up being cut in half!
 resizeto3 = false;
+resizeto3_python = false; % use reslice_img.py (needs Python 3 with nibabel and scipy) instead of resize_img.m to resize, much faster as all volumes are resliced in parallel threads
 % Parallel preprocessing? Tip: disable when having errors to ease debugging.
 parallel_processing = false;
 % Always disable shared MRI optimization?
@@ -95,9 +97,12 @@ parallel_processing = false;
 sharedmri_all = true;
 % ART input files
 art_before_smoothing = true; % At CSG, we always did ART on post-smoothed data, but according to Alfonso Nieto-Castanon, ART should be done before smoothing: https://www.nitrc.org/forum/message.php?msg_id=10652
+art_python = false; % use art_outliers.py (needs Python 3 with nibabel and scipy) instead of art_batch() to detect the outliers, much faster as all sessions are processed in parallel (and the SPM.mat generation for ART is skipped)
 % Skip preprocessing steps (to do only post-processing?) - useful in case
 % of error and you want to restart just at post-processing
 skip_preprocessing = false;
+% Record the state of the data and parameters at the end of the run with lineage_plan.py (needs Python 3), so that after a change of the data or parameters, lineage_plan.py can list the subjects and stages to re-run
+lineage_record_python = false;
 % Use the rshrf toolbox to deconvolve the Hemodynamic Response Function?  Note: the rshrf toolbox needs to be in the "toolbox" folder of SPM12. Important: do not enable this if you use CONN for analysis, as it is advised to use rshrf after CONN denoising: https://www.nitrc.org/forum/forum.php?thread_id=9818&forum_id=1144
 enable_rshrf = false;
 % Use Realign & Unwarp (=non-linear deformation recovery from movement artifacts) instead of Realign (without Reslice)? Note: available only for SPM12 pipelines.
@@ -183,7 +188,7 @@ fprintf(1, '\n\nNote: data is expected to be manually reoriented and coregistere
 fprintf(1, 'Note2: data is expected to be in 3D nifti format (extension .nii or .img). Experimental support for 4D nifti is implemented but not tested.\n');
 fprintf(1, 'Note3: never launch this script from the "Play" button in MATLAB. Always launch this script from the commandline prompt (to force compilation).\n');
 fprintf(1, 'Note4: Be careful to have a clean directory tree: inside the root path, there should only be one folder per condition, not any other folder containing any other kind of data!\n');
-fprintf(1, 'Note5: Make sure your data is clean too: if you already ran the script but it failed, remove every files that were generated by the script, except the original files of course, then re-run the script (else it will fail because it will misdetect the generated files as the original ones).\n');
+fprintf(1, 'Note5: Make sure your data is clean too: if you already ran the script but it failed, remove every files that were generated by the script, except the original files of course, then re-run the script (else it will fail because it will misdetect the generated files as the original ones). Tip: lineage_plan.py can find which subjects and stages need to be re-run after a change, instead of reprocessing everything.\n');
 fprintf(1, 'Note6: Accentuated characters, paths with spaces and paths that are too long may make the SPM modules fail (file not found error). Please check all your paths, including the data and the toolboxes that you added in your MATLAB path.\n');
 fprintf(1, 'Note7: If you get the error "Improper assignment with rectangular empty matrix" during slice timing, please check your TR and slice number (check that the values detected by SPM are the same than the ones you provided, else it means you need to fix something - be careful with SPM<12, spm_slice_timing will not show the number of slices and will show only one digit after comma for TR, eg, if you set TR=2.46, it will show only TR=2.5).\n');
 fprintf(1, 'Note8: If you get the error "subsref, Reference to non-existent element of a cell array" as soon as the first subject gets processed ("Running job #1" is not even displayed yet) then please check that you have correctly installed all the required libraries (particularly VBM8 in spm/toolbox folder).\n');
@@ -228,7 +233,13 @@ for c = 1:length(conditions)
                                                             'TR', 0, ...
                                                             'nslices', 0);
                     fprintf('-> Autodetected parameters for condition %s subject %s session %s modality %s:\n', conditions{c}, data(isub).name, fsess.id, fsess.modalities{imodal});
-                    [autores_so, autores_tr, autores_nslices] = autodetect_sliceorder(fdata(1, :), true); % use verbose mode to show the autodetected parameters
+                    slice_order_sidecar = fullfile(fsess.dir, fsess.modalities{imodal}, 'slice_order.json');
+                    if exist(slice_order_sidecar, 'file')
+                        % Parameters already autodetected for the whole dataset by slice_order_batch.py, no need to open the files
+                        [autores_so, autores_tr, autores_nslices] = load_slice_order_sidecar(slice_order_sidecar);
+                    else
+                        [autores_so, autores_tr, autores_nslices] = autodetect_sliceorder(fdata(1, :), true); % use verbose mode to show the autodetected parameters
+                    end
                     slice_order_auto{c}{isub}{isess}{imodal}.slice_order = autores_so;
                     slice_order_auto{c}{isub}{isess}{imodal}.TR = autores_tr;
                     slice_order_auto{c}{isub}{isess}{imodal}.nslices = autores_nslices;
@@ -548,7 +559,7 @@ for c = 1:length(conditions) % loop over all conditions/groups
                     fdata_nbframes = spm_select_get_nbframes(fdata(1,:));
                     if fdata_nbframes > 1
                         %fdata = expand_4d_vols(fdata);  % WRONG: if you do that with a Named File Selector, it will give random results, with not the correct amount of frames (you can check after realign the motion text file rp* and compare against the number of EPI frames). The correct way is to use "Expand images frames" after named file selector, see above the commented block to see how to implement that, but the issue is then that out of memory errors are much more likely, so we prefer to just stick to 3D nifti.
-                        error('4D nifti file detected, they are unsupported, as they can cause out of memory errors (cant map view error). Please convert to 3D nifti files using SPM or the provided helper script nifti_4dto3d_convert_recursive.m .');
+                        error('4D nifti file detected, they are unsupported, as they can cause out of memory errors (cant map view error). Please convert to 3D nifti files using SPM or the provided helper scripts nifti_4dto3d_convert_recursive.m or nifti_4dto3d_stream.py .');
                     end
                     if script_mode == 0
                         matlabbatchall{matlabbatchall_counter}{2}.cfg_basicio.cfg_named_file.files{ffileset} = cellstr(fdata);
@@ -636,6 +647,7 @@ end
 if resizeto3
     fprintf(1, '\n\n-------------------------\n=== RESIZING FUNCTIONAL IMAGES TO 3x3x3 ===\n\n');
     spm_jobman('initcfg'); % init the jobman
+    reslice_img_py = fullfile(fileparts(mfilename('fullpath')), 'reslice_img.py'); % path to the python reslicer, resolved here as mfilename is unreliable inside parfor
     for c = 1:length(conditions)
         % Get the data structure for all subjects for this condition
         data = get_data(fullfile(root_pth, conditions{c}), subjects{c}, func_dir_regex);
@@ -649,13 +661,27 @@ if resizeto3
                     % Resize the warped images to get a voxel size of 3x3x3
                     % =====================================================================
                     prepfdata = get_prepfdata(data, isub, isess, imodal, script_mode, addprefix);
-                    % Detect if 4D, we need to expand
-                    prepfdata_nbframes = spm_select_get_nbframes(prepfdata(1,:));
-                    if prepfdata_nbframes > 1
-                        prepfdata = expand_4d_vols(prepfdata);
+                    if resizeto3_python
+                        % Reslice all volumes of the session at once in parallel threads (4D files are supported as-is), the list of files is passed via a temporary file to avoid commandline length limits
+                        listfile = [tempname '.txt'];
+                        fid = fopen(listfile, 'w');
+                        prepfiles = cellstr(prepfdata);
+                        fprintf(fid, '%s\n', prepfiles{:});
+                        fclose(fid);
+                        status = system(sprintf('python "%s" --voxdim 3 3 3 --filelist "%s"', reslice_img_py, listfile));
+                        delete(listfile);
+                        if status ~= 0
+                            error('reslice_img.py failed for condition %s subject %s session %s modality %s, check the error above.', conditions{c}, data(isub).name, fsess.id, fsess.modalities{imodal});
+                        end
+                    else
+                        % Detect if 4D, we need to expand
+                        prepfdata_nbframes = spm_select_get_nbframes(prepfdata(1,:));
+                        if prepfdata_nbframes > 1
+                            prepfdata = expand_4d_vols(prepfdata);
+                        end
+                        fclose('all');
+                        resize_img(prepfdata,[3 3 3],nan(2,3));
                     end
-                    fclose('all');
-                    resize_img(prepfdata,[3 3 3],nan(2,3));
                     % =====================================================================
                 end %end for modalities
             end %end for sessions
@@ -858,12 +884,44 @@ end % end for conditions
 
 %%%%%%%%%%%%%% RUN POSTPROCESSING JOBS
 fprintf(1, '\n----------------\n=== RUN SMOOTHING JOBS ===\n\n');
-run_jobs(smoothingbatchall, parallel_processing, matlabbatchall_infos, path);
-fprintf(1, '\n----------------\n=== RUN SPM.MAT GENERATION (FOR ART) ===\n\n');
-run_jobs(artbatchall, parallel_processing, matlabbatchall_infos, path);
+if smoothing_python
+    % Smooth all volumes of all sessions at once in parallel processes (same files and kernel as the smoothing batches), the list of files is passed via a temporary file to avoid commandline length limits
+    listfile = [tempname '.txt'];
+    fid = fopen(listfile, 'w');
+    for i = 1:numel(smoothingbatchall)
+        if ~isempty(smoothingbatchall{i})
+            fprintf(fid, '%s\n', smoothingbatchall{i}{1}.spm.spatial.smooth.data{:});
+        end
+    end
+    fclose(fid);
+    status = system(sprintf('python "%s" --fwhm %g --prefix s%s --filelist "%s"', fullfile(fileparts(mfilename('fullpath')), 'smooth_img.py'), smoothingkernel, int2str(smoothingkernel), listfile));
+    delete(listfile);
+    if status ~= 0
+        error('smooth_img.py failed, check the errors above.');
+    end
+else
+    run_jobs(smoothingbatchall, parallel_processing, matlabbatchall_infos, path);
+end
+if ~art_python
+    fprintf(1, '\n----------------\n=== RUN SPM.MAT GENERATION (FOR ART) ===\n\n');
+    run_jobs(artbatchall, parallel_processing, matlabbatchall_infos, path);
+end
 
 % ART must be done separately, it's not through SPM batch system
-if strcmp(motionRemovalTool,'art')
+% Tip: to run the jobs saved in the JOBS folder and ART in parallel (one working directory per MATLAB worker, which avoids the art_batch() config file conflict), see run_jobs_pool.py
+if strcmp(motionRemovalTool,'art') && art_python
+    fprintf(1, '\n--------------\n=== ART COMPOSITE MOTION OUTLIERS SCRUBBING (PYTHON) ===\n\n');
+    % Same input files as for art_batch() below (see get_prepfdata), all sessions of all conditions are processed in parallel in one call
+    if art_before_smoothing
+        artprefix = strcat(addprefix, 'wa');
+    else
+        artprefix = strcat(['s' int2str(smoothingkernel)], addprefix, 'wa');
+    end
+    status = system(sprintf('python "%s" -i "%s" --prefix %s', fullfile(fileparts(mfilename('fullpath')), 'art_outliers.py'), root_pth, artprefix));
+    if status ~= 0
+        error('art_outliers.py failed for some sessions, check the errors above.');
+    end
+elseif strcmp(motionRemovalTool,'art')
     fprintf(1, '\n--------------\n=== ART COMPOSITE MOTION OUTLIERS SCRUBBING ===\n\n');
     for c = 1:length(conditions)
         % Get the data structure for all subjects for this condition
@@ -884,6 +942,14 @@ if strcmp(motionRemovalTool,'art')
     end % end for conditions
 end % endif
 
+if lineage_record_python
+    % Fingerprint of the derivatives and hashes of the parameters and batch jobs of this run, in JOBS/lineage_state.json
+    status = system(sprintf('python "%s" -i "%s" --record', fullfile(fileparts(mfilename('fullpath')), 'lineage_plan.py'), root_pth));
+    if status ~= 0
+        error('lineage_plan.py failed to record the state of this run, check the error above.');
+    end
+end
+
 toc % show the time it took to compute everything
 fprintf('All jobs done! Restoring path and exiting...\n');
 path(bakpath); % restore the path to the previous state
@@ -972,6 +1038,23 @@ function [prepfdata] = get_prepfdata(data, isub, isess, imodal, script_mode, add
     end
 end
 
+function [slice_order, TR, nslices] = load_slice_order_sidecar(filepath)
+    % Load the slice order, TR and number of slices from a slice_order.json file generated by slice_order_batch.py (same outputs as autodetect_sliceorder.m)
+    if exist('jsondecode', 'builtin') || exist('jsondecode', 'file')
+        sidecar = jsondecode(fileread(filepath));
+    else
+        % MATLAB < R2016b, use jsonlab
+        addpath(fullfile(fileparts(mfilename('fullpath')), 'jsonlab'));
+        sidecar = loadjson(filepath);
+    end
+    slice_order = reshape(sidecar.slice_order, 1, []);
+    TR = sidecar.tr;
+    nslices = sidecar.nslices;
+    fprintf('Slice order loaded from %s (detected from %s): %s\n', filepath, sidecar.source, sidecar.slice_order_type_name);
+    fprintf('TR (in s): %g - nslices: %i\n', TR, nslices);
+    fprintf('Slice order detailed: %s\n', ['[' sprintf('%i, ', slice_order) ']']);
+end
+
 function dirNames = get_dirnames(filepath)
     % Get a list of all files and folders in this folder.
     files = dir(filepath);
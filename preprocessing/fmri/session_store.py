@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# session_store.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Chunked compressed store for 3D NIfTI sessions
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: packs the hundreds of 3D NIfTI files (.nii or .img/.hdr) of a functional session, and of each of its derivatives (a, wa, s8wa...), into one chunked and compressed store per series, with lazy slicing by time or space, and exports the files back exactly as they were for SPM.
+#
+# A store is a folder (<series>.nstore, eg wauf.nstore) in the zarr style: the voxel data of all volumes is one (t, z, y, x) array cut into chunks (by default 32 volumes x 16 x 32 x 32 voxels), each chunk compressed (zlib, or blosc if installed) in its own file under chunks/ (the chunks that are all zeros, such as outside of the brain, are not written), plus a store.json file with the shape, datatype, chunks and the list of the original files, and a headers.bin file with the original headers (including the NIfTI extensions, and the .hdr and .mat sidecar files). The voxel data is stored as it is on disk (same datatype and endianness, unscaled), so the store is lossless: --export writes back files identical to the original ones, byte for byte. 4D files can be packed too (their volumes are appended along t).
+#
+# The files of a folder are grouped into series by their name with all numbers replaced (eg, wauf0001.nii...wauf0300.nii and s8wauf0001.nii...s8wauf0300.nii are two series), and each series with at least --min-volumes volumes of the same dimensions and datatype is packed, the chunks being compressed in parallel threads (and the folders in parallel processes with --recursive). With --delete, the original files are deleted only after the store was read back and each file reconstructed from it was verified against the checksum of the original.
+#
+# From Python, SessionStore gives a lazy access that only reads and decompresses the chunks that are needed, eg to extract a voxel timeseries:
+#   from session_store import SessionStore
+#   store = SessionStore('/path/to/rest/wauf.nstore')
+#   ts = store.get((slice(None), z, y, x))   # timeseries of voxel (x, y, z), scaled to the real values (scl_slope/scl_inter)
+#   vol = store.volume(10)                   # 11th volume as a (x, y, z) array, as nibabel would load it
+#
+# Usage:
+#   python session_store.py -i /root_pth/COND/SUBJ/data/session1/rest                # pack all the series of a folder
+#   python session_store.py -i /root_pth --recursive --regex "^(wa|s8wa)" --delete -j 4
+#   python session_store.py -i /path/to/rest/wauf.nstore --export /path/to/rest       # write back the original files for SPM
+#   python session_store.py -i /path/to/rest/wauf.nstore --info
+#
+# Required libraries: numpy, nibabel. Optional: blosc (faster compression).
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import re
+import shlex
+import shutil
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import nibabel as nib
+import numpy as np
+
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Files of a store
+STORE_EXT = '.nstore'
+META_FILE = 'store.json'
+BLOBS_FILE = 'headers.bin'
+CHUNKS_DIR = 'chunks'
+# Default chunks shape (t, z, y, x)
+DEFAULT_CHUNKS = (32, 16, 32, 32)
+# Extensions of the images that can be packed (compressed .nii.gz files are not, since they could not be written back identically), and of their sidecar files
+IMAGE_EXTS = ('.nii', '.img')
+SIDECAR_EXTS = ('.hdr', '.mat')
+# Folders skipped when walking the data tree
+SKIP_DIRS = ['mprage', 'JOBS', '__MACOSX']
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def compress(raw, codec, level, typesize=1):
+    if codec == 'blosc':
+        return blosc.compress(raw, typesize=typesize, clevel=level)
+    return zlib.compress(raw, level)
+
+def decompress(buf, codec):
+    if codec == 'blosc':
+        if blosc is None:
+            raise ImportError('This store was compressed with blosc, please pip install blosc to read it.')
+        return blosc.decompress(buf)
+    return zlib.decompress(buf)
+
+def chunk_name(idx):
+    return '.'.join(str(i) for i in idx)
+
+def series_key(filename):
+    '''Key grouping the files of a series: the name with all numbers replaced (eg, wauf0001.nii -> wauf#.nii)'''
+    return re.sub(r'\d+', '#', filename)
+
+def series_name(filenames):
+    '''Name of a series (and of its store): the first filename without extension and without its trailing number'''
+    stem = os.path.splitext(filenames[0])[0]
+    return re.sub(r'[\d_\-.]+$', '', stem) or 'series'
+
+def find_series(dirpath, regex=None, min_volumes=2):
+    '''Group the images of a folder into series. Returns a dict {name: [paths]} of the series with at least min_volumes files.'''
+    groups = {}
+    for f in sorted(os.listdir(dirpath)):
+        if os.path.splitext(f)[1].lower() in IMAGE_EXTS and (regex is None or re.search(regex, f)):
+            groups.setdefault(series_key(f), []).append(f)
+    series = {}
+    for files in groups.values():
+        if len(files) < min_volumes:
+            continue
+        name = series_name(files)
+        while name in series: # different series with the same name, eg f#_#.nii and f#.nii
+            name += '_'
+        series[name] = [os.path.join(dirpath, f) for f in files]
+    return series
+
+def image_info(filepath):
+    '''Header infos of an image needed to read its raw voxel data: (data file path, data offset, dtype, (x, y, z) shape, number of frames, slope, inter)'''
+    img = nib.load(filepath)
+    shape = img.shape
+    if len(shape) < 3 or len(shape) > 4:
+        raise ValueError('%s: only 3D and 4D images can be packed, this one has shape %s' % (filepath, shape))
+    slope = float(getattr(img.dataobj, 'slope', 1.0))
+    inter = float(getattr(img.dataobj, 'inter', 0.0))
+    # The offset and datatype (with its endianness) of the file, from the array proxy since img.header is a normalized copy
+    return (img.file_map['image'].filename, int(img.dataobj.offset), np.dtype(img.dataobj.dtype), tuple(shape[:3]),
+            shape[3] if len(shape) == 4 else 1, slope if np.isfinite(slope) else 1.0, inter if np.isfinite(inter) else 0.0, img.affine)
+
+def sidecar_paths(datapath):
+    '''Sidecar files of an image (the .hdr of a pair, and the .mat written by SPM)'''
+    stem = os.path.splitext(datapath)[0]
+    return [(ext, stem + ext) for ext in SIDECAR_EXTS if os.path.exists(stem + ext)]
+
+
+class SessionStore(object):
+    '''Lazy access to a store: only the chunks needed by a slice are read and decompressed'''
+    def __init__(self, path, jobs=8):
+        self.path = fullpath(path)
+        with open(os.path.join(self.path, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.chunks = tuple(self.meta['chunks'])
+        self.codec = self.meta['codec']
+        self.files = self.meta['files']
+        self.affine = np.array(self.meta['affine'])
+        self.jobs = jobs
+        self.slopes = np.concatenate([[f['slope']] * f['frames'] for f in self.files])
+        self.inters = np.concatenate([[f['inter']] * f['frames'] for f in self.files])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk(self, idx):
+        '''Read one chunk (zeros if it was not written)'''
+        cshape = tuple(min(c, n - i * c) for i, c, n in zip(idx, self.chunks, self.shape))
+        path = os.path.join(self.path, CHUNKS_DIR, chunk_name(idx))
+        if not os.path.exists(path):
+            return np.zeros(cshape, dtype=self.dtype)
+        with open(path, 'rb') as f:
+            return np.frombuffer(decompress(f.read(), self.codec), dtype=self.dtype).reshape(cshape)
+
+    def _normalize(self, key):
+        '''Normalize an index (ints and slices with a positive step, up to 4 axes) into a list of (start, stop, step, isint)'''
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 4:
+            raise IndexError('too many indices for a (t, z, y, x) store')
+        key = key + (slice(None),) * (4 - len(key))
+        norm = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, (int, np.integer)):
+                k = int(k) + n if k < 0 else int(k)
+                if not 0 <= k < n:
+                    raise IndexError('index %i out of bounds for axis of size %i' % (k, n))
+                norm.append((k, k + 1, 1, True))
+            elif isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step < 1:
+                    raise IndexError('only positive steps are supported')
+                norm.append((start, max(start, stop), step, False))
+            else:
+                raise IndexError('only integers and slices are supported')
+        return norm
+
+    def _read(self, norm):
+        out = np.zeros(tuple(stop - start for start, stop, _, _ in norm), dtype=self.dtype)
+        if out.size:
+            ranges = [range(start // c, (stop - 1) // c + 1) for (start, stop, _, _), c in zip(norm, self.chunks)]
+            indices = list(itertools.product(*ranges))
+            if len(indices) > 4 and self.jobs > 1:
+                with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                    blocks = list(executor.map(self._chunk, indices))
+            else:
+                blocks = [self._chunk(idx) for idx in indices]
+            for idx, block in zip(indices, blocks):
+                dst, src = [], []
+                for i, c, (start, stop, _, _) in zip(idx, self.chunks, norm):
+                    lo, hi = max(start, i * c), min(stop, (i + 1) * c)
+                    dst.append(slice(lo - start, hi - start))
+                    src.append(slice(lo - i * c, hi - i * c))
+                out[tuple(dst)] = block[tuple(src)]
+        out = out[tuple(slice(None, None, step) for _, _, step, _ in norm)]
+        return out.reshape(tuple(n for n, (_, _, _, isint) in zip(out.shape, norm) if not isint))
+
+    def __getitem__(self, key):
+        '''Raw (unscaled) voxel values, indexed as (t, z, y, x)'''
+        return self._read(self._normalize(key))
+
+    def get(self, key, scaled=True):
+        '''Voxel values indexed as (t, z, y, x), scaled to the real values (scl_slope and scl_inter of each volume) by default'''
+        norm = self._normalize(key)
+        raw = self._read(norm)
+        if not scaled:
+            return raw
+        start, stop, step, isint = norm[0]
+        slopes, inters = self.slopes[start:stop:step], self.inters[start:stop:step]
+        if isint:
+            return raw * slopes[0] + inters[0]
+        shape = (-1,) + (1,) * (raw.ndim - 1)
+        return raw * slopes.reshape(shape) + inters.reshape(shape)
+
+    def volume(self, t, scaled=True):
+        '''One volume as a (x, y, z) array, as nibabel would load it'''
+        return self.get(t, scaled).transpose(2, 1, 0)
+
+    def blob(self, entry, name):
+        '''Read a blob (header, tail or sidecar file) of a packed file'''
+        if name not in entry['blobs']:
+            return None
+        offset, length = entry['blobs'][name]
+        with open(os.path.join(self.path, BLOBS_FILE), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def file_parts(self, entry):
+        '''Yield the successive bytes of the original data file of an entry: header, raw volumes, tail'''
+        yield self.blob(entry, 'prefix')
+        for t in range(entry['start'], entry['start'] + entry['frames']):
+            yield self[t].tobytes()
+        yield self.blob(entry, 'tail')
+
+    def export(self, outdir, regex=None):
+        '''Write back the original files (data files and sidecars) in outdir. Returns the list of written data files.'''
+        written = []
+        for entry in self.files:
+            if regex and not re.search(regex, entry['name']):
+                continue
+            outpath = os.path.join(outdir, entry['name'])
+            with open(outpath, 'wb') as f:
+                for part in self.file_parts(entry):
+                    f.write(part)
+            for ext in SIDECAR_EXTS:
+                data = self.blob(entry, ext)
+                if data is not None:
+                    with open(os.path.splitext(outpath)[0] + ext, 'wb') as f:
+                        f.write(data)
+            written.append(outpath)
+        return written
+
+    def verify(self):
+        '''Check that each original file reconstructed from the store matches the checksums recorded when packing. Returns the list of mismatching files.'''
+        bad = []
+        for entry in self.files:
+            hasher = hashlib.blake2b()
+            for part in self.file_parts(entry):
+                hasher.update(part)
+            ok = hasher.hexdigest() == entry['digests']['data']
+            for ext in SIDECAR_EXTS:
+                data = self.blob(entry, ext)
+                if data is not None:
+                    ok &= hashlib.blake2b(data).hexdigest() == entry['digests'][ext]
+            if not ok:
+                bad.append(entry['name'])
+        return bad
+
+
+def pack_series(files, storepath, chunks=DEFAULT_CHUNKS, codec='zlib', level=3, jobs=8):
+    '''Pack the images (3D or 4D, all with the same dimensions and datatype) into a store, streaming chunks of volumes. Returns the store path.'''
+    infos = [image_info(f) for f in files]
+    dtypes = set(i[2].str for i in infos)
+    shapes = set(i[3] for i in infos)
+    if len(dtypes) > 1 or len(shapes) > 1:
+        raise ValueError('the images do not all have the same datatype and dimensions (%s, %s), use --regex to select one series' % (sorted(dtypes), sorted(shapes)))
+    dtype, (nx, ny, nz) = infos[0][2], infos[0][3]
+    ntotal = sum(i[4] for i in infos)
+    shape = (ntotal, nz, ny, nx)
+    chunks = tuple(int(min(c, n)) for c, n in zip(chunks, shape))
+    volbytes = nx * ny * nz * dtype.itemsize
+
+    tmppath = storepath + '.part'
+    if os.path.exists(tmppath):
+        shutil.rmtree(tmppath)
+    os.makedirs(os.path.join(tmppath, CHUNKS_DIR))
+    entries = []
+    buf = np.zeros((chunks[0],) + shape[1:], dtype=dtype)
+    state = {'filled': 0, 'tchunk': 0}
+
+    def flush(executor):
+        '''Cut the buffered volumes into chunks, compress and write them (all-zeros chunks are skipped)'''
+        n = state['filled']
+        if n == 0:
+            return
+        def write_chunk(idx):
+            zs, ys, xs = [slice(i * c, (i + 1) * c) for i, c in zip(idx, chunks[1:])]
+            block = buf[:n, zs, ys, xs]
+            if block.any():
+                with open(os.path.join(tmppath, CHUNKS_DIR, chunk_name((state['tchunk'],) + idx)), 'wb') as f:
+                    f.write(compress(np.ascontiguousarray(block).tobytes(), codec, level, dtype.itemsize))
+        ranges = [range(-(-s // c)) for s, c in zip(shape[1:], chunks[1:])]
+        list(executor.map(write_chunk, itertools.product(*ranges)))
+        state['filled'] = 0
+        state['tchunk'] += 1
+
+    with open(os.path.join(tmppath, BLOBS_FILE), 'wb') as blobs, ThreadPoolExecutor(max_workers=jobs) as executor:
+        def add_blob(entry, name, data):
+            entry['blobs'][name] = [blobs.tell(), len(data)]
+            blobs.write(data)
+
+        t = 0
+        for filepath, (datapath, offset, _, _, nframes, slope, inter, _) in zip(files, infos):
+            entry = {'name': os.path.basename(datapath), 'start': t, 'frames': nframes, 'slope': slope, 'inter': inter, 'blobs': {}, 'digests': {}}
+            hasher = hashlib.blake2b()
+            with open(datapath, 'rb') as f:
+                prefix = f.read(offset)
+                hasher.update(prefix)
+                add_blob(entry, 'prefix', prefix)
+                for _ in range(nframes):
+                    raw = f.read(volbytes)
+                    if len(raw) != volbytes:
+                        raise ValueError('%s is truncated' % datapath)
+                    hasher.update(raw)
+                    buf[state['filled']] = np.frombuffer(raw, dtype=dtype).reshape(shape[1:])
+                    state['filled'] += 1
+                    t += 1
+                    if state['filled'] == chunks[0]:
+                        flush(executor)
+                tail = f.read()
+                hasher.update(tail)
+                add_blob(entry, 'tail', tail)
+            entry['digests']['data'] = hasher.hexdigest()
+            for ext, path in sidecar_paths(datapath):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                add_blob(entry, ext, data)
+                entry['digests'][ext] = hashlib.blake2b(data).hexdigest()
+            entries.append(entry)
+        flush(executor)
+
+    meta = {'format': 'nstore', 'version': 1, 'shape': list(shape), 'dtype': dtype.str, 'chunks': list(chunks), 'codec': codec, 'level': level,
+            'axes': ['t', 'z', 'y', 'x'], 'affine': infos[0][7].tolist(), 'files': entries}
+    with open(os.path.join(tmppath, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=1)
+    # The store only gets its final name once complete
+    if os.path.exists(storepath):
+        shutil.rmtree(storepath)
+    os.rename(tmppath, storepath)
+    return storepath
+
+def delete_originals(store):
+    '''Delete the original files (data files and sidecars) of a verified store'''
+    dirpath = os.path.dirname(store.path)
+    for entry in store.files:
+        datapath = os.path.join(dirpath, entry['name'])
+        for path in [datapath] + [p for _, p in sidecar_paths(datapath)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+def process_folder(args):
+    '''Pack all the series of a folder. Never raises, returns a list of (series, store path or None, message).'''
+    dirpath, regex, min_volumes, chunks, codec, level, delete, threads = args
+    results = []
+    try:
+        series = find_series(dirpath, regex, min_volumes)
+    except Exception as exc:
+        return [(dirpath, None, str(exc))]
+    for name, files in sorted(series.items()):
+        storepath = os.path.join(dirpath, name + STORE_EXT)
+        try:
+            pack_series(files, storepath, chunks, codec, level, threads)
+            store = SessionStore(storepath, threads)
+            packed = sum(os.path.getsize(f) for f in files)
+            stored = sum(os.path.getsize(os.path.join(root, f)) for root, _, fs in os.walk(storepath) for f in fs)
+            msg = '%i files, %i volumes, %.1f MB -> %.1f MB' % (len(files), store.shape[0], packed / 1e6, stored / 1e6)
+            if delete:
+                bad = store.verify()
+                if bad:
+                    raise ValueError('verification failed for %s, the original files were kept' % ', '.join(bad))
+                delete_originals(store)
+                msg += ', verified and original files deleted'
+            results.append((name, storepath, msg))
+        except Exception as exc:
+            results.append((name, None, str(exc)))
+    return results
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Chunked compressed store for 3D NIfTI sessions v%s
+Description: Pack the 3D NIfTI files of each series of a session into one chunked compressed store (lossless, with the original headers), with lazy slicing from Python, and export them back for SPM.
+    ''' % __version__
+    ep = '''Without --export nor --info, the input folders are packed.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, nargs='+', required=True,
+                        help='Folders to pack, or stores (.nstore folders) for --export and --info.')
+    main_parser.add_argument('-r', '--recursive', action='store_true', required=False, default=False,
+                        help='Pack all the subfolders of the input folders.')
+    main_parser.add_argument('--regex', metavar='"^wa"', type=str, required=False, default=None,
+                        help='Only pack the images whose filename matches this regex.')
+    main_parser.add_argument('--min-volumes', metavar='2', type=int, required=False, default=2,
+                        help='Minimum number of files of a series to pack it (default: 2, so single images such as the mean image are left as is).')
+    main_parser.add_argument('--chunks', metavar='N', type=int, nargs=4, required=False, default=list(DEFAULT_CHUNKS),
+                        help='Chunks shape as t z y x (default: %s).' % ' '.join(str(c) for c in DEFAULT_CHUNKS))
+    main_parser.add_argument('--codec', type=str, choices=['zlib', 'blosc'], required=False, default='zlib',
+                        help='Compression codec (default: zlib, blosc is faster but needs pip install blosc).')
+    main_parser.add_argument('--level', metavar='3', type=int, required=False, default=3,
+                        help='Compression level (default: 3).')
+    main_parser.add_argument('--delete', action='store_true', required=False, default=False,
+                        help='Delete the original files after packing, once each file reconstructed from the store was verified.')
+    main_parser.add_argument('--export', metavar='/some/path', type=str, required=False, default=None,
+                        help='Write back the original files of the input stores in this folder.')
+    main_parser.add_argument('--export-regex', metavar='"0001"', type=str, required=False, default=None,
+                        help='Only export the files whose name matches this regex.')
+    main_parser.add_argument('--info', action='store_true', required=False, default=False,
+                        help='Print the infos of the input stores.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=4,
+                        help='Number of folders packed in parallel processes (default: 4), each with 4 compression threads.')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpaths = [fullpath(p) for p in args.input]
+    for p in inputpaths:
+        if not os.path.isdir(p):
+            raise NameError('Specified input path does not exist: %s' % p)
+    if args.codec == 'blosc' and blosc is None:
+        main_parser.error('blosc is not installed, please pip install blosc or use --codec zlib')
+
+    #### Main program
+    if args.info or args.export:
+        for p in inputpaths:
+            store = SessionStore(p)
+            if args.info:
+                print('== %s: shape (t, z, y, x) %s, %s, chunks %s, %s, %i files (%s ... %s)' % (p, store.shape, store.dtype, store.chunks, store.codec, len(store.files), store.files[0]['name'], store.files[-1]['name']))
+            if args.export:
+                outdir = fullpath(args.export)
+                if not os.path.isdir(outdir):
+                    os.makedirs(outdir)
+                written = store.export(outdir, args.export_regex)
+                print('== %s: %i files exported to %s' % (p, len(written), outdir))
+        return 0
+
+    folders = []
+    for p in inputpaths:
+        if args.recursive:
+            for dirpath, dirnames, _ in os.walk(p):
+                dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS and not d.endswith(STORE_EXT) and not d.endswith(STORE_EXT + '.part'))
+                folders.append(dirpath)
+        else:
+            folders.append(p)
+    print('== Packing the series of %i folders...' % len(folders))
+    nerrors = nstores = 0
+    tasks = [(d, args.regex, args.min_volumes, tuple(args.chunks), args.codec, args.level, args.delete, 4) for d in folders]
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        for dirpath, results in zip(folders, executor.map(process_folder, tasks)):
+            for name, storepath, msg in results:
+                if storepath is None:
+                    nerrors += 1
+                    print('-> ERROR %s (%s): %s' % (dirpath, name, msg))
+                else:
+                    nstores += 1
+                    print('-> %s: %s' % (storepath, msg))
+    print('== Done, %i stores written, %i errors.' % (nstores, nerrors))
+    return 1 if nerrors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
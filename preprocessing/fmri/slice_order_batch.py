@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# slice_order_batch.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#     Batch slice order/timing autodetection
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: autodetect the slice order, slice timing, TR and number of slices of all functional sessions of a dataset at once, with the same decoding rules as autodetect_sliceorder.m, and save them in a slice_order.json file in each session's functional folder.
+# script_preproc_fmri_csg.m loads these files when they exist instead of calling autodetect_sliceorder.m (and thus SPM) for each session.
+#
+# For each functional folder (matching func_dir_regex, same as in script_preproc_fmri_csg.m), the most precise source available is used:
+#   1. a BIDS JSON sidecar with SliceTiming (and RepetitionTime),
+#   2. a Siemens DICOM with the MosaicRefAcqTimes (0019,1029) field or the same field in the CSA image header (needs pydicom),
+#   3. the NIfTI slice_code (types 1 to 6 of the nifti1.h convention), the slice timing is then only an approximation assuming a constant delay between slices.
+# Multiband acquisitions are detected from the slice timing (slices acquired at the same time, like gen_slice_order.m generates with multi > 0) or from the BIDS MultibandAccelerationFactor.
+#
+# Usage:
+#   python slice_order_batch.py -i /root_pth
+#   python slice_order_batch.py -i /root_pth --func-dir-regex "(rest|func)" --force -j 8
+#
+# Required libraries: numpy. Optional: pydicom to read DICOMs.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import json
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from header_cache import parse_header, read_header_bytes
+
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Name of the per-session output file
+SIDECAR_NAME = 'slice_order.json'
+
+# nifti slice order convention: http://nifti.nimh.nih.gov/pub/dist/src/niftilib/nifti1.h
+kNIFTI_SLICE_UNKNOWN = 0  # AUTO DETECT
+kNIFTI_SLICE_SEQ_INC = 1  # 1,2,3,4
+kNIFTI_SLICE_SEQ_DEC = 2  # 4,3,2,1
+kNIFTI_SLICE_ALT_INC = 3  # 1,3,2,4 Siemens: interleaved with odd number of slices, interleaved for other vendors
+kNIFTI_SLICE_ALT_DEC = 4  # 4,2,3,1 descending interleaved with odd number of slices (odd-last)
+kNIFTI_SLICE_ALT_INC2 = 5  # 2,4,1,3 Siemens interleaved with even number of slices
+kNIFTI_SLICE_ALT_DEC2 = 6  # 3,1,4,2 Siemens interleaved descending with even number of slices (even-last)
+kNIFTI_SLICE_CUSTOM = 99  # custom type (such as Philips central, reverse central, interleaved or for multi-band)
+
+SLICE_ORDER_TYPE_NAMES = {
+    0: 'type 0: unknown',
+    1: 'type 1: sequential ascending (1 2 3 4)',
+    2: 'type 2: sequential descending (4 3 2 1)',
+    3: 'type 3: interleaving ascending odd-first (1 3 2 4)',
+    4: 'type 4: interleaving descending odd-last (4 2 3 1)',
+    5: 'type 5: interleaving ascending even-first (2 4 1 3)',
+    6: 'type 6: interleaving descending even-last (3 1 4 2)',
+    99: 'type 99: custom type (see detailed slice_order)',
+    }
+
+IMAGE_EXTS = ('.nii', '.nii.gz', '.hdr')
+DICOM_EXTS = ('.dcm', '.ima')
+
+
+
+#***********************************
+#                       AUX
+#***********************************
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def find_func_dirs(inputpath, func_dir_regex):
+    '''Find recursively all folders whose name matches func_dir_regex and which contain files'''
+    regex = re.compile(func_dir_regex)
+    res = []
+    for dirpath, dirs, files in os.walk(inputpath):
+        dirs.sort()
+        if regex.search(os.path.basename(dirpath)) and files:
+            res.append(dirpath)
+    return res
+
+def slice_order_from_type(slice_order_type, nslices):
+    '''Generate the slice order (1-based slice numbers in acquisition order) from a nifti slice_code, as in autodetect_sliceorder.m'''
+    # Note: all slices are included in interleaved orders (autodetect_sliceorder.m uses 2:2:nslices-1 and 1:2:nslices-1, which drops the last slice when its parity matches)
+    odd = list(range(1, nslices+1, 2))
+    even = list(range(2, nslices+1, 2))
+    if slice_order_type == kNIFTI_SLICE_SEQ_INC:
+        return list(range(1, nslices+1))
+    elif slice_order_type == kNIFTI_SLICE_SEQ_DEC:
+        return list(range(nslices, 0, -1))
+    elif slice_order_type == kNIFTI_SLICE_ALT_INC:
+        return odd + even
+    elif slice_order_type == kNIFTI_SLICE_ALT_DEC:
+        return (odd + even)[::-1]
+    elif slice_order_type == kNIFTI_SLICE_ALT_INC2:
+        return even + odd
+    elif slice_order_type == kNIFTI_SLICE_ALT_DEC2:
+        return (even + odd)[::-1]
+    return []
+
+def slice_timing_from_order(slice_order, tr):
+    '''Approximate the slice timing (in seconds, per slice number) from a slice order, assuming a constant delay between slices, as in autodetect_sliceorder.m'''
+    rank = np.argsort(np.asarray(slice_order), kind='stable') + 1
+    return np.round((rank - 1) * (tr / rank.max()), 6).tolist()
+
+def slice_order_type_from_timing(slice_timing):
+    '''Get the slice order (1-based) and the nifti slice order type from a slice timing vector, as in autodetect_sliceorder.m'''
+    so = np.argsort(np.asarray(slice_timing, dtype=np.float64), kind='stable') + 1
+    if len(so) < 2:
+        return so.tolist(), kNIFTI_SLICE_UNKNOWN
+    sorted_asc = np.sort(so)
+    monotonic = np.all((so == sorted_asc) | (so == sorted_asc[::-1]))  # prevent mixup with Philips central or reverse central or interleaved modes
+    if so[0] + 1 == so[1] and so[0] == 1 and monotonic:
+        sotype = kNIFTI_SLICE_SEQ_INC
+    elif so[0] - 1 == so[1] and so[0] == so.max() and monotonic:
+        sotype = kNIFTI_SLICE_SEQ_DEC
+    elif so[0] + 2 == so[1]:
+        sotype = kNIFTI_SLICE_ALT_INC if so[0] % 2 else kNIFTI_SLICE_ALT_INC2  # odd-first or even-first
+    elif so[0] - 2 == so[1]:
+        sotype = kNIFTI_SLICE_ALT_DEC if so[-1] % 2 else kNIFTI_SLICE_ALT_DEC2  # odd-last or even-last
+    else:
+        # Custom type not covered by nifti conventions (such as Philips central, reverse central, interleaved or multi-band)
+        sotype = kNIFTI_SLICE_CUSTOM
+    return so.tolist(), sotype
+
+def detect_multiband(slice_timing, decimals=4):
+    '''Multiband factor = number of slices acquired at the same time (1 if not multiband). Slice times are rounded to avoid floating point noise from the scanner.'''
+    if not slice_timing:
+        return 1
+    times = np.round(np.asarray(slice_timing, dtype=np.float64), decimals)
+    _, counts = np.unique(times, return_counts=True)
+    # All time points should have the same number of slices, else this is not a regular multiband scheme
+    return int(counts.max()) if counts.min() == counts.max() else 1
+
+
+
+#***********************************
+#                    DECODERS
+#***********************************
+
+def decode_json(jsonpath):
+    '''Decode a BIDS JSON sidecar'''
+    with open(jsonpath, 'r') as f:
+        js = json.load(f)
+    if 'SliceTiming' not in js:
+        return None
+    slice_timing = [float(t) for t in js['SliceTiming']]
+    res = {'source': 'json', 'file': jsonpath, 'slice_timing': slice_timing, 'tr': float(js.get('RepetitionTime', 0)), 'nslices': len(slice_timing)}
+    if js.get('MultibandAccelerationFactor'):
+        res['multiband_factor'] = int(js['MultibandAccelerationFactor'])
+    return res
+
+def decode_dicom(dcmpath):
+    '''Decode a Siemens DICOM, from the MosaicRefAcqTimes field (0019,1029), or from the CSA image header if the field is absent'''
+    if pydicom is None:
+        raise ImportError('pydicom is required to read DICOMs, please pip install pydicom.')
+    ds = pydicom.dcmread(dcmpath, stop_before_pixels=True)
+    if str(getattr(ds, 'Manufacturer', '')).strip().upper() != 'SIEMENS':
+        raise ValueError('Autodetection of slice order from DICOMs is only supported for Siemens machines at the moment.')
+    slice_timing = None
+    if (0x0019, 0x1029) in ds:
+        value = ds[0x0019, 0x1029].value
+        if isinstance(value, bytes):
+            # Stored as raw bytes (packs of 8 bytes per double)
+            slice_timing = np.frombuffer(value, dtype='<f8').tolist()
+        else:
+            slice_timing = [float(v) for v in (value if hasattr(value, '__iter__') else [value])]
+    else:
+        from nibabel.nicom import csareader
+        csa = csareader.get_csa_header(ds, 'image')
+        if csa is not None and 'MosaicRefAcqTimes' in csa['tags']:
+            slice_timing = [float(v) for v in csa['tags']['MosaicRefAcqTimes']['items']]
+    if not slice_timing:
+        # The first volume of a series does not have the slice timing infos
+        return None
+    return {'source': 'dicom', 'file': dcmpath, 'slice_timing': slice_timing, 'tr': float(getattr(ds, 'RepetitionTime', 0) or 0), 'nslices': len(slice_timing)}
+
+def decode_nifti(impath):
+    '''Decode a NIfTI header (slice_code, TR and number of slices)'''
+    h = parse_header(read_header_bytes(impath))
+    nslices = h['nz']
+    tr = h['tr']
+    if tr == 0 and h['slice_duration'] > 0:
+        # some converters do not conserve the TR when splitting into 3D files, approximate it from the slice duration
+        tr = h['slice_duration'] * max(h['slice_start'], h['slice_end'])
+    slice_order = slice_order_from_type(h['slice_code'], nslices)
+    slice_timing = slice_timing_from_order(slice_order, tr) if slice_order and tr > 0 else []
+    return {'source': 'nifti', 'file': impath, 'slice_order': slice_order, 'slice_order_type': h['slice_code'] if slice_order else kNIFTI_SLICE_UNKNOWN,
+            'slice_timing': slice_timing, 'tr': tr, 'nslices': nslices}
+
+def detect_session(dirpath):
+    '''Autodetect the slice order of a functional folder, using the most precise source available (JSON > DICOM > NIfTI). Return a dict, with an 'error' key if nothing could be detected.'''
+    names = sorted(os.listdir(dirpath))
+    jsons = [n for n in names if n.lower().endswith('.json') and n != SIDECAR_NAME]
+    dicoms = [n for n in names if n.lower().endswith(DICOM_EXTS)]
+    images = [n for n in names if n.lower().endswith(IMAGE_EXTS)]
+    res = None
+    errors = []
+    for candidates, decoder in ((jsons, decode_json), (dicoms[1:2] or dicoms[:1], decode_dicom), (images[:1], decode_nifti)):  # for DICOMs, use the second volume, the first one has no slice timing
+        for name in candidates:
+            try:
+                res = decoder(os.path.join(dirpath, name))
+            except Exception as exc:
+                errors.append('%s: %s' % (name, exc))
+                res = None
+            if res is not None and (res.get('slice_timing') or res.get('slice_order')):
+                break
+            res = None
+        if res is not None:
+            break
+    if res is None:
+        return {'dir': dirpath, 'error': ' | '.join(errors) or 'No JSON, DICOM or NIfTI file with slice infos found.'}
+
+    # Some scanners store the TR and the slice timing in ms instead of s
+    if res['tr'] > 100.0:
+        res['tr'] /= 1000.0
+    if res['slice_timing'] and max(res['slice_timing']) > 100.0:
+        res['slice_timing'] = [t / 1000.0 for t in res['slice_timing']]
+    if 'slice_order' not in res:
+        res['slice_order'], res['slice_order_type'] = slice_order_type_from_timing(res['slice_timing'])
+    if 'multiband_factor' not in res:
+        res['multiband_factor'] = detect_multiband(res['slice_timing'])
+    res['slice_order_type_name'] = SLICE_ORDER_TYPE_NAMES.get(res['slice_order_type'], 'Unhandled bug!')
+    res['dir'] = dirpath
+    return res
+
+def process_session(args):
+    '''Worker: detect and write the sidecar of one functional folder. args = (dirpath, force).'''
+    dirpath, force = args
+    outpath = os.path.join(dirpath, SIDECAR_NAME)
+    if not force and os.path.exists(outpath):
+        return {'dir': dirpath, 'skipped': True}
+    res = detect_session(dirpath)
+    if 'error' not in res:
+        out = {k: res[k] for k in ('slice_order', 'slice_timing', 'tr', 'nslices', 'slice_order_type', 'slice_order_type_name', 'multiband_factor', 'source', 'file')}
+        out['file'] = os.path.basename(out['file'])
+        out['generator'] = 'slice_order_batch.py v%s' % __version__
+        with open(outpath, 'w') as f:
+            json.dump(out, f, indent=2)
+    return res
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Batch slice order/timing autodetection v%s
+Description: Autodetect slice order, slice timing, TR and number of slices for all functional folders of a dataset (from BIDS JSON, Siemens DICOM or NIfTI headers), and save them as %s in each folder, to be used by script_preproc_fmri_csg.m.
+    ''' % (__version__, SIDECAR_NAME)
+    ep = '''Note: detection from NIfTI files can be wrong (anonymization or converters may drop the infos), and the slice timing is then only an approximation. Always check the results against your MRI sequence printout.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, required=True,
+                        help='Path to the root of the dataset (root_pth).')
+    main_parser.add_argument('--func-dir-regex', metavar='regex', type=str, required=False, default='(rest|func|task|tennis|navigation)',
+                        help='Regular expression matching the functional folders names (same as func_dir_regex in script_preproc_fmri_csg.m).')
+    main_parser.add_argument('-f', '--force', action='store_true', required=False, default=False,
+                        help='Detect again and overwrite existing %s files.' % SIDECAR_NAME)
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show the detected parameters of each session).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    inputpath = fullpath(args.input)
+
+    if not os.path.isdir(inputpath):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+
+    #### Main program
+    dirs = find_func_dirs(inputpath, args.func_dir_regex)
+    print('== Found %i functional folders in %s' % (len(dirs), inputpath))
+    nerrors = nskipped = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for res in executor.map(process_session, [(d, args.force) for d in dirs]):
+            if res.get('skipped'):
+                nskipped += 1
+            elif 'error' in res:
+                nerrors += 1
+                print('ERROR: %s: %s' % (res['dir'], res['error']), file=sys.stderr)
+            elif args.verbose:
+                print('-> %s (from %s)' % (res['dir'], res['source']))
+                print('   Slice order type: %s - multiband factor: %i' % (res['slice_order_type_name'], res['multiband_factor']))
+                print('   TR (in s): %g - nslices: %i' % (res['tr'], res['nslices']))
+                print('   Slice order detailed: %s' % res['slice_order'])
+                print('   Slice timing (in s): %s' % res['slice_timing'])
+    print('== Done: %i sessions detected, %i already done (use --force to redo), %i errors.' % (len(dirs) - nerrors - nskipped, nskipped, nerrors))
+    return 1 if nerrors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
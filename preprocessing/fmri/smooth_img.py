@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# smooth_img.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Parallel Gaussian smoothing of images
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: smooths images with a Gaussian kernel of a given FWHM in mm, same as spm_smooth (used by the smoothing jobs of script_preproc_fmri_csg.m) but without SPM, and all volumes of all images in parallel processes.
+#
+# As spm_smooth, the FWHM in mm is converted to voxels for each axis from the voxel sizes of the image, and the volume is convolved separably along each axis with a 1D kernel of +/- 6 sigmas, which is by default the same kernel as SPM (spm_smoothkern: a Gaussian convolved with a first degree B-spline, normalized to sum 1; use --kernel gaussian for a plain sampled Gaussian), with zeros outside of the image. Each volume is read from the memory-mapped input, convolved in float32 with scipy.ndimage.correlate1d, and written directly at its place in the preallocated output, so that the volumes (of 3D and 4D images) can be processed in parallel processes without loading whole 4D files in memory.
+#
+# As with spm_smooth (dtype = 0 in the batch), the output images are prefixed (s8 for a 8mm FWHM, as in script_preproc_fmri_csg.m) and keep the datatype and scaling of the input images (values are rounded and clipped for integer datatypes). Compressed .nii.gz inputs are written as uncompressed .nii files.
+#
+# To check the equivalence with SPM on your data, smooth one image with both and compare with --compare, eg:
+#   python smooth_img.py -i sample.nii --fwhm 8 --prefix py_ --compare s8sample.nii
+# which prints the differences of dimensions, orientation and values, and fails if they exceed 1 quantization step (or 1e-4 of the value range for float images).
+#
+# Usage:
+#   python smooth_img.py -i /path/to/session --regex "^wa" --fwhm 8 -j 8
+#   python smooth_img.py --filelist files.txt --fwhm 8 --prefix s8       # one image path per line, as generated by script_preproc_fmri_csg.m
+#
+# Required libraries: nibabel, scipy.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import math
+import os
+import re
+import shlex
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import correlate1d
+from scipy.special import erf
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Extensions of the images to smooth (.hdr files are opened through their .img)
+IMAGE_EXTS = ('.nii', '.nii.gz', '.img')
+# FWHM to Gaussian standard deviation
+FWHM_TO_SIGMA = 1.0 / math.sqrt(8 * math.log(2))
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def split_ext(filepath):
+    '''Split the filename and the image extension (handles .nii.gz)'''
+    if filepath.lower().endswith('.nii.gz'):
+        return filepath[:-7], filepath[-7:]
+    return os.path.splitext(filepath)
+
+def list_images(inputpaths, regex=None):
+    '''Expand the input paths (files or folders, not recursive) into a list of images, optionally filtering the filenames with a regex'''
+    images = []
+    for p in inputpaths:
+        p = fullpath(re.sub(r',\d+$', '', p.strip())) # remove the SPM frame number if any (eg, file.nii,1)
+        if os.path.isdir(p):
+            images.extend(os.path.join(p, f) for f in sorted(os.listdir(p)) if f.lower().endswith(IMAGE_EXTS) and (regex is None or re.search(regex, f)))
+        elif os.path.isfile(p):
+            images.append(p)
+        else:
+            raise NameError('Specified input path does not exist: %s' % p)
+    # Remove duplicates (such as the frames of an expanded 4D file) but keep the order
+    seen = set()
+    return [f for f in images if not (f in seen or seen.add(f))]
+
+def smoothkern(fwhm, x):
+    '''Gaussian kernel of the given FWHM (in voxels) convolved with a first degree B-spline, sampled at x, same as spm_smoothkern(fwhm, x, 1)'''
+    s = (fwhm * FWHM_TO_SIGMA) ** 2 + np.finfo(np.float64).eps
+    w1 = 0.5 * math.sqrt(2 / s)
+    w2 = -0.5 / s
+    w3 = math.sqrt(s / 2 / math.pi)
+    krn = 0.5 * (erf(w1 * (x + 1)) * (x + 1) + erf(w1 * (x - 1)) * (x - 1) - 2 * erf(w1 * x) * x) \
+          + w3 * (np.exp(w2 * (x + 1) ** 2) + np.exp(w2 * (x - 1) ** 2) - 2 * np.exp(w2 * x ** 2))
+    krn[krn < 0] = 0
+    return krn
+
+def kernels(fwhm, affine, kind='spm'):
+    '''1D kernels along each axis for a FWHM in mm (3 values), from the voxel sizes of the affine, as spm_smooth'''
+    vox = np.sqrt((affine[:3, :3] ** 2).sum(axis=0))
+    out = []
+    for f in np.asarray(fwhm, dtype=np.float64) / vox: # FWHM in voxels
+        if f <= 0:
+            out.append(np.ones(1, dtype=np.float32))
+            continue
+        half = int(math.floor(6 * f * FWHM_TO_SIGMA + 0.5)) # round as MATLAB (half away from zero)
+        x = np.arange(-half, half + 1, dtype=np.float64)
+        k = smoothkern(f, x) if kind == 'spm' else np.exp(-0.5 * (x / (f * FWHM_TO_SIGMA)) ** 2)
+        out.append((k / k.sum()).astype(np.float32))
+    return out
+
+def to_disk(values, dtype, slope, inter):
+    '''Convert values to their representation on disk with the given datatype and scaling (rounded and clipped for integer datatypes, NaNs set to 0), as spm_write_plane does'''
+    raw = (values - inter) / slope if (slope != 1.0 or inter != 0.0) else values
+    if dtype.kind in 'iu':
+        info = np.iinfo(dtype)
+        raw = np.nan_to_num(np.rint(raw), nan=0.0)
+        raw = np.clip(raw, info.min, info.max)
+    return raw.astype(dtype)
+
+def prepare_output(outpath, img, fwhm):
+    '''Write the header of the output image (copy of the input header, same datatype and scaling) and preallocate its data. Returns (header, offset of the data).'''
+    src_hdr = img.header
+    is_pair = split_ext(outpath)[1].lower() == '.img'
+    if isinstance(src_hdr, nib.Nifti1Header):
+        klass = src_hdr.__class__ if not is_pair else (nib.nifti2.Nifti2PairHeader if isinstance(src_hdr, nib.Nifti2Header) else nib.nifti1.Nifti1PairHeader)
+    else:
+        klass = nib.nifti1.Nifti1PairHeader if is_pair else nib.Nifti1Header
+    hdr = klass.from_header(src_hdr)
+    if hdr.endianness != src_hdr.endianness:
+        hdr = hdr.as_byteswapped(src_hdr.endianness)
+    qcode = int(src_hdr['qform_code']) if 'qform_code' in src_hdr and src_hdr['qform_code'] > 0 else 2
+    scode = int(src_hdr['sform_code']) if 'sform_code' in src_hdr and src_hdr['sform_code'] > 0 else 2
+    hdr.set_qform(img.affine, qcode)
+    hdr.set_sform(img.affine, scode)
+    hdr.set_slope_inter(float(getattr(img.dataobj, 'slope', 1.0)), float(getattr(img.dataobj, 'inter', 0.0)))
+    hdr['descrip'] = ('Conv(%.1f,%.1f,%.1f) - ' % tuple(fwhm) + hdr['descrip'].item().decode('latin-1'))[:79] # same description as spm_smooth
+    hdr['vox_offset'] = 0 # let the header compute the minimal offset (after extensions) for single files, and 0 for pairs
+    nbytes = int(np.prod(hdr.get_data_shape())) * hdr.get_data_dtype().itemsize
+    if is_pair:
+        with open(split_ext(outpath)[0] + '.hdr', 'wb') as f:
+            hdr.write_to(f)
+        offset = 0
+        with open(outpath, 'wb') as f:
+            f.truncate(nbytes)
+    else:
+        with open(outpath, 'wb') as f:
+            hdr.write_to(f)
+            offset = int(hdr['vox_offset'])
+            f.write(b'\x00' * (offset - f.tell()))
+            f.truncate(offset + nbytes)
+    return hdr, offset
+
+def smooth_volume(args):
+    '''Smooth one volume (frame of a 3D or 4D image) and write it at its place in the preallocated output. Returns (outpath, frame, error message or None).'''
+    inpath, outpath, offset, fwhm, kind, frame = args
+    try:
+        img = nib.load(inpath, mmap=True)
+        hdr = img.header
+        slope, inter = float(getattr(img.dataobj, 'slope', 1.0)), float(getattr(img.dataobj, 'inter', 0.0))
+        vol = np.asarray(img.dataobj[..., frame] if frame is not None else img.dataobj, dtype=np.float32)
+        vol = vol.reshape(img.shape[:3])
+        for axis, k in enumerate(kernels(fwhm, img.affine, kind)):
+            if k.size > 1:
+                vol = correlate1d(vol, k, axis=axis, output=np.float32, mode='constant', cval=0.0)
+        dtype = hdr.get_data_dtype()
+        volume_bytes = int(np.prod(img.shape[:3])) * dtype.itemsize
+        # Each process writes its own volume at its own offset, so no lock is needed
+        with open(outpath, 'r+b') as f:
+            f.seek(offset + (frame or 0) * volume_bytes)
+            f.write(to_disk(vol, dtype, slope, inter).tobytes(order='F'))
+        return outpath, frame, None
+    except Exception as exc:
+        return outpath, frame, str(exc)
+
+def output_path(inpath, prefix):
+    '''Path of the smoothed image: prefixed, in the same folder, and uncompressed'''
+    stem, ext = split_ext(inpath)
+    if ext.lower() == '.nii.gz':
+        ext = '.nii'
+    return os.path.join(os.path.dirname(stem), prefix + os.path.basename(stem) + ext)
+
+def smooth_images(images, fwhm, prefix='s8', kind='spm', jobs=None, verbose=False):
+    '''Smooth all the images with the given FWHM in mm (3 values), all volumes in parallel processes. Returns (list of output paths, list of errors).'''
+    tasks = []
+    outpaths = []
+    for inpath in images:
+        img = nib.load(inpath)
+        if len(img.shape) > 4:
+            raise ValueError('%s: images with more than 4 dimensions are not supported' % inpath)
+        outpath = output_path(inpath, prefix)
+        hdr, offset = prepare_output(outpath, img, fwhm)
+        frames = range(img.shape[3]) if len(img.shape) == 4 else [None]
+        tasks.extend((inpath, outpath, offset, tuple(fwhm), kind, frame) for frame in frames)
+        outpaths.append(outpath)
+        if verbose:
+            print('-> %s: kernel sizes %s voxels' % (inpath, [len(k) for k in kernels(fwhm, img.affine, kind)]))
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for outpath, frame, error in executor.map(smooth_volume, tasks, chunksize=8):
+            if error:
+                errors.append('%s (frame %s): %s' % (outpath, frame, error))
+    return outpaths, errors
+
+def compare_images(outpath, refpath):
+    '''Compare a smoothed image with a reference (eg, the output of spm_smooth on the same image). Returns (ok, report lines).'''
+    out, ref = nib.load(outpath), nib.load(refpath)
+    lines = []
+    if out.shape != ref.shape:
+        return False, ['dimensions differ: %s vs reference %s' % (out.shape, ref.shape)]
+    maxaff = np.abs(out.affine - ref.affine).max()
+    lines.append('max affine difference: %g' % maxaff)
+    # Tolerance: 1 quantization step for integer images, else 1e-4 of the value range
+    if ref.get_data_dtype().kind in 'iu':
+        tol = float(getattr(ref.dataobj, 'slope', 1.0)) * 1.0001
+    else:
+        tol = None
+    maxdiff = meandiff = 0.0
+    nover = ntotal = 0
+    vmin, vmax = np.inf, -np.inf
+    frames = range(ref.shape[3]) if len(ref.shape) == 4 else [None]
+    for frame in frames:
+        sl = (Ellipsis,) if frame is None else (Ellipsis, frame)
+        a = np.asarray(out.dataobj[sl], dtype=np.float64)
+        b = np.asarray(ref.dataobj[sl], dtype=np.float64)
+        vmin, vmax = min(vmin, np.nanmin(b)), max(vmax, np.nanmax(b))
+        diff = np.abs(np.nan_to_num(a) - np.nan_to_num(b))
+        maxdiff = max(maxdiff, diff.max())
+        meandiff += diff.sum()
+        ntotal += diff.size
+        if tol is not None:
+            nover += int((diff > tol).sum())
+    if tol is None:
+        tol = 1e-4 * max(vmax - vmin, np.finfo(np.float64).eps)
+    lines.append('max value difference: %g (tolerance %g), mean: %g, value range of reference: [%g, %g]' % (maxdiff, tol, meandiff / ntotal, vmin, vmax))
+    if nover:
+        lines.append('%i/%i voxels differ by more than the tolerance' % (nover, ntotal))
+    return maxaff < 1e-3 and maxdiff <= tol, lines
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Parallel Gaussian smoothing v%s
+Description: Smooth images with a Gaussian kernel of a given FWHM in mm like spm_smooth, but without SPM and all volumes in parallel processes.
+    ''' % __version__
+    ep = '''The outputs keep the datatype and scaling of the inputs, as spm_smooth with dtype = 0.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/some/path', type=str, nargs='+', required=False, default=[],
+                        help='Images or folders of images (not recursive) to smooth.')
+    main_parser.add_argument('--filelist', metavar='files.txt', type=str, required=False, default=None,
+                        help='Text file with one image path per line (SPM frame numbers such as ,1 are ignored).')
+    main_parser.add_argument('--regex', metavar='"^wa"', type=str, required=False, default=None,
+                        help='Only smooth the images of the input folders whose filename matches this regex.')
+    main_parser.add_argument('-f', '--fwhm', metavar='8', type=float, nargs='+', required=False, default=[8.0],
+                        help='FWHM of the Gaussian kernel in mm, 1 value (isotropic) or 3 values (default: 8).')
+    main_parser.add_argument('-p', '--prefix', metavar='s8', type=str, required=False, default=None,
+                        help='Prefix of the smoothed images (default: s followed by the FWHM, eg s8).')
+    main_parser.add_argument('-k', '--kernel', type=str, choices=['spm', 'gaussian'], required=False, default='spm',
+                        help='spm (default): same kernel as spm_smooth (Gaussian convolved with a linear B-spline), gaussian: plain sampled Gaussian.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=None,
+                        help='Number of parallel processes (default: number of CPUs).')
+    main_parser.add_argument('--compare', metavar='s8sample.nii', type=str, required=False, default=None,
+                        help='Compare the output (only one input image) with this reference image smoothed by SPM.')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Verbose mode (show more output).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    if len(args.fwhm) not in (1, 3):
+        main_parser.error('--fwhm needs 1 or 3 values')
+    fwhm = args.fwhm * 3 if len(args.fwhm) == 1 else args.fwhm
+    prefix = args.prefix if args.prefix is not None else 's%g' % fwhm[0]
+
+    inputpaths = list(args.input)
+    if args.filelist:
+        with open(args.filelist, 'r') as f:
+            inputpaths.extend(line for line in f if line.strip())
+    if not inputpaths:
+        main_parser.error('no input image, use -i or --filelist')
+
+    #### Main program
+    images = list_images(inputpaths, args.regex)
+    images = [f for f in images if not os.path.basename(f).startswith(prefix)] # do not smooth the outputs of a previous run
+    if args.compare and len(images) != 1:
+        main_parser.error('--compare needs exactly one input image')
+    print('== Smoothing %i images with a %s mm FWHM kernel...' % (len(images), 'x'.join('%g' % f for f in fwhm)))
+    outpaths, errors = smooth_images(images, fwhm, prefix, args.kernel, args.jobs, args.verbose)
+    for error in errors:
+        print('-> ERROR %s' % error)
+    if errors:
+        return 1
+    print('== Done, %i images smoothed.' % len(outpaths))
+
+    if args.compare:
+        ok, lines = compare_images(outpaths[0], fullpath(args.compare))
+        print('== Comparison with %s:' % args.compare)
+        for line in lines:
+            print('-> %s' % line)
+        print('== %s' % ('EQUIVALENT' if ok else 'DIFFERENT'))
+        return 0 if ok else 1
+    return 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# checksum_manifest.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Incremental checksum manifest of raw data
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: records the checksums of all the raw files (NIfTI, Analyze, DICOM) of a dataset in a manifest, and verifies them before and after a pipeline run (script_preproc_fmri_csg.m, vbm_script_preproc_csg.m or the DWI scripts), to detect the raw files that were silently modified (eg, SPM writes its outputs next to the raw inputs, and reorientation edits the headers in place), deleted or added.
+#
+# The files are hashed with BLAKE2b in parallel threads, reading large blocks (hashlib releases the GIL, so the threads hash in parallel while others wait for the disk). The manifest (a CSV file with the path, size, modification time and hash of each file) is incremental: only the files whose size or modification time changed are hashed again, the others keep their recorded hash (use --full to hash everything again, eg to detect a corruption that did not change the size nor the mtime).
+#
+# The verification reports the files that are modified (different hash), touched (same hash but different modification time, eg a header rewritten identically), missing and new, as a summary and optionally as a CSV table (--report), and exits with code 1 if any recorded file was modified or is missing.
+#
+# Usage:
+#   python checksum_manifest.py -i /root_pth -m raw_manifest.csv --update     # before the run: create (or refresh) the manifest
+#   python checksum_manifest.py -i /root_pth -m raw_manifest.csv --report diff.csv   # after the run: verify
+#   python checksum_manifest.py -i /root_pth -m raw_manifest.csv --regex "\.(nii|img|hdr)$" --exclude "/mri/|/JOBS/" --update
+#
+# Required libraries: none (Python standard library only).
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import collections
+import csv
+import hashlib
+import os
+import re
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Default selection of the raw files: NIfTI, Analyze and DICOM (with or without extension, DICOM files are often named by their UID, eg 1.2.840.113619...)
+DEFAULT_REGEX = r'(?i)(\.(nii|nii\.gz|img|hdr|dcm|ima)|/[^./]+|/[\d.]+)$'
+# Size of the blocks read when hashing
+BLOCK_SIZE = 8 * 1024 * 1024
+# Columns of the manifest and of the report
+COLUMNS = ['path', 'size', 'mtime', 'blake2b']
+REPORT_COLUMNS = ['status', 'path', 'old_size', 'new_size', 'old_mtime', 'new_mtime', 'old_blake2b', 'new_blake2b']
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def hash_file(path):
+    '''BLAKE2b of a file, read by large blocks. Never raises, returns (hash or None, error message or None).'''
+    try:
+        hasher = hashlib.blake2b()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                hasher.update(block)
+        return hasher.hexdigest(), None
+    except (IOError, OSError) as exc:
+        return None, str(exc)
+
+def scan_files(root, regex=DEFAULT_REGEX, exclude=None, skip=()):
+    '''Find the files to checksum: a dict {relative path (with forward slashes): (size, mtime)}. The regex and exclude are matched against the relative path with a leading slash.'''
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        reldir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+        reldir = '' if reldir == '.' else reldir + '/'
+        for f in filenames:
+            relpath = reldir + f
+            if relpath in skip or not re.search(regex, '/' + relpath) or (exclude and re.search(exclude, '/' + relpath)):
+                continue
+            try:
+                st = os.stat(os.path.join(dirpath, f))
+            except OSError:
+                # file deleted in the meantime or broken symlink
+                continue
+            files[relpath] = (st.st_size, st.st_mtime)
+    return files
+
+def load_manifest(filepath):
+    '''Read a manifest as a dict {path: (size, mtime, hash)}'''
+    with open(filepath, 'r', newline='') as f:
+        return collections.OrderedDict((r['path'], (int(r['size']), float(r['mtime']), r['blake2b'])) for r in csv.DictReader(f))
+
+def write_csv(rows, columns, filepath):
+    '''Write the rows (dicts) as a CSV table, atomically'''
+    tmppath = filepath + '.tmp'
+    with open(tmppath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmppath, filepath)
+
+def update_hashes(root, files, manifest, full=False, jobs=8):
+    '''Hash the files that are new or whose size or modification time changed (or all with full), and reuse the hashes of the manifest for the others.
+    Returns ({path: (size, mtime, hash)}, list of the hashed files, list of (path, error)).'''
+    current = {}
+    todo = []
+    for relpath, (size, mtime) in files.items():
+        old = manifest.get(relpath)
+        if not full and old is not None and old[0] == size and old[1] == mtime:
+            current[relpath] = old
+        else:
+            todo.append(relpath)
+    errors = []
+    # Biggest files first, so that the threads finish together
+    todo.sort(key=lambda p: -files[p][0])
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for relpath, (digest, err) in zip(todo, executor.map(hash_file, [os.path.join(root, *p.split('/')) for p in todo])):
+            if err:
+                errors.append((relpath, err))
+            else:
+                current[relpath] = files[relpath] + (digest,)
+    return current, todo, errors
+
+def diff_manifests(old, new):
+    '''Compare a recorded manifest with the current state. Returns the report rows, sorted by status and path.'''
+    rows = []
+    def row(status, path, o, n):
+        o = o or ('', '', '')
+        n = n or ('', '', '')
+        return {'status': status, 'path': path, 'old_size': o[0], 'new_size': n[0], 'old_mtime': o[1], 'new_mtime': n[1], 'old_blake2b': o[2], 'new_blake2b': n[2]}
+    for path, o in old.items():
+        n = new.get(path)
+        if n is None:
+            rows.append(row('missing', path, o, None))
+        elif n[2] != o[2]:
+            rows.append(row('modified', path, o, n))
+        elif n[1] != o[1]:
+            rows.append(row('touched', path, o, n))
+    for path, n in new.items():
+        if path not in old:
+            rows.append(row('new', path, None, n))
+    order = {'modified': 0, 'missing': 1, 'new': 2, 'touched': 3}
+    return sorted(rows, key=lambda r: (order[r['status']], r['path']))
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Incremental checksum manifest of raw data v%s
+Description: Record the BLAKE2b checksums of the raw files of a dataset, and verify them (only the files whose size or mtime changed are hashed again) to report the modified, missing and new files around a pipeline run.
+    ''' % __version__
+    ep = '''Without --update, the files are verified against the manifest, which is left unchanged.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-i', '--input', metavar='/root_pth', type=str, required=True,
+                        help='Root folder of the dataset.')
+    main_parser.add_argument('-m', '--manifest', metavar='raw_manifest.csv', type=str, required=True,
+                        help='Manifest file (CSV).')
+    main_parser.add_argument('--update', action='store_true', required=False, default=False,
+                        help='Create or refresh the manifest with the current files, instead of verifying.')
+    main_parser.add_argument('--regex', metavar='regex', type=str, required=False, default=DEFAULT_REGEX,
+                        help='Regex of the relative paths (with a leading /) of the files to checksum (default: NIfTI, Analyze and DICOM files, including files without extension).')
+    main_parser.add_argument('--exclude', metavar='"/JOBS/"', type=str, required=False, default=None,
+                        help='Regex of the relative paths (with a leading /) of the files to skip.')
+    main_parser.add_argument('--full', action='store_true', required=False, default=False,
+                        help='Hash all files again, even those whose size and mtime did not change.')
+    main_parser.add_argument('--report', metavar='diff.csv', type=str, required=False, default=None,
+                        help='Save the differences as a CSV table (status, path, old and new size, mtime and hash).')
+    main_parser.add_argument('-j', '--jobs', metavar='8', type=int, required=False, default=8,
+                        help='Number of hashing threads (default: 8).')
+    main_parser.add_argument('-v', '--verbose', action='store_true', required=False, default=False,
+                        help='Print all the differences (else only the first ones of each kind).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    root = fullpath(args.input)
+    manifestpath = fullpath(args.manifest)
+    if not os.path.isdir(root):
+        raise NameError('Specified input path does not exist. Please check the specified path')
+    if not args.update and not os.path.exists(manifestpath):
+        main_parser.error('the manifest %s does not exist, create it first with --update' % manifestpath)
+
+    #### Main program
+    start = time.time()
+    manifest = load_manifest(manifestpath) if os.path.exists(manifestpath) else {}
+    # The manifest (and the report) may be stored inside the dataset
+    skip = set(os.path.relpath(p, root).replace(os.sep, '/') for p in (manifestpath, fullpath(args.report) if args.report else manifestpath))
+    files = scan_files(root, args.regex, args.exclude, skip)
+    current, hashed, errors = update_hashes(root, files, manifest, args.full, args.jobs)
+    print('== %i files found, %i hashed (%.1f GB) in %.1fs' % (len(files), len(hashed), sum(files[p][0] for p in hashed) / 1e9, time.time() - start))
+    for relpath, err in errors:
+        print('-> ERROR %s: %s' % (relpath, err))
+
+    if args.update:
+        write_csv([{'path': p, 'size': v[0], 'mtime': repr(v[1]), 'blake2b': v[2]} for p, v in sorted(current.items())], COLUMNS, manifestpath)
+        print('== Manifest of %i files saved in %s' % (len(current), manifestpath))
+        return 1 if errors else 0
+
+    rows = diff_manifests(manifest, current)
+    counts = collections.Counter(r['status'] for r in rows)
+    shown = collections.Counter()
+    for r in rows:
+        shown[r['status']] += 1
+        if args.verbose or shown[r['status']] <= 10:
+            print('   %-8s %s' % (r['status'], r['path']))
+        elif shown[r['status']] == 11:
+            print('   ... (%i more %s files, use -v or --report to see them all)' % (counts[r['status']] - 10, r['status']))
+    print('== %i recorded files: %i modified, %i missing, %i touched (same content), and %i new files' % (len(manifest), counts['modified'], counts['missing'], counts['touched'], counts['new']))
+    if args.report:
+        write_csv(rows, REPORT_COLUMNS, fullpath(args.report))
+        print('-> Report saved in %s' % fullpath(args.report))
+    return 1 if counts['modified'] or counts['missing'] or errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+# dataset_snapshot.py
+# Copyright (C) 2026 Larroque Stephen
+#
+# Licensed under the MIT License (MIT), see the LICENSE file at the root of this repository.
+#
+#=================================
+#        Deduplicating snapshot and incremental restore of a dataset
+#                        Python 3
+#              Coma Science Group
+#                     License: MIT
+#            Creation date: 2026-10-19
+#=================================
+#
+# Description: snapshots a dataset (eg, the manually reoriented dataset before preprocessing) into a deduplicated repository, and restores it incrementally, to replace the zip backup that is restored before re-running script_preproc_fmri_csg.m or vbm_script_preproc_csg.m after an error.
+#
+# Each file is cut into content-defined chunks (the cut points depend on the content, with a gear rolling hash over a window of 32 bytes, so an edit such as a reoriented header only changes the chunk it is in, and the next chunks stay the same), each chunk is stored once in the repository under the hash of its content, compressed with zlib. Identical chunks across files, subjects and snapshots are thus only stored once, and the files are chunked and compressed in parallel processes. A file whose size and modification time did not change since the previous snapshot of the same folder is not read again.
+#
+# The restore is incremental: only the files that are missing or differ from the snapshot (by size and modification time, or by content with --verify) are rewritten, and the files that are not in the snapshot (eg, the files generated by SPM) are deleted, so that re-running after an error takes minutes instead of a full unzip. The extra files are only deleted when restoring in place (in the snapshotted folder), or into another folder with --delete-extra (a restore into another non-empty folder is refused without --delete-extra or --keep-extra, so that an unrelated folder is not wiped), and they are kept if some files could not be restored.
+#
+# Usage:
+#   python dataset_snapshot.py -r /backup/repo -i /root_pth --name reoriented -j 8       # snapshot
+#   python dataset_snapshot.py -r /backup/repo --restore reoriented --dry-run            # show what would be restored and deleted
+#   python dataset_snapshot.py -r /backup/repo --restore reoriented -j 8                 # restore in place (in the snapshotted folder)
+#   python dataset_snapshot.py -r /backup/repo --list
+#   python dataset_snapshot.py -r /backup/repo --forget reoriented                       # delete a snapshot and its unused chunks
+#
+# Required libraries: numpy.
+#
+
+from __future__ import print_function
+
+__version__ = '0.1.0'
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shlex
+import stat
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    _str = basestring
+except NameError:
+    _str = str
+
+# Content-defined chunking: a cut is made after a byte when the top MASK_BITS bits of the gear hash of the last 32 bytes are zero, so chunks are on average MIN_CHUNK + 2**MASK_BITS bytes
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+MASK_BITS = 19
+WINDOW = 32
+# Random (but fixed) values of the gear hash for each byte value
+GEAR = np.random.RandomState(20261019).randint(0, 2**32, size=256, dtype=np.uint64).astype(np.uint32)
+# Size of the blocks read from the files
+BLOCK_SIZE = 16 * 1024 * 1024
+# Folders of the repository
+CHUNKS_DIR = 'chunks'
+SNAPSHOTS_DIR = 'snapshots'
+
+
+def fullpath(relpath):
+    '''Relative path to absolute'''
+    if (type(relpath) is object or hasattr(relpath, 'read')): # relpath is either an object or file-like, try to get its name
+        relpath = relpath.name
+    return os.path.abspath(os.path.expanduser(relpath))
+
+def gear_hashes(buf):
+    '''Gear hash of the last 32 bytes at each position of a buffer (uint8 array): sum of GEAR[byte] << age, computed by doubling the window instead of a loop over the bytes'''
+    h = GEAR[buf]
+    span = 1
+    while span < WINDOW:
+        # the right-hand side is computed before the in-place addition, so it uses the hashes of the previous window size
+        h[span:] += h[:-span] << np.uint32(span)
+        span *= 2
+    return h
+
+def cut_points(buf, final):
+    '''Ends of the chunks of a buffer starting at a chunk boundary. Without final, the bytes after the last cut are not cut (they are carried over to the next block).'''
+    ends = np.flatnonzero((gear_hashes(buf) >> np.uint32(32 - MASK_BITS)) == 0) + 1
+    n = len(buf)
+    cuts = []
+    start = 0
+    while True:
+        i = np.searchsorted(ends, start + MIN_CHUNK)
+        if i < len(ends) and ends[i] <= start + MAX_CHUNK:
+            cut = int(ends[i])
+        elif start + MAX_CHUNK <= n:
+            cut = start + MAX_CHUNK
+        else:
+            break
+        cuts.append(cut)
+        start = cut
+    if final and start < n:
+        cuts.append(n)
+    return cuts
+
+def chunk_path(repo, digest):
+    return os.path.join(repo, CHUNKS_DIR, digest[:2], digest)
+
+def store_chunk(repo, data, level):
+    '''Store a chunk under the hash of its content if it is not in the repository yet. Returns (hash, number of bytes written).'''
+    digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+    path = chunk_path(repo, digest)
+    if os.path.exists(path):
+        return digest, 0
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    packed = zlib.compress(data, level)
+    tmppath = '%s.%i.tmp' % (path, os.getpid())
+    with open(tmppath, 'wb') as f:
+        f.write(packed)
+    os.replace(tmppath, path)
+    return digest, len(packed)
+
+def load_chunk(repo, digest):
+    with open(chunk_path(repo, digest), 'rb') as f:
+        return zlib.decompress(f.read())
+
+def snapshot_file(args):
+    '''Chunk and store a file. Never raises, returns (relative path, entry or None, bytes written, error message or None).'''
+    repo, root, relpath, level = args
+    try:
+        path = os.path.join(root, relpath)
+        st = os.stat(path)
+        chunks = []
+        written = 0
+        hasher = hashlib.blake2b()
+        carry = b''
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                final = len(block) < BLOCK_SIZE
+                hasher.update(block)
+                buf = carry + block
+                start = 0
+                for end in cut_points(np.frombuffer(buf, dtype=np.uint8), final):
+                    digest, nbytes = store_chunk(repo, buf[start:end], level)
+                    chunks.append(digest)
+                    written += nbytes
+                    start = end
+                carry = buf[start:]
+                if final:
+                    break
+        entry = {'path': relpath, 'size': st.st_size, 'mtime': st.st_mtime, 'mode': stat.S_IMODE(st.st_mode), 'digest': hasher.hexdigest(), 'chunks': chunks}
+        return relpath, entry, written, None
+    except Exception as exc:
+        return relpath, None, 0, str(exc)
+
+def restore_file(args):
+    '''Rewrite a file from its chunks, atomically. Never raises, returns (relative path, error message or None).'''
+    repo, target, entry = args
+    tmppath = None
+    try:
+        path = os.path.join(target, *entry['path'].split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmppath = path + '.restore.tmp'
+        hasher = hashlib.blake2b()
+        with open(tmppath, 'wb') as f:
+            for digest in entry['chunks']:
+                data = load_chunk(repo, digest)
+                hasher.update(data)
+                f.write(data)
+        if hasher.hexdigest() != entry['digest']:
+            raise IOError('corrupted chunks in the repository, the content does not match the snapshot')
+        os.chmod(tmppath, entry['mode'])
+        os.replace(tmppath, path)
+        os.utime(path, (entry['mtime'], entry['mtime']))
+        return entry['path'], None
+    except Exception as exc:
+        # Do not leave incomplete files
+        if tmppath and os.path.exists(tmppath):
+            os.remove(tmppath)
+        return entry['path'], str(exc)
+
+def file_digest(path):
+    hasher = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def walk_files(root, exclude=None, skip=None):
+    '''Relative paths (with forward slashes) of all files and folders under root, except those matching the exclude regex and the skip folder (the repository if it is inside root)'''
+    files, dirs = [], []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if skip:
+            dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != skip]
+        reldir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+        reldir = '' if reldir == '.' else reldir + '/'
+        if exclude:
+            dirnames[:] = [d for d in dirnames if not re.search(exclude, reldir + d)]
+        dirnames.sort()
+        dirs.extend(reldir + d for d in dirnames)
+        files.extend(reldir + f for f in sorted(filenames) if not (exclude and re.search(exclude, reldir + f)))
+    return files, dirs
+
+def list_snapshots(repo):
+    '''Snapshots of a repository, oldest first'''
+    snapdir = os.path.join(repo, SNAPSHOTS_DIR)
+    snaps = []
+    if os.path.isdir(snapdir):
+        for f in os.listdir(snapdir):
+            if f.endswith('.json'):
+                with open(os.path.join(snapdir, f), 'r') as fh:
+                    snaps.append(json.load(fh))
+    return sorted(snaps, key=lambda s: s['time'])
+
+def load_snapshot(repo, name):
+    path = os.path.join(repo, SNAPSHOTS_DIR, name + '.json')
+    if not os.path.exists(path):
+        raise NameError('No snapshot named %s in %s, see --list' % (name, repo))
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def collect_garbage(repo):
+    '''Delete the chunks that are not used by any snapshot. Returns the number of deleted chunks.'''
+    used = set()
+    for snap in list_snapshots(repo):
+        for entry in snap['files']:
+            used.update(entry['chunks'])
+    deleted = 0
+    for dirpath, _, filenames in os.walk(os.path.join(repo, CHUNKS_DIR)):
+        for f in filenames:
+            if f not in used:
+                os.remove(os.path.join(dirpath, f))
+                deleted += 1
+    return deleted
+
+
+
+#***********************************
+#                       MAIN
+#***********************************
+
+def main(argv=None):
+    if argv is None: # if argv is empty, fetch from the commandline
+        argv = sys.argv[1:]
+    elif isinstance(argv, _str): # else if argv is supplied but it's a simple string, we need to parse it to a list of arguments before handing to argparse or any other argument parser
+        argv = shlex.split(argv) # Parse string just like argv using shlex
+
+    #==== COMMANDLINE PARSER ====
+
+    #== Commandline description
+    desc = '''Deduplicating dataset snapshot and incremental restore v%s
+Description: Snapshot a dataset into a repository of compressed content-defined chunks (deduplicated across files, subjects and snapshots), and restore it incrementally (only the changed files are rewritten, and the files not in the snapshot are deleted).
+    ''' % __version__
+    ep = '''Use --dry-run before a restore to check which files would be rewritten and deleted.'''
+
+    #== Commandline arguments
+    main_parser = argparse.ArgumentParser(add_help=True, description=desc, epilog=ep, formatter_class=argparse.RawTextHelpFormatter)
+    main_parser.add_argument('-r', '--repository', metavar='/backup/repo', type=str, required=True,
+                        help='Repository folder of the snapshots (created if needed).')
+    main_parser.add_argument('-i', '--input', metavar='/root_pth', type=str, required=False, default=None,
+                        help='Folder to snapshot.')
+    main_parser.add_argument('--name', metavar='reoriented', type=str, required=False, default=None,
+                        help='Name of the new snapshot (default: the date and time).')
+    main_parser.add_argument('--exclude', metavar='"^JOBS/"', type=str, required=False, default=None,
+                        help='Regex of the relative paths of the files and folders to skip (they are also kept as they are by a restore).')
+    main_parser.add_argument('--full', action='store_true', required=False, default=False,
+                        help='Read all files again, even those unchanged since the previous snapshot of the same folder.')
+    main_parser.add_argument('--level', metavar='1', type=int, required=False, default=1,
+                        help='zlib compression level of the chunks (default: 1, the fastest).')
+    main_parser.add_argument('--restore', metavar='reoriented', type=str, required=False, default=None,
+                        help='Restore this snapshot.')
+    main_parser.add_argument('-o', '--output', metavar='/some/path', type=str, required=False, default=None,
+                        help='Folder to restore into (default: the folder that was snapshotted).')
+    main_parser.add_argument('--verify', action='store_true', required=False, default=False,
+                        help='When restoring, compare the content of the files instead of their size and modification time.')
+    main_parser.add_argument('--keep-extra', action='store_true', required=False, default=False,
+                        help='When restoring, keep the files that are not in the snapshot instead of deleting them.')
+    main_parser.add_argument('--delete-extra', action='store_true', required=False, default=False,
+                        help='When restoring into another folder than the snapshotted one (-o), delete the files that are not in the snapshot (they are only deleted by default when restoring in place).')
+    main_parser.add_argument('--dry-run', action='store_true', required=False, default=False,
+                        help='Only show what a restore would do.')
+    main_parser.add_argument('--list', action='store_true', required=False, default=False,
+                        help='List the snapshots of the repository.')
+    main_parser.add_argument('--forget', metavar='reoriented', type=str, required=False, default=None,
+                        help='Delete a snapshot, and the chunks that are not used by the other snapshots.')
+    main_parser.add_argument('-j', '--jobs', metavar='N', type=int, required=False, default=4,
+                        help='Number of parallel processes (default: 4).')
+
+    #== Parsing the arguments
+    args = main_parser.parse_args(argv) # Storing all arguments to args
+    repo = fullpath(args.repository)
+    if sum(bool(x) for x in (args.input, args.restore, args.list, args.forget)) != 1:
+        main_parser.error('specify one of -i (snapshot), --restore, --list or --forget')
+    if args.keep_extra and args.delete_extra:
+        main_parser.error('--keep-extra and --delete-extra are mutually exclusive')
+
+    #### Main program
+    if args.list:
+        for snap in list_snapshots(repo):
+            print('%s  %s  %i files, %.1f GB  (%s)' % (snap['name'], snap['time'], len(snap['files']), sum(e['size'] for e in snap['files']) / 1e9, snap['root']))
+        return 0
+
+    if args.forget:
+        load_snapshot(repo, args.forget)
+        os.remove(os.path.join(repo, SNAPSHOTS_DIR, args.forget + '.json'))
+        print('== Snapshot %s deleted, %i unused chunks deleted' % (args.forget, collect_garbage(repo)))
+        return 0
+
+    if args.input:
+        root = fullpath(args.input)
+        if not os.path.isdir(root):
+            raise NameError('Specified input path does not exist. Please check the specified path')
+        name = args.name or time.strftime('%Y-%m-%d_%H-%M-%S')
+        if os.path.exists(os.path.join(repo, SNAPSHOTS_DIR, name + '.json')):
+            main_parser.error('a snapshot named %s already exists' % name)
+        for d in (CHUNKS_DIR, SNAPSHOTS_DIR):
+            if not os.path.isdir(os.path.join(repo, d)):
+                os.makedirs(os.path.join(repo, d))
+        files, dirs = walk_files(root, args.exclude, repo)
+        # Files unchanged since the previous snapshot of the same folder are not read again
+        previous = {}
+        if not args.full:
+            for snap in list_snapshots(repo):
+                if snap['root'] == root:
+                    previous = {e['path']: e for e in snap['files']}
+        entries, todo = {}, []
+        for relpath in files:
+            st = os.stat(os.path.join(root, relpath))
+            prev = previous.get(relpath)
+            if prev and prev['size'] == st.st_size and prev['mtime'] == st.st_mtime and all(os.path.exists(chunk_path(repo, c)) for c in prev['chunks']):
+                entries[relpath] = prev
+            else:
+                todo.append(relpath)
+        print('== Snapshot %s of %s: %i files, %i unchanged since the previous snapshot, %i to read...' % (name, root, len(files), len(entries), len(todo)))
+        start = time.time()
+        written = nbytes = 0
+        errors = []
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            for relpath, entry, w, err in executor.map(snapshot_file, [(repo, root, p, args.level) for p in todo], chunksize=4):
+                if err:
+                    errors.append(relpath)
+                    print('-> ERROR %s: %s' % (relpath, err))
+                    continue
+                entries[relpath] = entry
+                written += w
+                nbytes += entry['size']
+        if errors:
+            print('== %i files could not be read, the snapshot was not saved.' % len(errors))
+            return 1
+        snap = {'name': name, 'root': root, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'exclude': args.exclude,
+                'chunker': {'min': MIN_CHUNK, 'max': MAX_CHUNK, 'mask_bits': MASK_BITS, 'window': WINDOW},
+                'dirs': dirs, 'files': [entries[p] for p in files]}
+        snappath = os.path.join(repo, SNAPSHOTS_DIR, name + '.json')
+        with open(snappath + '.tmp', 'w') as f:
+            json.dump(snap, f)
+        os.replace(snappath + '.tmp', snappath)
+        print('== Done in %.1fs: %.1f GB read, %.1f GB of new chunks written. Restore with --restore %s' % (time.time() - start, nbytes / 1e9, written / 1e9, name))
+        return 0
+
+    # Restore
+    snap = load_snapshot(repo, args.restore)
+    target = fullpath(args.output) if args.output else snap['root']
+    inplace = (target == snap['root'])
+    # Another folder may contain unrelated data: it must be empty, unless the user explicitly chose what to do with its files
+    if not inplace and os.path.isdir(target) and os.listdir(target) and not (args.delete_extra or args.keep_extra):
+        main_parser.error('%s is not empty and is not the snapshotted folder (%s): use --delete-extra to delete the files that are not in the snapshot, or --keep-extra to keep them' % (target, snap['root']))
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    files, dirs = walk_files(target, snap.get('exclude'), repo)
+    current = set(files)
+    wanted = set(e['path'] for e in snap['files'])
+    torestore = []
+    for entry in snap['files']:
+        path = os.path.join(target, *entry['path'].split('/'))
+        if entry['path'] in current and os.path.getsize(path) == entry['size']:
+            if args.verify:
+                if file_digest(path) == entry['digest']:
+                    continue
+            elif os.path.getmtime(path) == entry['mtime']:
+                continue
+        torestore.append(entry)
+    delete = (inplace or args.delete_extra) and not args.keep_extra
+    extra = sorted(current - wanted) if delete else []
+    extradirs = sorted(set(dirs) - set(snap['dirs']), reverse=True) if delete else []
+    print('== Restore of %s into %s: %i files to rewrite, %i unchanged, %i extra files to delete' % (args.restore, target, len(torestore), len(snap['files']) - len(torestore), len(extra)))
+    if args.dry_run:
+        for entry in torestore:
+            print('   restore %s' % entry['path'])
+        for relpath in extra:
+            print('   delete  %s' % relpath)
+        return 0
+    errors = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        for relpath, err in executor.map(restore_file, [(repo, target, e) for e in torestore], chunksize=4):
+            if err:
+                errors += 1
+                print('-> ERROR %s: %s' % (relpath, err))
+    if errors and (extra or extradirs):
+        # The extra files may be the only copy of files that could not be restored (eg, renamed files)
+        print('== %i files could not be restored, the %i extra files are kept.' % (errors, len(extra)))
+        extra, extradirs = [], []
+    for relpath in extra:
+        os.remove(os.path.join(target, *relpath.split('/')))
+    for reldir in extradirs: # deepest first
+        path = os.path.join(target, *reldir.split('/'))
+        if os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+    for reldir in snap['dirs']:
+        path = os.path.join(target, *reldir.split('/'))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    print('== Done: %i files restored, %i extra files deleted, %i errors' % (len(torestore) - errors, len(extra), errors))
+    return 1 if errors else 0
+
+# Calling main function if the script is directly called (not imported as a library in another program)
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())